@@ -5,9 +5,10 @@ from sqlalchemy.orm import Session
 
 from app.models.template import Template
 from app.deps import get_db
+from app.publish import InvalidTemplateBundle, publish_template
 from app.schemas.template_detail import TemplateDetailSchema
 from app.settings import get_settings
-from app.util.setup_util import initialize_file_storage
+from app.util.setup_util import create_template_environment, initialize_file_storage
 
 app_cli = typer.Typer()
 settings = get_settings()
@@ -51,5 +52,26 @@ def refresh():
     typer.echo("Templates refreshed.")
 
 
+@app_cli.command()
+def publish(template_id: str, bundle: str):
+    """
+    Publish a template bundle, creating or updating the template. Every running Plato node is notified of the change.
+
+    Args:
+        template_id (str): The ID of the template to publish.
+        bundle (str): The path to the template bundle, a zip or tar archive.
+    """
+    file_storage = initialize_file_storage(settings.STORAGE_TYPE, settings.DATA_DIR, settings.BUCKET_NAME)
+    jinja_env = create_template_environment(settings.TEMPLATE_DIRECTORY)
+    with get_session() as db_session, open(bundle, mode="rb") as bundle_file:
+        try:
+            publish_template(template_id, bundle_file, file_storage, db_session, jinja_env,
+                             settings.TEMPLATE_DIRECTORY, settings.TEMPLATE_DIRECTORY_NAME)
+        except InvalidTemplateBundle as e:
+            typer.echo(f"Invalid template bundle: {e.message}", err=True)
+            raise typer.Exit(code=1)
+    typer.echo(f"Template {template_id} published.")
+
+
 if __name__ == "__main__":
     app_cli()
\ No newline at end of file
@@ -0,0 +1,109 @@
+import io
+import logging
+from concurrent.futures import Future
+from typing import List
+
+from jinja2 import Environment as JinjaEnv
+
+from app.compose.output_cache import OutputKey, output_cache
+from app.compose.render_pool import RenderPriorityEnum, render_pool
+from app.compose.renderer import Renderer, compose
+from app.models.template import Template
+from app.schemas.template_detail import MIMETypeEnum
+
+EXAMPLE_OUTPUT = "example"
+
+# PNG composition is currently unavailable through the API
+EXAMPLE_MIME_TYPES: List[str] = [mime_type for mime_type in Renderer.renderers
+                                 if mime_type != MIMETypeEnum.PNG_MIME.value]
+
+logger = logging.getLogger(__name__)
+
+
+def example_key(template: Template, mime_type: str, **kwargs) -> OutputKey:
+    """
+    Output cache key for a template's example composition. Includes the template version, so examples of
+    outdated versions of a template are never served.
+
+    Args:
+        template: The template
+        mime_type: The MIME type of the composition
+        kwargs: Additional options given to the renderer
+
+    Returns:
+        OutputKey: The output cache key
+    """
+    return EXAMPLE_OUTPUT, template.id, template.version, mime_type, tuple(sorted(kwargs.items()))
+
+
+def get_example(template: Template, mime_type: str, jinja_env: JinjaEnv, template_static_directory: str,
+                **kwargs) -> io.BytesIO:
+    """
+    Gets a template's example composition from the output cache, rendering and caching it if it wasn't
+    pre-rendered yet.
+
+    Args:
+        template: The template
+        mime_type: The desired output MIME type
+        jinja_env: The Jinja2 environment to be used for rendering the template
+        template_static_directory: The static directory for the template, used to load static files
+        kwargs: Additional keyword arguments to be given to the specific renderer
+
+    Returns:
+        io.BytesIO: The Byte stream for the composed example.
+    """
+    key = example_key(template, mime_type, **kwargs)
+    content = output_cache.get(key)
+    if content is None:
+        content = render_pool.run(_render_example, template, mime_type, jinja_env, template_static_directory,
+                                  **kwargs)
+        output_cache.put(key, content)
+    return io.BytesIO(content)
+
+
+def prerender_examples(template: Template, jinja_env: JinjaEnv, template_static_directory: str) -> Future:
+    """
+    Renders a template's example composition in every MIME type available through the API, in the background on
+    the render pool (behind any render requested by clients), and stores them in the output cache. Examples which fail to render are logged and skipped,
+    to be rendered again (and fail with the appropriate error) when requested.
+
+    Args:
+        template: The template, which is copied so it can be used after its session is closed
+        jinja_env: The Jinja2 environment to be used for rendering the template
+        template_static_directory: The static directory for the template, used to load static files
+
+    Returns:
+        Future: Completed once every example is stored
+    """
+    snapshot = Template(id_=template.id, schema=template.schema, type_=template.type, metadata=template.metadata_,
+                        example_composition=template.example_composition, tags=template.tags)
+    snapshot.version = template.version
+    return render_pool.submit(_prerender_examples, snapshot, jinja_env, template_static_directory,
+                              priority=RenderPriorityEnum.BACKGROUND)
+
+
+def discard_examples(template_id: str | None = None) -> None:
+    """
+    Removes the cached examples of a template, e.g. after its files changed.
+
+    Args:
+        template_id: The id of the template, or None to remove the examples of every template
+    """
+    output_cache.discard(lambda key: key[0] == EXAMPLE_OUTPUT and template_id in (None, key[1]))
+
+
+def _prerender_examples(template: Template, jinja_env: JinjaEnv, template_static_directory: str) -> None:
+    for mime_type in EXAMPLE_MIME_TYPES:
+        try:
+            content = _render_example(template, mime_type, jinja_env, template_static_directory)
+        except Exception:
+            logger.warning("Unable to pre-render the example of template '%s' as %s", template.id, mime_type,
+                           exc_info=True)
+            continue
+        output_cache.put(example_key(template, mime_type), content)
+
+
+def _render_example(template: Template, mime_type: str, jinja_env: JinjaEnv, template_static_directory: str,
+                    **kwargs) -> bytes:
+    return compose(template, template.example_composition, mime_type, jinja_env, template_static_directory,
+                   **kwargs).getvalue()
@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Set, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+from app.metrics import CACHE_REQUESTS
+from app.models.idempotency_key import IdempotencyKey
+from app.settings import get_settings
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# polling for the result of a running request starts this often, backing off up to the store's poll interval
+MIN_POLL_INTERVAL_SECONDS = 0.01
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyKeyReused(Exception):
+    """
+    Exception to be raised when an idempotency key is used again for a different request
+    """
+    ...
+
+
+class IdempotencyStore:
+    """
+    Results of the requests sent with an idempotency key, so retries of a request (e.g. after a client timeout)
+    get the result of the original render, waiting for it if it's still running, instead of rendering it again.
+
+    Keys are remembered for `window_seconds` after their request started. Requests are identified by a fingerprint of
+    everything their result depends on, so a key can't be used for a different request. Failed requests are
+    forgotten, so they can be retried. Completed results are evicted, oldest first, once they take more than
+    `max_bytes`.
+
+    Keys and results are stored in the idempotency_key table, so retries find them whichever process or node they
+    reach. The process running a request holds a lease on its key, renewed while it runs: if the process dies, a
+    retry takes the key over once the lease expired, and runs the request again.
+
+        Typical usage:
+
+            content, replayed = idempotency_store.run(idempotency_key, fingerprint, render)
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], window_seconds: float, max_bytes: int,
+                 lease_seconds: float, poll_interval: float):
+        self.session_factory = session_factory
+        self.window_seconds = window_seconds
+        self.max_bytes = max_bytes
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._running_keys: Set[str] = set()
+        self._lock = threading.Lock()
+        self._lease_renewer: threading.Thread | None = None
+
+    def run(self, key: str, fingerprint: str, function: Callable[[], bytes]) -> Tuple[bytes, bool]:
+        """
+        Runs a request with an idempotency key, unless a request with the same key is running or completed within
+        the window, in which case its result is returned.
+
+        Args:
+            key: The idempotency key
+            fingerprint: Identifies the request
+            function: Runs the request, returning its result
+
+        Raises:
+            IdempotencyKeyReused: When the key was used for a request with a different fingerprint
+
+        Returns:
+            Tuple[bytes, bool]: The result, and whether it's the result of an earlier request
+        """
+        interval = MIN_POLL_INTERVAL_SECONDS
+        while not self._claim(key, fingerprint):
+            with self.session_factory() as db:
+                row = db.execute(select(IdempotencyKey.fingerprint, IdempotencyKey.result)
+                                 .where(IdempotencyKey.key == key)).one_or_none()
+            # otherwise, the request failed or expired in the meantime, and the key can be claimed again
+            if row is not None:
+                if row.fingerprint != fingerprint:
+                    raise IdempotencyKeyReused(key)
+                if row.result is not None:
+                    CACHE_REQUESTS.inc(cache="idempotency", result="hit")
+                    return row.result, True
+                time.sleep(interval)
+                interval = min(interval * 2, self.poll_interval)
+        CACHE_REQUESTS.inc(cache="idempotency", result="miss")
+
+        with self._lock:
+            self._running_keys.add(key)
+            if self._lease_renewer is None or not self._lease_renewer.is_alive():
+                self._lease_renewer = threading.Thread(target=self._renew_leases, name="plato-idempotency-leases",
+                                                       daemon=True)
+                self._lease_renewer.start()
+        try:
+            content = function()
+        except BaseException:
+            self._forget(key)
+            raise
+        finally:
+            with self._lock:
+                self._running_keys.discard(key)
+
+        self._complete(key, content)
+        return content, False
+
+    def _claim(self, key: str, fingerprint: str) -> bool:
+        """
+        Claims a key for a request, unless it's used by a request completed within the window, or still running
+        under a lease.
+        """
+        now = func.clock_timestamp()
+        lease = now + timedelta(seconds=self.lease_seconds)
+        with self.session_factory() as db:
+            db.execute(delete(IdempotencyKey)
+                       .where(IdempotencyKey.created_at < now - timedelta(seconds=self.window_seconds)))
+            claimed = db.execute(
+                insert(IdempotencyKey)
+                .values(key=key, fingerprint=fingerprint, locked_until=lease)
+                .on_conflict_do_update(index_elements=[IdempotencyKey.key], set_={"locked_until": lease},
+                                       where=(IdempotencyKey.fingerprint == fingerprint)
+                                       & IdempotencyKey.result.is_(None) & (IdempotencyKey.locked_until < now))
+                .returning(IdempotencyKey.key)
+            ).one_or_none()
+            db.commit()
+        return claimed is not None
+
+    def _renew_leases(self) -> None:
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock:
+                keys = list(self._running_keys)
+            if not keys:
+                continue
+            try:
+                with self.session_factory() as db:
+                    db.execute(update(IdempotencyKey)
+                               .where(IdempotencyKey.key.in_(keys), IdempotencyKey.result.is_(None))
+                               .values(locked_until=func.clock_timestamp() + timedelta(seconds=self.lease_seconds)))
+                    db.commit()
+            except Exception:
+                logger.exception("Failed to renew the leases of idempotency keys")
+
+    def _complete(self, key: str, content: bytes) -> None:
+        with self.session_factory() as db:
+            db.execute(update(IdempotencyKey)
+                       .where(IdempotencyKey.key == key, IdempotencyKey.result.is_(None))
+                       .values(result=content, locked_until=None))
+            # evicts the oldest results, once the newer ones take up the whole budget
+            newest_first = (select(IdempotencyKey.key,
+                                   func.sum(func.length(IdempotencyKey.result))
+                                   .over(order_by=IdempotencyKey.created_at.desc()).label("retained_bytes"))
+                            .where(IdempotencyKey.result.is_not(None))
+                            .subquery())
+            db.execute(delete(IdempotencyKey)
+                       .where(IdempotencyKey.key.in_(select(newest_first.c.key)
+                                                     .where(newest_first.c.retained_bytes > self.max_bytes))))
+            db.commit()
+
+    def _forget(self, key: str) -> None:
+        with self.session_factory() as db:
+            db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.result.is_(None)))
+            db.commit()
+
+
+idempotency_store = IdempotencyStore(SessionLocal, get_settings().IDEMPOTENCY_WINDOW_SECONDS,
+                                     get_settings().IDEMPOTENCY_MAX_BYTES, get_settings().IDEMPOTENCY_LEASE_SECONDS,
+                                     get_settings().IDEMPOTENCY_POLL_INTERVAL)
@@ -0,0 +1,406 @@
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import timedelta
+from enum import Enum
+from typing import Callable, Mapping
+
+from jsonschema import ValidationError
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.compose.limits import PageLimitExceeded
+from app.compose.render_pool import RenderPriorityEnum
+from app.compose.renderer import InvalidPageNumber, RendererNotFound
+from app.db.session import SessionLocal
+from app.metrics import RENDER_JOBS
+from app.models.render_job import RenderJob
+from app.settings import get_settings
+
+# polling for a job's result starts this often, backing off up to the queue's poll interval
+MIN_POLL_INTERVAL_SECONDS = 0.01
+
+
+class JobQueueType(str, Enum):
+    POSTGRES = "postgres"
+
+
+class InvalidJobQueueTypeException(Exception):
+    """
+    Exception raised when attempting to initialize the job queue with an invalid type
+    """
+    def __init__(self, type_: str):
+        """
+        Constructor method
+        """
+        super(InvalidJobQueueTypeException, self).__init__(type_)
+
+
+class RenderJobFailed(Exception):
+    """
+    Exception to be raised when a render job failed on a worker for a reason the API can't report more precisely
+    """
+    message: str
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(message)
+
+
+class RenderJobTimeout(Exception):
+    """
+    Exception to be raised when a render job isn't done within the queue's timeout
+    """
+    ...
+
+
+@dataclass
+class QueuedJob:
+    """
+    A render job, as claimed by a worker
+    """
+    id: str
+    template_id: str
+    mime_type: str
+    compose_data: dict
+    options: dict
+    priority: RenderPriorityEnum
+    attempts: int
+
+
+@dataclass
+class JobResult:
+    """
+    The outcome of a finished render job: either its content, or the error it failed with (see `job_error`)
+    """
+    content: bytes | None = None
+    error: dict | None = None
+
+
+def job_error(error: BaseException) -> dict:
+    """
+    Describes the error a render failed with, so the API can raise the matching exception (see `raise_job_error`).
+
+    Args:
+        error: The error
+
+    Returns:
+        dict: The error's type and message, along with what's needed to raise it again
+    """
+    if isinstance(error, ValidationError):
+        return {"type": "validation", "message": error.message}
+    if isinstance(error, PageLimitExceeded):
+        return {"type": "page_limit", "message": str(error), "max_pages": error.max_pages}
+    if isinstance(error, InvalidPageNumber):
+        return {"type": "invalid_page", "message": error.message}
+    if isinstance(error, RendererNotFound):
+        return {"type": "renderer_not_found", "message": str(error)}
+    if isinstance(error, MemoryError):
+        return {"type": "memory", "message": str(error)}
+    return {"type": "error", "message": f"{type(error).__name__}: {error}"}
+
+
+def raise_job_error(error: Mapping) -> None:
+    """
+    Raises the error a render job failed with, as it was raised on the worker whenever the API handles it.
+
+    Args:
+        error: The error, as described by `job_error`
+
+    Raises:
+        jsonschema.exceptions.ValidationError: When the compose data wasn't valid for the template
+        PageLimitExceeded: When the document had more pages than allowed
+        InvalidPageNumber: When the requested page didn't exist
+        RendererNotFound: When there was no renderer for the requested MIME type
+        MemoryError: When the render needed more memory than allowed
+        RenderJobFailed: For any other error
+    """
+    error_type = error.get("type")
+    if error_type == "validation":
+        raise ValidationError(error["message"])
+    if error_type == "page_limit":
+        raise PageLimitExceeded(error["max_pages"])
+    if error_type == "invalid_page":
+        raise InvalidPageNumber(error["message"])
+    if error_type == "renderer_not_found":
+        raise RendererNotFound(error["message"])
+    if error_type == "memory":
+        raise MemoryError(error["message"])
+    raise RenderJobFailed(error.get("message", "The render job failed"))
+
+
+class JobQueue(ABC):
+    """
+    Queue of the render jobs sent by the API to a farm of render workers (see app.worker), and of their results.
+
+    Jobs are claimed by workers for `lease_seconds`, and workers renew the lease while they render a job: a job whose
+    lease expired (e.g. because its worker crashed) is claimed again by another worker, until it was attempted
+    `max_attempts` times and fails.
+
+        Typical usage:
+
+            # API
+            pdf = job_queue.run(template_id, compose_data, "application/pdf", options, RenderPriorityEnum.BULK)
+
+            # worker
+            job = job_queue.claim(worker_id)
+            job_queue.complete(job.id, content)
+    """
+
+    def __init__(self, timeout_seconds: float, lease_seconds: float, max_attempts: int, poll_interval: float):
+        self.timeout_seconds = timeout_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+
+    @abstractmethod
+    def enqueue(self, template_id: str, compose_data: Mapping, mime_type: str, options: Mapping,
+                priority: RenderPriorityEnum) -> str:
+        """
+        Queues a render job.
+
+        Returns:
+            str: The id of the job
+        """
+        ...
+
+    @abstractmethod
+    def claim(self, worker_id: str) -> QueuedJob | None:
+        """
+        Claims the next job for a worker: the oldest job of the highest priority class, or a job whose lease expired.
+
+        Returns:
+            QueuedJob | None: The claimed job, or None if there's nothing to run
+        """
+        ...
+
+    @abstractmethod
+    def renew(self, job_id: str, worker_id: str) -> bool:
+        """
+        Extends the lease of a job claimed by a worker for another `lease_seconds`.
+
+        Returns:
+            bool: Whether the job is still leased by the worker, False if it was finished, discarded or claimed again
+        """
+        ...
+
+    @abstractmethod
+    def complete(self, job_id: str, content: bytes) -> None:
+        """
+        Stores the result of a job. Ignored if the job was finished or discarded in the meantime.
+        """
+        ...
+
+    @abstractmethod
+    def fail(self, job_id: str, error: Mapping) -> None:
+        """
+        Stores the error a job failed with (see `job_error`). Ignored if the job was finished or discarded in the
+        meantime.
+        """
+        ...
+
+    @abstractmethod
+    def result(self, job_id: str) -> JobResult | None:
+        """
+        Gets the outcome of a job.
+
+        Returns:
+            JobResult | None: The outcome of the job, or None if it isn't finished
+        """
+        ...
+
+    @abstractmethod
+    def discard(self, job_id: str) -> None:
+        """
+        Forgets a job, whether it's finished or not.
+        """
+        ...
+
+    @abstractmethod
+    def purge(self, older_than_seconds: float) -> int:
+        """
+        Forgets the jobs finished for longer than the given time, whose results were never collected.
+
+        Returns:
+            int: The number of forgotten jobs
+        """
+        ...
+
+    def run(self, template_id: str, compose_data: Mapping, mime_type: str, options: Mapping,
+            priority: RenderPriorityEnum = RenderPriorityEnum.INTERACTIVE) -> bytes:
+        """
+        Queues a render job and waits for a worker to run it, polling for its result.
+
+        Raises:
+            RenderJobTimeout: When the job isn't done within `timeout_seconds`
+            Exception: The error the render failed with (see `raise_job_error`)
+
+        Returns:
+            bytes: The composed file
+        """
+        job_id = self.enqueue(template_id, compose_data, mime_type, options, priority)
+        RENDER_JOBS.inc(outcome="queued")
+        try:
+            job_result = self._wait(job_id)
+        finally:
+            self.discard(job_id)
+
+        if job_result.error is not None:
+            RENDER_JOBS.inc(outcome="failed")
+            raise_job_error(job_result.error)
+        RENDER_JOBS.inc(outcome="done")
+        return job_result.content
+
+    def _wait(self, job_id: str) -> JobResult:
+        deadline = time.monotonic() + self.timeout_seconds
+        interval = MIN_POLL_INTERVAL_SECONDS
+        while True:
+            job_result = self.result(job_id)
+            if job_result is not None:
+                return job_result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                RENDER_JOBS.inc(outcome="timeout")
+                raise RenderJobTimeout(job_id)
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.poll_interval)
+
+
+class PostgresJobQueue(JobQueue):
+    """
+    Job queue stored in the render_job table, so it needs nothing beyond Plato's database. Workers claim jobs with
+    `SELECT ... FOR UPDATE SKIP LOCKED`, so concurrent workers never wait for each other nor claim the same job.
+    Results are stored in the job's row until the API collects them.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session_factory = session_factory
+
+    def enqueue(self, template_id: str, compose_data: Mapping, mime_type: str, options: Mapping,
+                priority: RenderPriorityEnum) -> str:
+        job_id = uuid.uuid4().hex
+        with self.session_factory() as db:
+            db.add(RenderJob(id=job_id, template_id=template_id, compose_data=compose_data, mime_type=mime_type,
+                             options=dict(options), priority=list(RenderPriorityEnum).index(priority)))
+            db.commit()
+        return job_id
+
+    def claim(self, worker_id: str) -> QueuedJob | None:
+        with self.session_factory() as db:
+            self._release_expired(db)
+            next_job = (select(RenderJob.id)
+                        .where(RenderJob.status == "queued")
+                        .order_by(RenderJob.priority, RenderJob.created_at)
+                        .limit(1)
+                        .with_for_update(skip_locked=True)
+                        .scalar_subquery())
+            row = db.execute(
+                update(RenderJob)
+                .where(RenderJob.id == next_job)
+                .values(status="running", attempts=RenderJob.attempts + 1, worker_id=worker_id,
+                        locked_until=func.clock_timestamp() + timedelta(seconds=self.lease_seconds))
+                .returning(RenderJob.id, RenderJob.template_id, RenderJob.mime_type, RenderJob.compose_data,
+                           RenderJob.options, RenderJob.priority, RenderJob.attempts)
+            ).one_or_none()
+            db.commit()
+
+        if row is None:
+            return None
+        job_id, template_id, mime_type, compose_data, options, priority, attempts = row
+        return QueuedJob(job_id, template_id, mime_type, compose_data, options, list(RenderPriorityEnum)[priority],
+                         attempts)
+
+    def _release_expired(self, db: Session) -> None:
+        """
+        Queues the running jobs whose lease expired again, or fails them once they were attempted too many times.
+        """
+        expired = (select(RenderJob.id)
+                   .where(RenderJob.status == "running", RenderJob.locked_until < func.clock_timestamp())
+                   .with_for_update(skip_locked=True))
+        db.execute(update(RenderJob)
+                   .where(RenderJob.id.in_(expired), RenderJob.attempts < self.max_attempts)
+                   .values(status="queued", worker_id=None, locked_until=None))
+        db.execute(update(RenderJob)
+                   .where(RenderJob.id.in_(expired))
+                   .values(status="failed", locked_until=None, finished_at=func.clock_timestamp(),
+                           error=job_error(RenderJobFailed(f"The render job was abandoned by its worker "
+                                                           f"{self.max_attempts} times"))))
+
+    def renew(self, job_id: str, worker_id: str) -> bool:
+        with self.session_factory() as db:
+            renewed = db.execute(
+                update(RenderJob)
+                .where(RenderJob.id == job_id, RenderJob.status == "running", RenderJob.worker_id == worker_id)
+                .values(locked_until=func.clock_timestamp() + timedelta(seconds=self.lease_seconds))
+            ).rowcount
+            db.commit()
+        return renewed == 1
+
+    def complete(self, job_id: str, content: bytes) -> None:
+        self._finish(job_id, status="done", result=content)
+
+    def fail(self, job_id: str, error: Mapping) -> None:
+        self._finish(job_id, status="failed", error=dict(error))
+
+    def _finish(self, job_id: str, **values) -> None:
+        with self.session_factory() as db:
+            db.execute(update(RenderJob)
+                       .where(RenderJob.id == job_id, RenderJob.status == "running")
+                       .values(locked_until=None, finished_at=func.clock_timestamp(), **values))
+            db.commit()
+
+    def result(self, job_id: str) -> JobResult | None:
+        with self.session_factory() as db:
+            row = db.execute(select(RenderJob.status, RenderJob.result, RenderJob.error)
+                             .where(RenderJob.id == job_id)).one_or_none()
+        if row is None:
+            return JobResult(error=job_error(RenderJobFailed("The render job was discarded")))
+
+        status, content, error = row
+        if status == "done":
+            return JobResult(content=content)
+        if status == "failed":
+            return JobResult(error=error)
+        return None
+
+    def discard(self, job_id: str) -> None:
+        with self.session_factory() as db:
+            db.execute(delete(RenderJob).where(RenderJob.id == job_id))
+            db.commit()
+
+    def purge(self, older_than_seconds: float) -> int:
+        with self.session_factory() as db:
+            purged = db.execute(
+                delete(RenderJob)
+                .where(or_(RenderJob.status == "done", RenderJob.status == "failed"),
+                       RenderJob.finished_at < func.clock_timestamp() - timedelta(seconds=older_than_seconds))
+            ).rowcount
+            db.commit()
+        return purged
+
+
+def create_job_queue(queue_type: str, session_factory: Callable[[], Session]) -> JobQueue:
+    """
+    Initializes the job queue of the given type, with the timeouts from the settings.
+
+    Args:
+        queue_type: The type of job queue, currently only 'postgres'
+        session_factory: Creates database sessions, for queues stored in the database
+
+    Raises:
+        InvalidJobQueueTypeException: If the given job queue type doesn't exist
+
+    Returns:
+        JobQueue: The job queue
+    """
+    settings = get_settings()
+    options = dict(timeout_seconds=settings.RENDER_JOB_TIMEOUT_SECONDS, lease_seconds=settings.RENDER_JOB_LEASE_SECONDS,
+                   max_attempts=settings.RENDER_JOB_MAX_ATTEMPTS, poll_interval=settings.RENDER_JOB_POLL_INTERVAL)
+    if queue_type == JobQueueType.POSTGRES:
+        return PostgresJobQueue(session_factory, **options)
+    raise InvalidJobQueueTypeException(queue_type)
+
+
+job_queue = create_job_queue(get_settings().RENDER_JOB_QUEUE, SessionLocal)
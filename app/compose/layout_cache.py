@@ -0,0 +1,140 @@
+import hashlib
+import json
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Hashable, Iterator, Mapping, Tuple
+
+from app.metrics import CACHE_REQUESTS
+from app.models.template import Template
+from app.settings import get_settings
+
+LayoutKey = Tuple[Hashable, ...]
+
+
+def layout_key(template: Template, compose_data: Mapping, layout_options: Mapping) -> LayoutKey:
+    """
+    Layout cache key for a composition. Includes the template version, so layouts of outdated versions of a template
+    are never served, and a digest of the compose data rather than the data itself.
+
+    Args:
+        template: The template
+        compose_data: The data the template is filled with
+        layout_options: The options given to WeasyPrint's layout
+
+    Returns:
+        LayoutKey: The layout cache key
+    """
+    digest = hashlib.sha256(json.dumps(compose_data, sort_keys=True, default=str).encode()).hexdigest()
+    return template.id, template.version, digest, tuple(sorted(layout_options.items()))
+
+
+class LayoutCache:
+    """
+    In-memory cache of laid out WeasyPrint documents, so several outputs of the same composition (e.g. its page count,
+    then each of its pages as PNG) only lay it out once. Keys start with the template id (see `layout_key`).
+
+    The memory held by a laid out document grows with its number of pages, so the cache holds at most `max_pages`
+    pages, evicting documents in least recently used order, and documents of more than `max_document_pages` pages
+    aren't cached at all, as they would evict most others while rarely being written more than once.
+
+    Writing a document as a PDF adds the fonts it embeds to it, so cached documents, shared between renders, must only
+    be written within `writing` (or copied first, like PNG pages are).
+
+        Typical usage:
+
+            document = layout_cache.get(key)
+            if document is None:
+                document = HTML(string=html_string).render()
+                layout_cache.put(key, document)
+            with layout_cache.writing(document):
+                pdf = document.write_pdf()
+    """
+
+    def __init__(self, max_pages: int, max_document_pages: int):
+        self.max_pages = max_pages
+        self.max_document_pages = min(max_document_pages, max_pages)
+        self._documents: OrderedDict[LayoutKey, Tuple[Any, int]] = OrderedDict()
+        self._write_locks: weakref.WeakKeyDictionary[Any, threading.Lock] = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.pages = 0
+        """
+        Number of pages of the cached documents
+        """
+
+    def get(self, key: LayoutKey) -> Any | None:
+        """
+        Gets a cached layout.
+
+        Args:
+            key: The key of the layout
+
+        Returns:
+            weasyprint.Document | None: The laid out document, or None if it isn't cached
+        """
+        with self._lock:
+            document, _ = self._documents.get(key, (None, 0))
+            if document is not None:
+                self._documents.move_to_end(key)
+        CACHE_REQUESTS.inc(cache="layout", result="miss" if document is None else "hit")
+        return document
+
+    def put(self, key: LayoutKey, document: Any) -> None:
+        """
+        Caches a layout, replacing any layout previously cached with the same key. Documents of more than
+        `max_document_pages` pages aren't cached.
+
+        Args:
+            key: The key of the layout
+            document: The laid out document
+        """
+        pages = len(document.pages)
+        if pages > self.max_document_pages or self.max_pages <= 0:
+            return
+        with self._lock:
+            self._remove(key)
+            self._documents[key] = document, pages
+            self._write_locks.setdefault(document, threading.Lock())
+            self.pages += pages
+            while self.pages > self.max_pages:
+                self._remove(next(iter(self._documents)))
+
+    @contextmanager
+    def writing(self, document: Any) -> Iterator[None]:
+        """
+        Waits until no other render is writing the document, if it was cached, then holds it until the context exits.
+
+        Args:
+            document: The laid out document about to be written
+        """
+        with self._lock:
+            write_lock = self._write_locks.get(document)
+        if write_lock is None:
+            yield
+            return
+        with write_lock:
+            yield
+
+    def discard(self, template_id: str | None = None) -> None:
+        """
+        Removes the cached layouts of a template, e.g. after its files changed.
+
+        Args:
+            template_id: The id of the template, or None to remove every layout
+        """
+        with self._lock:
+            for key in [key for key in self._documents if template_id in (None, key[0])]:
+                self._remove(key)
+
+    def _remove(self, key: LayoutKey) -> None:
+        # the write lock stays with the document for as long as it's referenced, e.g. by a render still writing it
+        _, pages = self._documents.pop(key, (None, 0))
+        self.pages -= pages
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+
+settings = get_settings()
+layout_cache = LayoutCache(settings.LAYOUT_CACHE_MAX_PAGES, settings.LAYOUT_CACHE_MAX_DOCUMENT_PAGES)
@@ -0,0 +1,173 @@
+import json
+import logging
+import resource
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+LAYOUT_PAGE_MESSAGE = "Step 5 - Creating layout - Page"
+"""
+Start of the messages WeasyPrint logs on its progress logger for every page it lays out
+"""
+
+_max_pages: ContextVar[int | None] = ContextVar("max_pages", default=None)
+
+
+class PayloadTooDeep(Exception):
+    """
+    Raised when a payload is nested deeper than allowed
+    """
+
+    def __init__(self, max_depth: int):
+        self.max_depth = max_depth
+        super().__init__(f"The payload is nested deeper than {max_depth} levels")
+
+
+class PageLimitExceeded(Exception):
+    """
+    Raised during layout, as soon as a document has more pages than allowed
+    """
+
+    def __init__(self, max_pages: int):
+        self.max_pages = max_pages
+        super().__init__(f"The document has more than {max_pages} pages")
+
+
+def check_depth(value: Any, max_depth: int) -> None:
+    """
+    Checks that a parsed JSON value isn't nested deeper than `max_depth` objects and arrays, iteratively, so
+    the check itself can't run out of stack.
+
+    Args:
+        value: The JSON value
+        max_depth: The maximum depth
+
+    Raises:
+        PayloadTooDeep: When the value is nested deeper than `max_depth`
+    """
+    pending = [(value, 1)]
+    while pending:
+        current, depth = pending.pop()
+        if isinstance(current, dict):
+            children = current.values()
+        elif isinstance(current, list):
+            children = current
+        else:
+            continue
+        if depth > max_depth:
+            raise PayloadTooDeep(max_depth)
+        pending.extend((child, depth + 1) for child in children)
+
+
+def parse_payload(body: bytes, max_depth: int) -> Any:
+    """
+    Parses a JSON payload, checking its depth.
+
+    Args:
+        body: The JSON document
+        max_depth: The maximum depth of the document
+
+    Raises:
+        ValueError: When the body isn't valid JSON
+        PayloadTooDeep: When the document is nested deeper than `max_depth`
+
+    Returns:
+        The parsed document
+    """
+    try:
+        value = json.loads(body)
+    except RecursionError as e:
+        # nested deeper than the parser itself supports
+        raise PayloadTooDeep(max_depth) from e
+    check_depth(value, max_depth)
+    return value
+
+
+@contextmanager
+def page_limit(max_pages: int) -> Iterator[None]:
+    """
+    Aborts WeasyPrint layouts run in this context with PageLimitExceeded as soon as they reach `max_pages` + 1 pages,
+    before the remaining pages are laid out.
+
+    Args:
+        max_pages: The maximum number of pages, or 0 for no limit
+    """
+    if max_pages:
+        _layout_page_limit.enable()
+    token = _max_pages.set(max_pages or None)
+    try:
+        yield
+    finally:
+        _max_pages.reset(token)
+
+
+class _LayoutPageLimit(logging.Filter):
+    """
+    Filter of WeasyPrint's progress logger, which follows the layout of every page to enforce page limits. The logger
+    must handle the page records for that, so it's made to log them if its level was less verbose than INFO: records
+    are then only emitted if they pass the level the logger was configured with.
+    """
+
+    def __init__(self, progress_logger: logging.Logger):
+        super().__init__()
+        self.progress_logger = progress_logger
+        self.level = logging.NOTSET
+        """
+        Level the logger was configured with
+        """
+        self._overridden = False
+
+    def enable(self) -> None:
+        """
+        Makes the logger handle the page records, unless it already does, e.g. as it was configured more verbosely.
+        """
+        level = self.progress_logger.level
+        if self._overridden and level == logging.INFO:
+            return
+        self.level = level
+        self._overridden = level == logging.NOTSET or level > logging.INFO
+        if self._overridden:
+            self.progress_logger.setLevel(logging.INFO)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        max_pages = _max_pages.get()
+        if max_pages is not None and str(record.msg).startswith(LAYOUT_PAGE_MESSAGE) and record.args \
+                and record.args[0] > max_pages:
+            raise PageLimitExceeded(max_pages)
+        # without a configured level, the logger would have inherited its parent's
+        return record.levelno >= (self.level or self.progress_logger.parent.getEffectiveLevel())
+
+
+_layout_page_limit = _LayoutPageLimit(logging.getLogger("weasyprint.progress"))
+_layout_page_limit.progress_logger.addFilter(_layout_page_limit)
+_layout_page_limit.enable()
+
+
+def process_data_bytes() -> int | None:
+    """
+    Size of this process' data segment (private writable memory, as limited by RLIMIT_DATA), or None where /proc
+    isn't available.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmData:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def limit_process_memory(max_bytes: int) -> None:
+    """
+    Limits the data segment of this process, so allocations beyond it fail with a MemoryError instead of the
+    process being killed by the OOM killer. The limit applies to the whole process: the MemoryError is raised in
+    whichever thread allocates beyond it, not necessarily in the one which used most of the memory.
+
+    Args:
+        max_bytes: The limit
+    """
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard_limit != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard_limit)
+    resource.setrlimit(resource.RLIMIT_DATA, (max_bytes, hard_limit))
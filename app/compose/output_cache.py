@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Tuple
+
+from app.metrics import CACHE_REQUESTS
+from app.settings import get_settings
+
+OutputKey = Tuple[Hashable, ...]
+
+
+class OutputCache:
+    """
+    In-memory cache of composed outputs, for compositions whose result only changes when their template does
+    (e.g. example compositions). Keys are tuples, by convention starting with the kind of output and the template id.
+    Entries are evicted in least recently used order once the cache holds more than `max_bytes`.
+
+        Typical usage:
+
+            content = output_cache.get(key)
+            if content is None:
+                content = render()
+                output_cache.put(key, content)
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._contents: OrderedDict[OutputKey, bytes] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: OutputKey) -> bytes | None:
+        """
+        Gets a cached output.
+
+        Args:
+            key: The key of the output
+
+        Returns:
+            bytes | None: The output, or None if it isn't cached
+        """
+        with self._lock:
+            content = self._contents.get(key)
+            if content is not None:
+                self._contents.move_to_end(key)
+        CACHE_REQUESTS.inc(cache="output", result="miss" if content is None else "hit")
+        return content
+
+    def put(self, key: OutputKey, content: bytes) -> None:
+        """
+        Caches an output, replacing any output previously cached with the same key.
+        Outputs larger than the whole cache are not kept.
+
+        Args:
+            key: The key of the output
+            content: The output
+        """
+        with self._lock:
+            self._size -= len(self._contents.pop(key, b""))
+            if len(content) > self.max_bytes:
+                return
+            self._contents[key] = content
+            self._size += len(content)
+            while self._size > self.max_bytes:
+                _, evicted_content = self._contents.popitem(last=False)
+                self._size -= len(evicted_content)
+
+    def discard(self, predicate: Callable[[OutputKey], bool]) -> None:
+        """
+        Removes every cached output whose key matches the given predicate.
+
+        Args:
+            predicate: Whether the output with the given key should be removed
+        """
+        with self._lock:
+            for key in [key for key in self._contents if predicate(key)]:
+                self._size -= len(self._contents.pop(key))
+
+    def clear(self) -> None:
+        """
+        Empties the cache.
+        """
+        with self._lock:
+            self._contents.clear()
+            self._size = 0
+
+    @property
+    def size(self) -> int:
+        """
+        The total size of the cached outputs, in bytes
+        """
+        return self._size
+
+
+output_cache = OutputCache(get_settings().OUTPUT_CACHE_MAX_BYTES)
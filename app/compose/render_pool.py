@@ -0,0 +1,337 @@
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Tuple, TypeVar
+
+from app.compose.limits import limit_process_memory, process_data_bytes
+from app.metrics import RENDER_QUEUE_DEPTH, RENDER_QUEUE_WAIT_SECONDS, RENDER_RECYCLES, RENDERS, process_rss_bytes
+from app.settings import get_settings
+from app.util.timing_util import record_stage
+
+T = TypeVar("T")
+
+RENDER_THREAD_NAME_PREFIX = "plato-render"
+
+logger = logging.getLogger(__name__)
+
+
+class RenderPriorityEnum(str, Enum):
+    """
+    Priority classes of renders, from the highest to the lowest
+    """
+    INTERACTIVE = "interactive"
+    BULK = "bulk"
+    BACKGROUND = "background"
+
+
+@dataclass
+class _Job:
+    future: Future
+    function: Callable
+    args: Tuple
+    kwargs: Dict[str, Any]
+    context: contextvars.Context
+    priority: RenderPriorityEnum
+    flow: str | None
+    queued_at: float = field(default_factory=time.perf_counter)
+
+
+class RenderPool:
+    """
+    Bounded pool of workers running renders, so the number of concurrent WeasyPrint renders doesn't depend on the
+    size of the web server's threadpool. Renders requested by clients and background renders (e.g. pre-rendered
+    examples) share the same workers.
+
+    Queued renders are scheduled by priority class: a free worker always takes an interactive render first, then a
+    bulk one, then a background one. With `reserved_workers`, that many workers only ever run interactive renders,
+    so they don't wait for a long bulk render to finish. Within a class, renders are scheduled with weighted fair
+    queuing across flows (e.g. callers or templates): each flow gets a share of the workers proportional to its
+    weight in `flow_weights` (1 by default), whatever the number of renders it queued.
+
+    Workers are only started on the first submitted render, and the pool can be used again after being shut down.
+    A render can run alone (see `running_alone`), e.g. to be profiled without the other renders.
+
+    As memory held by WeasyPrint and Pango builds up over renders and is only given back when the process exits, the
+    pool can recycle the process it runs in: once it ran `max_renders` renders (plus a random jitter of up to
+    `max_renders_jitter`, drawn when the workers start, so forked processes don't all recycle at once), or the
+    process' resident memory exceeds `max_rss_bytes`, `on_recycle` is called once (see `stop_process`).
+
+    With `max_render_memory_bytes`, the process' memory is limited to what it uses when the workers start, plus that
+    much for every worker, as a safety net against the process being killed by the OOM killer. It isn't a limit per
+    render: the process' memory is limited as a whole (see `limit_process_memory`), so the MemoryError is raised by
+    whichever allocation goes over it, which may be in another render, a request handler or the event loop rather
+    than in the render which used the memory.
+
+        Typical usage:
+
+            pdf = render_pool.run(compose, template, compose_data, "application/pdf", jinja_env, static_directory,
+                                  priority=RenderPriorityEnum.BULK, flow=caller)
+    """
+
+    def __init__(self, workers: int, max_renders: int = 0, max_renders_jitter: int = 0, max_rss_bytes: int = 0,
+                 on_recycle: Callable[[str], None] | None = None, max_render_memory_bytes: int = 0,
+                 reserved_workers: int = 0, flow_weights: Mapping[str, float] | None = None):
+        self.workers = workers
+        self.max_renders = max_renders
+        self.max_renders_jitter = max_renders_jitter
+        self.max_rss_bytes = max_rss_bytes
+        self.max_render_memory_bytes = max_render_memory_bytes
+        self.on_recycle = on_recycle
+        # at least one worker is left for renders other than interactive ones, so they can't be starved forever
+        self.reserved_workers = min(reserved_workers, workers - 1)
+        self.flow_weights = flow_weights or {}
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._threads: List[threading.Thread] = []
+        self._generation = 0
+        self._queues: Dict[RenderPriorityEnum, List[Tuple[float, int, _Job]]] = {priority: []
+                                                                                  for priority in RenderPriorityEnum}
+        self._sequence = itertools.count()
+        self._virtual_time: Dict[RenderPriorityEnum, float] = {priority: 0.0 for priority in RenderPriorityEnum}
+        self._last_finish: Dict[Tuple[RenderPriorityEnum, str | None], float] = {}
+        self._flow_queued: Dict[Tuple[RenderPriorityEnum, str | None], int] = {}
+        self._running_unreserved = 0
+        self._running = 0
+        self._alone = False
+        self._worker_state = threading.local()
+        self.queued = 0
+        """
+        Number of renders waiting for a worker
+        """
+        self.renders = 0
+        """
+        Number of renders run since the pool was started
+        """
+        self.recycling = False
+        self._render_limit = 0
+
+    def submit(self, function: Callable[..., T], *args, priority: RenderPriorityEnum = RenderPriorityEnum.INTERACTIVE,
+               flow: str | None = None, **kwargs) -> Future:
+        """
+        Queues a render, to be run by the first available worker. The render runs in a copy of the caller's context,
+        so stages it times are tracked by the caller, along with the time it waited for a worker (`queue`).
+
+        Args:
+            function: The render function
+            args: The arguments for the render function
+            priority: The priority class of the render
+            flow: Who the render is for (e.g. a caller or a template), for renders to be scheduled fairly across flows
+            kwargs: The keyword arguments for the render function
+
+        Returns:
+            Future: The future result of the render
+        """
+        future = Future()
+        with self._condition:
+            if not self._threads:
+                self._start()
+            self._enqueue(_Job(future, function, args, kwargs, contextvars.copy_context(), priority, flow))
+            self._condition.notify()
+        return future
+
+    def _start(self) -> None:
+        self._render_limit = self.max_renders and self.max_renders + random.randint(0, self.max_renders_jitter)
+        self._limit_memory()
+        self._threads = [threading.Thread(target=self._work, args=(self._generation,), daemon=True,
+                                          name=f"{RENDER_THREAD_NAME_PREFIX}_{i}") for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _enqueue(self, job: _Job) -> None:
+        # self-clocked fair queuing: a render's virtual finish time follows the previous render of its flow, or the
+        # class' virtual time if the flow has nothing queued, advancing by the inverse of the flow's weight
+        flow_key = (job.priority, job.flow)
+        start = max(self._virtual_time[job.priority], self._last_finish.get(flow_key, 0.0))
+        finish = start + 1 / self.flow_weights.get(job.flow, 1)
+        self._last_finish[flow_key] = finish
+        self._flow_queued[flow_key] = self._flow_queued.get(flow_key, 0) + 1
+        heapq.heappush(self._queues[job.priority], (finish, next(self._sequence), job))
+        self.queued += 1
+
+    @contextmanager
+    def running_alone(self) -> Iterator[None]:
+        """
+        Waits until the renders run by other workers are done, then keeps workers from starting any other render until
+        the context exits. Can be entered by a render, or by any other thread.
+
+        Raises:
+            RuntimeError: When another render is already running alone
+        """
+        others = 1 if getattr(self._worker_state, "rendering", False) else 0
+        with self._condition:
+            if self._alone:
+                raise RuntimeError("Another render is already running alone")
+            self._alone = True
+            while self._running > others:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._alone = False
+                self._condition.notify_all()
+
+    def _next_job(self) -> _Job | None:
+        if self._alone:
+            return None
+        for priority, queue in self._queues.items():
+            if not queue:
+                continue
+            if priority != RenderPriorityEnum.INTERACTIVE \
+                    and self._running_unreserved >= self.workers - self.reserved_workers:
+                return None
+
+            finish, _, job = heapq.heappop(queue)
+            self._virtual_time[priority] = finish
+            flow_key = (priority, job.flow)
+            self._flow_queued[flow_key] -= 1
+            if not self._flow_queued[flow_key]:
+                del self._flow_queued[flow_key], self._last_finish[flow_key]
+            if priority != RenderPriorityEnum.INTERACTIVE:
+                self._running_unreserved += 1
+            self._running += 1
+            self.queued -= 1
+            return job
+        return None
+
+    def _work(self, generation: int) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    # workers of a pool which was shut down only finish its queued renders, and leave as soon as
+                    # new workers are started, so the pool never runs more renders at once than it has workers
+                    if generation != self._generation and (self._threads or not self.queued):
+                        return
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    self._condition.wait()
+
+            self._worker_state.rendering = True
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        result = job.context.run(self._run_queued, job)
+                    except BaseException as e:
+                        job.future.set_exception(e)
+                    else:
+                        job.future.set_result(result)
+            finally:
+                self._worker_state.rendering = False
+                with self._condition:
+                    if job.priority != RenderPriorityEnum.INTERACTIVE:
+                        self._running_unreserved -= 1
+                    self._running -= 1
+                    if self._alone:
+                        # wakes the render waiting to run alone, along with the idle workers
+                        self._condition.notify_all()
+                    else:
+                        self._condition.notify()
+
+    def _limit_memory(self) -> None:
+        data_bytes = process_data_bytes()
+        if self.max_render_memory_bytes and data_bytes is not None:
+            limit_process_memory(data_bytes + self.workers * self.max_render_memory_bytes)
+
+    def _run_queued(self, job: _Job) -> Any:
+        queue_seconds = time.perf_counter() - job.queued_at
+        RENDER_QUEUE_WAIT_SECONDS.observe(queue_seconds, priority=job.priority.value)
+        record_stage("queue", queue_seconds)
+        try:
+            return job.function(*job.args, **job.kwargs)
+        finally:
+            RENDERS.inc()
+            self._check_recycle()
+
+    def _check_recycle(self) -> None:
+        with self._lock:
+            self.renders += 1
+            if self.recycling:
+                return
+            if self._render_limit and self.renders >= self._render_limit:
+                reason = "renders"
+            elif self.max_rss_bytes and process_rss_bytes() > self.max_rss_bytes:
+                reason = "memory"
+            else:
+                return
+            self.recycling = True
+
+        RENDER_RECYCLES.inc(reason=reason)
+        if self.on_recycle is not None:
+            self.on_recycle(reason)
+
+    def run(self, function: Callable[..., T], *args, priority: RenderPriorityEnum = RenderPriorityEnum.INTERACTIVE,
+            flow: str | None = None, **kwargs) -> T:
+        """
+        Runs a render on the pool, waiting for its result.
+
+        Args:
+            function: The render function
+            args: The arguments for the render function
+            priority: The priority class of the render
+            flow: Who the render is for (e.g. a caller or a template), for renders to be scheduled fairly across flows
+            kwargs: The keyword arguments for the render function
+
+        Returns:
+            The result of the render, or raises the exception it raised
+        """
+        return self.submit(function, *args, priority=priority, flow=flow, **kwargs).result()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stops the workers, after they finish every queued render, or cancelling the queued renders if not waiting.
+
+        Args:
+            wait: Whether to wait until the workers stop
+        """
+        with self._condition:
+            threads, self._threads = self._threads, []
+            self._generation += 1
+            if not wait:
+                for queue in self._queues.values():
+                    for _, _, job in queue:
+                        job.future.cancel()
+                    queue.clear()
+                self._flow_queued.clear()
+                self._last_finish.clear()
+                self.queued = 0
+            self._condition.notify_all()
+
+        if wait:
+            for thread in threads:
+                thread.join()
+        with self._condition:
+            self.renders = 0
+            self.recycling = False
+
+
+def stop_process(reason: str) -> None:
+    """
+    Recycles this worker process by asking the server to stop it gracefully: it stops accepting connections and
+    finishes the in-flight requests, including their renders, before exiting. The process manager (gunicorn) then
+    replaces it with a fresh worker.
+
+    Args:
+        reason: Why the process is recycled
+    """
+    logger.warning("Recycling worker process %s, reason: %s", os.getpid(), reason)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+settings = get_settings()
+render_pool = RenderPool(settings.RENDER_WORKERS, max_renders=settings.RENDER_MAX_RENDERS,
+                         max_renders_jitter=settings.RENDER_MAX_RENDERS_JITTER,
+                         max_rss_bytes=settings.RENDER_MAX_RSS_BYTES, on_recycle=stop_process,
+                         max_render_memory_bytes=settings.RENDER_MAX_MEMORY_BYTES,
+                         reserved_workers=settings.RENDER_RESERVED_WORKERS, flow_weights=settings.RENDER_FLOW_WEIGHTS)
+RENDER_QUEUE_DEPTH.set_function(lambda: render_pool.queued)
@@ -3,15 +3,28 @@ import tempfile
 from abc import abstractmethod, ABC
 from jmespath import search
 from mimetypes import guess_extension
-from typing import Type, ClassVar, Dict, List
-from qrcode import make
+from typing import Any, Type, ClassVar, Dict, List, Mapping, Sequence, Tuple
 from tempfile import TemporaryDirectory
-from weasyprint import HTML
-from jsonschema import validate as validate_schema
+from jsonschema.protocols import Validator
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 from jinja2 import Environment as JinjaEnv
 
+from app.compose.layout_cache import layout_cache, layout_key
+from app.compose.limits import page_limit
+from app.compose.static_assets import static_asset_cache
+from app.metrics import CACHE_REQUESTS
 from app.models.template import Template
+from app.schemas.compose import PdfOptionsSchema
 from app.schemas.template_detail import MIMETypeEnum
+from app.settings import get_settings
+from app.util import cache_util
+from app.util.timing_util import timed_stage
+
+# WeasyPrint lays documents out in CSS pixels, 96 per inch, and PDF pages are measured in points, 72 per inch
+PX_TO_PT = 72 / 96
+# PDF options applied while laying out, as images are loaded then; the others only apply while writing
+LAYOUT_PDF_OPTIONS = ("optimize_images", "jpeg_quality", "dpi")
 
 
 class RendererNotFound(Exception):
@@ -21,6 +34,13 @@ class RendererNotFound(Exception):
     ...
 
 
+class LayoutUnsupported(Exception):
+    """
+    Exception to be raised when the requested MIME type isn't laid out in pages
+    """
+    ...
+
+
 class InvalidPageNumber(ValueError):
     """
     Exception to be raised when the given page number is invalid, either by being a negative number or by
@@ -60,7 +80,7 @@ class Renderer(ABC):
         self.jinja_env = jinja_env
         self.template_static_directory = template_static_directory
 
-    def compose_html(self, compose_data: dict) -> str:
+    def compose_html(self, compose_data: Mapping) -> str:
         """
         Creates the template HTML string using the Jinja2 environment.
 
@@ -73,15 +93,16 @@ class Renderer(ABC):
         template_static_directory = f"{self.template_static_directory}/{self.template_model.id}/"
         base_static_directory = f"{self.template_static_directory}/"
 
-        jinja_template = self.jinja_env.get_template(
-            name=f"{self.template_model.id}/{self.template_model.id}"
-        )  # template id works for the file as well
+        template_name = f"{self.template_model.id}/{self.template_model.id}"  # template id works for the file as well
+        is_cached = cache_util.is_jinja_template_cached(self.jinja_env, template_name)
+        CACHE_REQUESTS.inc(cache="template", result="hit" if is_cached else "miss")
+        jinja_template = self.jinja_env.get_template(name=template_name)
 
         return jinja_template.render(p=compose_data,
                                      base_static=base_static_directory,
                                      template_static=template_static_directory)
 
-    def render(self, compose_data: dict) -> io.BytesIO:
+    def render(self, compose_data: Mapping) -> io.BytesIO:
         """
         Renders Template onto a stream according to the Renderer's MIME type.
 
@@ -92,9 +113,23 @@ class Renderer(ABC):
             io.BytesIO: A file stream with the Renderer's MIME type.
         """
         with TemporaryDirectory() as temp_render_directory:
-            compose_data = self.qr_render(temp_render_directory, compose_data)
-            html_string = self.compose_html(compose_data)
-            return self.print(html_string)
+            return self.print(self.prepare_html(temp_render_directory, compose_data))
+
+    def prepare_html(self, output_folder: str, compose_data: Mapping) -> str:
+        """
+        Renders the QR codes of the composition, then the template HTML string.
+
+        Args:
+            output_folder: where to store the QR images rendered, which must be kept until the HTML is printed
+            compose_data: The data to fill the template with.
+
+        Returns:
+            str: HTML string for composed file.
+        """
+        with timed_stage("qr"):
+            compose_data = self.qr_render(output_folder, compose_data)
+        with timed_stage("jinja"):
+            return self.compose_html(compose_data)
 
     @abstractmethod
     def print(self, html: str) -> io.BytesIO:
@@ -151,67 +186,194 @@ class Renderer(ABC):
             return type_
         return wrapper
 
-    def qr_render(self, output_folder: str, compose_data: dict) -> dict:
+    def qr_render(self, output_folder: str, compose_data: Mapping) -> Mapping:
         """
-        Render QR codes, altering self.compose_data to replace qr_code properties with the filepath to their renders
+        Render QR codes, replacing qr_code properties with the filepath to their renders.
+        The given compose_data is never changed, so it can be shared between renders: replaced properties are set
+        in an overlay of it (see `with_value`).
 
         Args:
             output_folder: where to store the QR images renderer
             compose_data: the data to fill the template with
 
         Returns:
-            dict: altered compose_data
+            Mapping: compose_data, with the QR code renders
         """
-        qr_schema_paths = self.template_model.get_qr_entries()
-
-        def set_nested(key_list: List[str], dict_: dict, value: str):
-            """
-            Sets dict_[key1, key2, ...] = value
+        from qrcode import make
 
-            Args:
-                key_list: Nested key list
-                dict_: Dict to be iterated with key_list
-                value: Value to be set
-            """
-            for key in key_list[:-1]:
-                dict_ = dict_[key]
-            dict_[key_list[-1]] = value
+        qr_schema_paths = self.template_model.get_qr_entries()
 
         for i, qr_schema_path in enumerate(qr_schema_paths):
             with open(f"{output_folder}/{i}.png", mode="wb") as qr_file:
-                qr_value = search(qr_schema_path, compose_data) 
+                qr_value = search(qr_schema_path, compose_data)
                 if qr_value is not None:
                     img = make(qr_value)
                     img.save(qr_file)
-                    set_nested(qr_schema_path.split("."), compose_data, qr_file.name)
+                    compose_data = with_value(compose_data, qr_schema_path.split("."), qr_file.name)
 
         return compose_data
 
 
+def with_value(dict_: Mapping, key_list: Sequence[str], value: Any) -> Mapping:
+    """
+    Copy-on-write update of a nested value: returns dict_ with dict_[key1][key2]... = value, leaving dict_ unchanged.
+    Only the dicts along the key path are (shallowly) copied, everything else is shared with dict_.
+
+    Args:
+        dict_: Dict to be iterated with key_list
+        key_list: Nested key list
+        value: Value to be set
+
+    Returns:
+        Mapping: The updated copy of dict_
+    """
+    key, *inner_keys = key_list
+    return {**dict_, key: with_value(dict_[key], inner_keys, value) if inner_keys else value}
+
+
+class WeasyPrintRenderer(Renderer, ABC):
+    """
+    Base of the renderers printing documents with WeasyPrint, in two steps: laying the document out, then writing
+    the laid out document in the renderer's format. Renders are written from the layout cache when the composition
+    was already laid out with the same options (e.g. its page count was requested before the document itself).
+    """
+    cache_layouts: ClassVar[bool] = False
+    """
+    Whether renders keep their layouts in the layout cache. Only renderers writing several outputs from the same
+    composition (e.g. one per page) keep them, as most documents are only rendered once.
+    """
+    layout_options: Dict[str, Any] = {}
+    """
+    Options given to WeasyPrint's layout. Renderers laying documents out with the same options share cached layouts.
+    """
+
+    def render(self, compose_data: Mapping) -> io.BytesIO:
+        """
+        Renders Template onto a stream according to the Renderer's MIME type, laying it out unless its layout is
+        cached.
+
+        Args:
+            compose_data: The data to fill the template with.
+
+        Returns:
+            io.BytesIO: A file stream with the Renderer's MIME type.
+        """
+        document, _ = self.layout(compose_data, keep=self.cache_layouts)
+        with timed_stage("write"):
+            return self.write(document)
+
+    def layout(self, compose_data: Mapping, keep: bool = True) -> Tuple[Any, bool]:
+        """
+        Lays the composition out, without writing it. Cached layouts skip every stage of the render (QR codes,
+        Jinja and layout).
+
+        Args:
+            compose_data: The data to fill the template with.
+            keep: Whether the layout is kept in the layout cache once laid out
+
+        Returns:
+            Tuple[weasyprint.Document, bool]: The laid out document, and whether it was cached
+        """
+        key = layout_key(self.template_model, compose_data, self.layout_options)
+        document = layout_cache.get(key)
+        if document is not None:
+            return document, True
+
+        with TemporaryDirectory() as temp_render_directory:
+            document = self.lay_out(self.prepare_html(temp_render_directory, compose_data))
+        if keep:
+            layout_cache.put(key, document)
+        return document, False
+
+    def lay_out(self, html_string: str) -> Any:
+        """
+        Lays the HTML string out with WeasyPrint.
+
+        Args:
+            html_string: The HTML string to be laid out.
+
+        Returns:
+            weasyprint.Document: The laid out document.
+        """
+        from weasyprint import HTML
+
+        with timed_stage("layout"):
+            return HTML(string=html_string, url_fetcher=static_asset_cache.fetch).render(**self.layout_options)
+
+    def print(self, html_string: str) -> io.BytesIO:
+        """
+        Prints the HTML string, laying it out and then writing it.
+
+        Args:
+            html_string: The HTML string to be printed.
+
+        Returns:
+            io.BytesIO: A file stream with the Renderer's MIME type.
+        """
+        document = self.lay_out(html_string)
+        with timed_stage("write"):
+            return self.write(document)
+
+    @abstractmethod
+    def write(self, document: Any) -> io.BytesIO:
+        """
+        Writes the laid out document in the Renderer's MIME type.
+
+        Args:
+            document: The weasyprint.Document to be written
+
+        Returns:
+            io.BytesIO: A file stream with the Renderer's MIME type.
+        """
+        ...
+
+
 @Renderer.renderer()
-class PdfRenderer(Renderer):
+class PdfRenderer(WeasyPrintRenderer):
     """
     PDF Renderer which uses weasyprint to generate PDF documents.
     """
 
     mime_type = MIMETypeEnum.PDF_MIME.value
 
-    def print(self, html_string: str) -> io.BytesIO:
+    def __init__(self, template_model: Template,
+                 jinja_env: JinjaEnv,
+                 template_static_directory: str,
+                 **pdf_options):
+        super().__init__(template_model, jinja_env, template_static_directory)
+        # the template's defaults, overridden by the ones given for the composition
+        self.pdf_options = {name: value for name, value in {**template_model.get_pdf_options(), **pdf_options}.items()
+                            if name in PdfOptionsSchema.model_fields and value is not None}
+        # only layout options are part of the layout cache key, so PDFs differing in how they're written share layouts
+        self.layout_options = {name: value for name, value in self.pdf_options.items() if name in LAYOUT_PDF_OPTIONS}
+        self.write_options = {name: value for name, value in self.pdf_options.items()
+                              if name not in LAYOUT_PDF_OPTIONS}
+
+    def write(self, document: Any) -> io.BytesIO:
+        """
+        Writes the laid out document as a PDF document.
 
-        with tempfile.NamedTemporaryFile() as target_file_html:
-            html = HTML(string=html_string)
-            html.write_pdf(target_file_html.name)
-            with open(target_file_html.name, mode='rb') as temp_file_stream:
-                return io.BytesIO(temp_file_stream.read())
+        Args:
+            document: The weasyprint.Document to be written
+
+        Returns:
+            io.BytesIO: A file stream with the PDF document.
+        """
+        # writing a PDF adds the fonts it embeds to the document, which may be shared through the layout cache
+        with layout_cache.writing(document):
+            return io.BytesIO(document.write_pdf(**self.write_options))
 
 
 @Renderer.renderer()
-class PNGRenderer(Renderer):
+class PNGRenderer(WeasyPrintRenderer):
     """
-    PNG Renderer which uses weasyprint to generate PNG documents.
+    PNG Renderer which uses weasyprint to generate PNG documents. Each page of a composition is printed from the
+    same cached layout.
     """
 
     mime_type = MIMETypeEnum.PNG_MIME.value
+    cache_layouts = True
+    layout_options = {"enable_hinting": True}
     _width: int | None = None
     _height: int | None = None
     _page: int = 0
@@ -257,12 +419,13 @@ class PNGRenderer(Renderer):
         self.page = page
         super().__init__(template_model, jinja_env, template_static_directory)
 
-    def print(self, html_string: str) -> io.BytesIO:
+    def write(self, document: Any) -> io.BytesIO:
         """
-        Prints the HTML string as a PNG image using WeasyPrint.
+        Writes the requested page of the laid out document as a PNG image. The document itself is left unchanged,
+        so it can be shared through the layout cache.
 
         Args:
-            html_string: The HTML string to be printed as PNG.
+            document: The weasyprint.Document to be written
 
         Raises:
             InvalidPageNumber: If the requested page number is invalid (negative or exceeds the number of pages).
@@ -270,24 +433,21 @@ class PNGRenderer(Renderer):
         Returns:
             io.BytesIO: A file stream with the PNG image.
         """
+        if self.page >= len(document.pages):
+            raise InvalidPageNumber(f"Page number ({self.page}) is larger than the maximum page number ({len(document.pages)-1})")
 
-        with tempfile.NamedTemporaryFile() as target_file_html:
-            html = HTML(string=html_string)
-            weasy_doc = html.render(enable_hinting=True)
-
-            if self.page >= len(weasy_doc.pages):
-                raise InvalidPageNumber(f"Page number ({self.page}) is larger than the maximum page number ({len(weasy_doc.pages)-1})")
+        page_to_print = document.pages[self.page]   # Print only the requested page
+        resolution_multiplier = 1
 
-            page_to_print = weasy_doc.pages[self.page]   # Print only the requested page
-            resolution_multiplier = 1
-
-            if self.height is not None:
-                resolution_multiplier = self.height / page_to_print.height
-            elif self.width is not None:
-                resolution_multiplier = self.width / page_to_print.width
+        if self.height is not None:
+            resolution_multiplier = self.height / page_to_print.height
+        elif self.width is not None:
+            resolution_multiplier = self.width / page_to_print.width
 
+        with tempfile.NamedTemporaryFile() as target_file_html:
             # 96 is the default resolution provided by weasyprint to maintain aspect ratio
-            weasy_doc.copy([page_to_print]).write_png(target=target_file_html.name, resolution=resolution_multiplier * 96)
+            document.copy([page_to_print]).write_png(target=target_file_html.name,
+                                                     resolution=resolution_multiplier * 96)
             with open(target_file_html.name, mode='rb') as temp_file_stream:
                 return io.BytesIO(temp_file_stream.read())
 
@@ -313,7 +473,41 @@ class HTMLRenderer(Renderer):
         return io.BytesIO(bytes(html_string, encoding="utf-8"))
 
 
-def compose(template: Template, compose_data: dict, mime_type: str, jinja_env: JinjaEnv, template_static_directory: str,
+_validators: Dict[str, Tuple[int, Validator]] = {}
+"""
+Validator for each template's schema, along with the template version it was created for
+"""
+
+
+def schema_validator(template: Template) -> Validator:
+    """
+    Gets the jsonschema validator for a template's schema. Schemas are only checked and compiled once per
+    template version.
+
+    Args:
+        template: The template
+
+    Raises:
+        jsonschema.exceptions.SchemaError: When the template's schema is invalid
+
+    Returns:
+        Validator: The validator for the template's schema
+    """
+    version, validator = _validators.get(template.id, (None, None))
+    if validator is not None and template.version is not None and version == template.version:
+        CACHE_REQUESTS.inc(cache="validator", result="hit")
+        return validator
+
+    CACHE_REQUESTS.inc(cache="validator", result="miss")
+    validator_class = validator_for(template.schema)
+    validator_class.check_schema(template.schema)
+    validator = validator_class(template.schema)
+    if template.version is not None:
+        _validators[template.id] = (template.version, validator)
+    return validator
+
+
+def compose(template: Template, compose_data: Mapping, mime_type: str, jinja_env: JinjaEnv, template_static_directory: str,
             *args, **kwargs) -> io.BytesIO:
     """
     Composes a file of the given mime_type using the compose_data to fill the given template.
@@ -321,7 +515,7 @@ def compose(template: Template, compose_data: dict, mime_type: str, jinja_env: J
     Args:
         template: The Template model to be used in the composition
         mime_type: The desired output MIME type
-        compose_data: The dict with the data to fill the template
+        compose_data: The dict with the data to fill the template, which is never changed
         jinja_env: The Jinja2 environment to be used for rendering the template
         template_static_directory: The static directory for the template, used to load static files
         args: Additional arguments to be given to the specific renderer
@@ -330,12 +524,57 @@ def compose(template: Template, compose_data: dict, mime_type: str, jinja_env: J
     Raises:
         jsonschema.exceptions.ValidationError: When the compose_data is not valid for a given template
         RendererNotFound: When there is no Renderer for the given mime_type
+        PageLimitExceeded: When the document has more pages than allowed by the settings
 
     Returns:
         io.BytesIO: The Byte stream for the composed file.
     """
-    validate_schema(instance=compose_data, schema=template.schema)
+    _validate(template, compose_data)
     renderer = Renderer.build_renderer(mime_type, template_model=template, jinja_env=jinja_env,
                                        template_static_directory=template_static_directory, *args, **kwargs)
 
-    return renderer.render(compose_data)
+    with page_limit(get_settings().RENDER_MAX_PAGES):
+        return renderer.render(compose_data)
+
+
+def layout(template: Template, compose_data: Mapping, mime_type: str, jinja_env: JinjaEnv,
+           template_static_directory: str, *args, **kwargs) -> Tuple[List[Tuple[float, float]], bool]:
+    """
+    Lays out the composition as it would be for the given mime_type, without writing it. The layout is kept in the
+    layout cache, so composing it afterwards (or any page of it, as PNG) doesn't lay it out again.
+
+    Args:
+        template: The Template model to be used in the composition
+        compose_data: The dict with the data to fill the template, which is never changed
+        mime_type: The MIME type the composition is laid out for
+        jinja_env: The Jinja2 environment to be used for rendering the template
+        template_static_directory: The static directory for the template, used to load static files
+        args: Additional arguments to be given to the specific renderer
+        kwargs: Additional keyword arguments to be given to the specific renderer
+
+    Raises:
+        jsonschema.exceptions.ValidationError: When the compose_data is not valid for a given template
+        RendererNotFound: When there is no Renderer for the given mime_type
+        LayoutUnsupported: When the given mime_type isn't laid out in pages
+        PageLimitExceeded: When the document has more pages than allowed by the settings
+
+    Returns:
+        Tuple[List[Tuple[float, float]], bool]: The width and height of every page, in points, and whether the
+            layout was cached
+    """
+    _validate(template, compose_data)
+    renderer = Renderer.build_renderer(mime_type, template_model=template, jinja_env=jinja_env,
+                                       template_static_directory=template_static_directory, *args, **kwargs)
+    if not isinstance(renderer, WeasyPrintRenderer):
+        raise LayoutUnsupported(mime_type)
+
+    with page_limit(get_settings().RENDER_MAX_PAGES):
+        document, cached = renderer.layout(compose_data)
+    return [(page.width * PX_TO_PT, page.height * PX_TO_PT) for page in document.pages], cached
+
+
+def _validate(template: Template, compose_data: Mapping) -> None:
+    with timed_stage("validate"):
+        error = best_match(schema_validator(template).iter_errors(compose_data))
+        if error is not None:
+            raise error
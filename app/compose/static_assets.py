@@ -0,0 +1,136 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from mimetypes import guess_type
+from typing import Dict, Tuple
+from urllib.parse import unquote, urlparse
+
+from app.metrics import CACHE_REQUESTS
+from app.settings import get_settings
+
+# (device, inode, size, modification time) - hardlinked copies of the same blob share the same key
+FileIdentity = Tuple[int, int, int, int]
+
+
+class StaticAssetCache:
+    """
+    In-memory cache of the static assets (fonts, images, stylesheets) loaded by WeasyPrint while rendering.
+
+    Assets are keyed by the SHA-256 digest of their content rather than by their URL, so identical files shipped
+    by several templates are only read and kept in memory once. Entries are evicted in least recently used order
+    once the cache holds more than `max_bytes`.
+
+        Typical usage:
+
+            HTML(string=html_string, url_fetcher=static_asset_cache.fetch)
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._contents: OrderedDict[str, bytes] = OrderedDict()
+        self._digests: Dict[FileIdentity, str] = {}
+        self._paths: Dict[str, FileIdentity] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str, *args, **kwargs) -> dict:
+        """
+        WeasyPrint URL fetcher serving local files from the cache. Any other URL is delegated to WeasyPrint's
+        default fetcher.
+
+        Args:
+            url: The URL of the resource to fetch
+            args: Additional arguments for the default fetcher
+            kwargs: Additional keyword arguments for the default fetcher
+
+        Returns:
+            dict: The fetched resource, as expected by WeasyPrint
+        """
+        parsed_url = urlparse(url)
+        if parsed_url.scheme != "file":
+            from weasyprint import default_url_fetcher
+
+            return default_url_fetcher(url, *args, **kwargs)
+
+        path = unquote(parsed_url.path)
+        return {
+            "string": self.get(path),
+            "mime_type": guess_type(path)[0],
+            "redirected_url": url,
+            "path": path,
+        }
+
+    def get(self, path: str) -> bytes:
+        """
+        Gets the content of the file at the given path, reading it from disk only if no file with the same
+        content is cached.
+
+        Args:
+            path: The path of the file
+
+        Raises:
+            FileNotFoundError: When there is no file at the given path
+
+        Returns:
+            bytes: The file content
+        """
+        file_stat = os.stat(path)
+        identity = (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+
+        with self._lock:
+            digest = self._digests.get(identity)
+            if digest is not None and digest in self._contents:
+                self._contents.move_to_end(digest)
+                self._paths[path] = identity
+                CACHE_REQUESTS.inc(cache="static_asset", result="hit")
+                return self._contents[digest]
+
+        CACHE_REQUESTS.inc(cache="static_asset", result="miss")
+
+        with open(path, mode="rb") as file:
+            content = file.read()
+        digest = hashlib.sha256(content).hexdigest()
+
+        with self._lock:
+            self._digests[identity] = digest
+            self._paths[path] = identity
+            if digest in self._contents:
+                self._contents.move_to_end(digest)
+                return self._contents[digest]
+            if len(content) <= self.max_bytes:
+                self._contents[digest] = content
+                self._size += len(content)
+                self._evict()
+        return content
+
+    def invalidate(self, path: str) -> None:
+        """
+        Forgets the content associated with the file at the given path, e.g. after it changed on disk.
+
+        Args:
+            path: The path of the file
+        """
+        with self._lock:
+            identity = self._paths.pop(path, None)
+            digest = self._digests.pop(identity, None)
+            if digest is not None and digest not in self._digests.values():
+                self._size -= len(self._contents.pop(digest, b""))
+
+    def clear(self) -> None:
+        """
+        Empties the cache.
+        """
+        with self._lock:
+            self._contents.clear()
+            self._digests.clear()
+            self._paths.clear()
+            self._size = 0
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes:
+            _, content = self._contents.popitem(last=False)
+            self._size -= len(content)
+
+
+static_asset_cache = StaticAssetCache(get_settings().STATIC_ASSET_CACHE_MAX_BYTES)
@@ -0,0 +1,117 @@
+import json
+import logging
+import os
+import select
+import threading
+import uuid
+from typing import Callable
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+TEMPLATE_CHANGED_CHANNEL = "plato_template_changed"
+
+NODE_ID = uuid.uuid4().hex
+"""
+Identifies this process, so it can ignore the notifications it sent itself. Processes forked from it (e.g. gunicorn
+workers of a preloaded app) get their own id, as they don't share its caches.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _new_node_id() -> None:
+    global NODE_ID
+    NODE_ID = uuid.uuid4().hex
+
+
+os.register_at_fork(after_in_child=_new_node_id)
+
+
+def notify_template_changed(db: Session, template_id: str) -> None:
+    """
+    Notifies every Plato node listening on the database that a template changed, along with when it was updated (as
+    an epoch timestamp), which tells nodes whether their copy of the template is up to date.
+    The notification is only delivered once the session's transaction is committed.
+
+    Args:
+        db: The database session
+        template_id: The id of the changed template
+    """
+    db.flush()
+    db.execute(text("SELECT pg_notify(:channel, json_build_object("
+                    "'template_id', :template_id, 'node_id', :node_id, "
+                    "'updated_at', (SELECT extract(epoch FROM updated_at) FROM template WHERE id = :template_id)"
+                    ")::text)"),
+               {"channel": TEMPLATE_CHANGED_CHANNEL, "template_id": template_id, "node_id": NODE_ID})
+
+
+class TemplateChangeListener:
+    """
+    Listens for template change notifications sent by other Plato nodes, in a background thread.
+
+        Typical usage:
+
+            listener = TemplateChangeListener(database_uri, lambda template_id, updated_at: ...)
+            listener.start()
+            ...
+            listener.stop()
+    """
+    POLL_TIMEOUT_SECONDS = 1
+    RECONNECT_DELAY_SECONDS = 5
+
+    def __init__(self, database_uri: str, on_change: Callable[[str, float | None], None]):
+        self.database_uri = database_uri
+        self.on_change = on_change
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="plato-template-listener", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Stopped listening for template changes, reconnecting")
+                self._stop_event.wait(self.RECONNECT_DELAY_SECONDS)
+
+    def _listen(self) -> None:
+        connection = psycopg2.connect(self.database_uri)
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {TEMPLATE_CHANGED_CHANNEL}")
+
+            while not self._stop_event.is_set():
+                if select.select([connection], [], [], self.POLL_TIMEOUT_SECONDS) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    self._handle(connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
+
+    def _handle(self, payload: str) -> None:
+        try:
+            notification = json.loads(payload)
+            node_id, template_id = notification["node_id"], notification["template_id"]
+            updated_at = notification.get("updated_at")
+            if updated_at is not None:
+                updated_at = float(updated_at)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            logger.warning("Ignoring malformed template change notification: %r", payload)
+            return
+        if node_id == NODE_ID:
+            return
+        try:
+            self.on_change(template_id, updated_at)
+        except Exception:
+            logger.exception("Failed to refresh template '%s'", template_id)
@@ -1,18 +1,30 @@
-from contextlib import contextmanager
-from typing import Iterator
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.settings import get_settings
 
 settings = get_settings()
 
+pool_options = dict(
+    pool_pre_ping=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+)
 
 if settings.SQLALCHEMY_DATABASE_URI is not None:
-    engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
+    engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, **pool_options)
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+if settings.ASYNC_SQLALCHEMY_DATABASE_URI is not None:
+    async_engine = create_async_engine(settings.ASYNC_SQLALCHEMY_DATABASE_URI, **pool_options)
+    AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
+
 
 @contextmanager
 def db_session() -> Iterator:
@@ -27,3 +39,15 @@ def db_session() -> Iterator:
         yield db
     finally:
         db.close()
+
+
+@asynccontextmanager
+async def async_db_session() -> AsyncIterator:
+    """
+    Yields an asyncio database session, and closes it after it is no longer needed (or if an issue occurs)
+
+    :return: The asyncio database session
+    :rtype: AsyncIterator
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,114 @@
+from itertools import chain
+from typing import Sequence
+
+from sqlalchemy import ColumnElement, Select, Text, cast, func, literal, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from app.models.template import Template
+from app.schemas.template_detail import TemplateFieldEnum
+
+TEMPLATE_FIELD_COLUMNS = {
+    TemplateFieldEnum.TEMPLATE_ID: Template.id,
+    TemplateFieldEnum.TEMPLATE_SCHEMA: Template.schema,
+    TemplateFieldEnum.TYPE: Template.type,
+    TemplateFieldEnum.METADATA: Template.metadata_,
+    TemplateFieldEnum.TAGS: Template.tags,
+    TemplateFieldEnum.EXAMPLE_COMPOSITION: Template.example_composition,
+}
+"""
+Columns for each field of the template detail, matching TemplateDetailSchema's serialization aliases
+"""
+
+ALL_TEMPLATE_FIELDS = list(TemplateFieldEnum)
+
+
+def template_json_object(fields: Sequence[TemplateFieldEnum] = ALL_TEMPLATE_FIELDS) -> ColumnElement:
+    """
+    Builds the JSON object for a template in the database, with the same structure as TemplateDetailSchema's
+    serialization, restricted to the given fields. Keys keep the schema's field order, whatever the order of `fields`.
+
+    Args:
+        fields: The fields to be included in the object
+
+    Returns:
+        ColumnElement: The json_build_object expression
+    """
+    return func.json_build_object(*chain.from_iterable(
+        (literal(field.value), TEMPLATE_FIELD_COLUMNS[field]) for field in TemplateFieldEnum if field in fields
+    ))
+
+
+def template_json_query(template_id: str, fields: Sequence[TemplateFieldEnum] = ALL_TEMPLATE_FIELDS) -> Select:
+    """
+    Query selecting the JSON document for a single template, as text, along with the template's version.
+
+    Args:
+        template_id: The id of the template
+        fields: The fields to be included in the document
+
+    Returns:
+        Select: The query, returning the document, version and update time of the template, or no rows if the
+            template doesn't exist
+    """
+    return (select(cast(template_json_object(fields), Text), Template.version, Template.updated_at)
+            .where(Template.id == template_id))
+
+
+def template_version_query(template_id: str) -> Select:
+    """
+    Query selecting only the version of a single template, through its primary key.
+
+    Args:
+        template_id: The id of the template
+
+    Returns:
+        Select: The query, returning the version and update time of the template, or no rows if the template
+            doesn't exist
+    """
+    return select(Template.version, Template.updated_at).where(Template.id == template_id)
+
+
+def catalogue_version_query(*filters: ColumnElement[bool]) -> Select:
+    """
+    Query aggregating the versions of every template matching the given filters. Any template being created,
+    updated or deleted changes its result.
+
+    Args:
+        filters: The filters the templates must match
+
+    Returns:
+        Select: The query, returning the number of templates, the sum of their versions and the last update time
+    """
+    return (select(func.count(), func.coalesce(func.sum(Template.version), 0), func.max(Template.updated_at))
+            .where(*filters))
+
+
+def template_list_json_query(*filters: ColumnElement[bool], fields: Sequence[TemplateFieldEnum] = ALL_TEMPLATE_FIELDS,
+                             after: str | None = None, limit: int | None = None) -> Select:
+    """
+    Query aggregating the JSON documents for every template matching the given filters into a JSON array, as text.
+    Templates are sorted by id when paginating, with `after` and `limit`.
+
+    Args:
+        filters: The filters the templates must match
+        fields: The fields to be included in each document
+        after: Only templates with an id greater than this one are included
+        limit: The maximum number of templates to include
+
+    Returns:
+        Select: The query, returning a single row with the JSON array, the number of templates in it and the last
+            template's id
+    """
+    page = select(Template.id.label("id"), template_json_object(fields).label("document")).where(*filters)
+    if after is not None:
+        page = page.where(Template.id > after)
+
+    paginated = limit is not None or after is not None
+    if paginated:
+        page = page.order_by(Template.id).limit(limit)
+    page = page.subquery()
+
+    documents = func.json_agg(aggregate_order_by(page.c.document, page.c.id) if paginated else page.c.document)
+    return select(cast(func.coalesce(documents, literal_column("'[]'::json")), Text),
+                  func.count(),
+                  func.max(page.c.id))
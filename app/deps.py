@@ -1,9 +1,17 @@
-from typing import Generator
-from fastapi import Request
+import secrets
+import uuid
+from typing import Annotated, AsyncGenerator, Generator
+from fastapi import Header, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.db.session import db_session
+from app.compose.limits import PayloadTooDeep, parse_payload
+from app.db.session import async_db_session, db_session
+from app.exceptions import AdminAuthorizationException, InvalidPayloadException, InvalidProfileRequestException, \
+    PayloadTooLargeException
 from app.file_storage import PlatoFileStorage
+from app.profiling import PROFILE_HEADER_CPU, PROFILE_HEADER_MEMORY, ProfileRequest
+from app.settings import get_settings
 from jinja2 import Environment as JinjaEnv
 
 
@@ -15,6 +23,53 @@ def get_db() -> Generator[Session, None, None]:
         yield db
 
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Provides an asyncio database session for dependency injection in async FastAPI routes, which don't take up a
+    threadpool worker while waiting for the database.
+    """
+    async with async_db_session() as db:
+        yield db
+
+
+async def get_compose_payload(request: Request) -> dict:
+    """
+    Reads the compose payload, as a JSON object. The body is rejected as soon as it exceeds the maximum payload size,
+    without being fully read, and after being parsed when it's nested deeper than the maximum depth, so oversized
+    payloads never reach the schema validation.
+
+    :param request: The FastAPI request object
+    :type request: Request
+
+    :raises PayloadTooLargeException: When the body is larger than the maximum payload size
+    :raises InvalidPayloadException: When the body isn't a JSON object, or is nested deeper than the maximum depth
+
+    :return: The payload
+    :rtype: dict
+    """
+    settings = get_settings()
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() \
+            and int(content_length) > settings.COMPOSE_MAX_PAYLOAD_BYTES:
+        raise PayloadTooLargeException(settings.COMPOSE_MAX_PAYLOAD_BYTES)
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > settings.COMPOSE_MAX_PAYLOAD_BYTES:
+            raise PayloadTooLargeException(settings.COMPOSE_MAX_PAYLOAD_BYTES)
+
+    try:
+        payload = parse_payload(body, settings.COMPOSE_MAX_PAYLOAD_DEPTH)
+    except PayloadTooDeep as e:
+        raise InvalidPayloadException(str(e)) from e
+    except ValueError as e:
+        raise InvalidPayloadException("the body is not valid JSON") from e
+    if not isinstance(payload, dict):
+        raise InvalidPayloadException("the body must be a JSON object")
+    return payload
+
+
 def get_file_storage(request: Request) -> PlatoFileStorage:
     """
     Retrieves the file storage instance from the request's application state.
@@ -49,3 +104,64 @@ def get_template_static_directory(request: Request) -> str:
     :return: The static directory path for templates
     """
     return request.app.state.template_static_directory
+
+
+def get_template_directory(request: Request) -> str:
+    """
+    Retrieves the local directory holding the templates from the request's application state.
+
+    :param request: The FastAPI request object
+    :type request: Request
+
+    :return: The directory path for templates
+    """
+    return request.app.state.template_directory
+
+
+def require_admin_key(x_admin_key: Annotated[str | None, Header()] = None) -> None:
+    """
+    Ensures the request carries the admin API key. Admin endpoints are disabled when no admin API key is configured.
+
+    :param x_admin_key: The value of the X-Admin-Key header
+    :type x_admin_key: str | None
+
+    :raises AdminAuthorizationException: If the admin API key is not configured, missing or invalid
+    """
+    admin_api_key = get_settings().ADMIN_API_KEY
+    if admin_api_key is None or x_admin_key is None or not secrets.compare_digest(x_admin_key, admin_api_key):
+        raise AdminAuthorizationException()
+
+
+def get_profile_request(x_plato_profile: Annotated[str | None, Header()] = None,
+                        x_request_id: Annotated[str | None, Header()] = None,
+                        x_admin_key: Annotated[str | None, Header()] = None) -> ProfileRequest | None:
+    """
+    Reads an admin's request for a composition to be profiled, from the X-Plato-Profile header: `cpu` to profile it
+    with cProfile, or `cpu,memory` to also trace its memory allocations. The profile is stored under the request id,
+    from the X-Request-ID header or generated otherwise.
+
+    :param x_plato_profile: The value of the X-Plato-Profile header
+    :type x_plato_profile: str | None
+    :param x_request_id: The value of the X-Request-ID header
+    :type x_request_id: str | None
+    :param x_admin_key: The value of the X-Admin-Key header
+    :type x_admin_key: str | None
+
+    :raises AdminAuthorizationException: If profiling is requested without a valid admin API key
+    :raises InvalidProfileRequestException: If the profiling options or the request id are invalid
+
+    :return: The profiling request, or None if profiling wasn't requested
+    :rtype: ProfileRequest | None
+    """
+    if x_plato_profile is None:
+        return None
+    require_admin_key(x_admin_key)
+
+    options = {option.strip().lower() for option in x_plato_profile.split(",")}
+    if PROFILE_HEADER_CPU not in options or not options <= {PROFILE_HEADER_CPU, PROFILE_HEADER_MEMORY}:
+        raise InvalidProfileRequestException(f"expected '{PROFILE_HEADER_CPU}' or "
+                                             f"'{PROFILE_HEADER_CPU},{PROFILE_HEADER_MEMORY}'")
+    try:
+        return ProfileRequest(x_request_id or uuid.uuid4().hex, memory=PROFILE_HEADER_MEMORY in options)
+    except ValueError as e:
+        raise InvalidProfileRequestException(str(e)) from e
@@ -53,6 +53,32 @@ class SinglePageUnsupportedException(HTTPException):
         self.detail = f"Single page printing unsupported on provided mime_type: {mime_type}"
 
 
+class LayoutUnsupportedException(HTTPException):
+    """
+    Raised when a layout is requested for a mime type which isn't laid out in pages
+    """
+
+    def __init__(self, mime_type: str) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_406_NOT_ACCEPTABLE
+        self.detail = f"Compositions in the given mime type '{mime_type}' are not laid out in pages."
+
+
+class PdfOptionsUnsupportedException(HTTPException):
+    """
+    Raised when PDF options are given for a mime type other than PDF
+    """
+
+    def __init__(self, mime_type: str) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_400_BAD_REQUEST
+        self.detail = f"PDF options unsupported on provided mime_type: {mime_type}"
+
+
 class AspectRatioCompromisedException(HTTPException):
     """
     Raised when both height and width are specified, which compromises the template's aspect ratio
@@ -103,4 +129,187 @@ class JSONSchemaVerificationErrorException(HTTPException):
         Constructor Method
         """
         self.status_code = status.HTTP_400_BAD_REQUEST
-        self.detail = "JSON schema validation failed"
\ No newline at end of file
+        self.detail = "JSON schema validation failed"
+
+
+class AdminAuthorizationException(HTTPException):
+    """
+    Raised when an admin-only endpoint is called without a valid admin API key
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_403_FORBIDDEN
+        self.detail = "A valid admin API key is required"
+
+
+class InvalidTemplateBundleException(HTTPException):
+    """
+    Raised when a template bundle is malformed, or its content is invalid
+    """
+
+    def __init__(self, message: str) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_400_BAD_REQUEST
+        self.detail = f"Invalid template bundle: {message}"
+
+
+class InvalidProfileRequestException(HTTPException):
+    """
+    Raised when a profiling request header is invalid
+    """
+
+    def __init__(self, message: str) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_400_BAD_REQUEST
+        self.detail = f"Invalid profiling request: {message}"
+
+
+class ProfilerBusyException(HTTPException):
+    """
+    Raised when a composition is to be profiled while this worker is profiling another one
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_409_CONFLICT
+        self.detail = "Another composition is being profiled by this worker, try again later"
+
+
+class ProfileNotFoundException(HTTPException):
+    """
+    Raised when the requested profile doesn't exist
+    """
+
+    def __init__(self, profile_id: str) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_404_NOT_FOUND
+        self.detail = f"Profile '{profile_id}' not found"
+
+
+class PayloadTooLargeException(HTTPException):
+    """
+    Raised when a compose payload is larger than allowed
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        self.detail = f"The payload is larger than the maximum of {max_bytes} bytes"
+
+
+class InvalidPayloadException(HTTPException):
+    """
+    Raised when a compose payload isn't a JSON object, or is nested deeper than allowed
+    """
+
+    def __init__(self, message: str) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        self.detail = f"Invalid payload: {message}"
+
+
+class PageLimitExceededException(HTTPException):
+    """
+    Raised when a composed document would have more pages than allowed
+    """
+
+    def __init__(self, max_pages: int) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        self.detail = f"The composed document would have more than the maximum of {max_pages} pages"
+
+
+class RenderMemoryExceededException(HTTPException):
+    """
+    Raised when rendering a document needs more memory than allowed
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        self.detail = "Rendering the document needs more memory than allowed"
+
+
+class InvalidIdempotencyKeyException(HTTPException):
+    """
+    Raised when the given idempotency key is empty or too long
+    """
+
+    def __init__(self, max_length: int) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_400_BAD_REQUEST
+        self.detail = f"The idempotency key must have between 1 and {max_length} characters"
+
+
+class IdempotencyKeyConflictException(HTTPException):
+    """
+    Raised when the given idempotency key was already used for a different request
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        self.detail = "The idempotency key was already used for a different request"
+
+
+class RangeNotSatisfiableException(HTTPException):
+    """
+    Raised when the requested byte range doesn't overlap the composed file
+    """
+
+    def __init__(self, size: int) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        self.detail = "The requested range is not satisfiable"
+        self.headers = {"Content-Range": f"bytes */{size}"}
+
+
+class RenderJobFailedException(HTTPException):
+    """
+    Raised when a render job sent to the render farm failed
+    """
+
+    def __init__(self, message: str) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        self.detail = f"The render failed: {message}"
+
+
+class RenderTimeoutException(HTTPException):
+    """
+    Raised when a render job sent to the render farm isn't done in time
+    """
+
+    def __init__(self, timeout_seconds: float) -> None:
+        """
+        Constructor Method
+        """
+        self.status_code = status.HTTP_504_GATEWAY_TIMEOUT
+        self.detail = f"The render wasn't done within {timeout_seconds:g} seconds"
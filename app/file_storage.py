@@ -1,16 +1,30 @@
+import fcntl
+import hashlib
 import json
+import logging
+import os
 import pathlib
+import shutil
+import tempfile
+import threading
 from abc import ABC
+from contextlib import contextmanager
 from enum import Enum
-from typing import Dict, Any
+from typing import BinaryIO, Callable, Dict, Any, Iterator, Set
 
-from smart_open import s3
-from google.cloud.storage import Client
 from sqlalchemy.orm import Session
 
 from app.models.template import Template
 from app.settings import get_settings
-from app.util.path_util import base_static_path, template_path
+from app.util.path_util import base_static_path, template_path, template_directory_path, template_static_path
+
+# how often the template watcher wakes up when nothing changes
+WATCH_TIMEOUT_MS = 500
+# in a local template directory, shared by every process using it
+TEMPLATE_FILES_LOCK_FILE_NAME = ".templates.lock"
+LOADED_TEMPLATES_DIRECTORY_NAME = ".loaded"
+
+logger = logging.getLogger(__name__)
 
 
 class StorageType(str, Enum):
@@ -41,25 +55,246 @@ class NoIndexTemplateFound(FileStorageError):
         super().__init__(f"No index template file found. Template_id: {template_id}")
 
 
+class BlobStore:
+    """
+    Content-addressed store which keeps a single read-only copy of every unique file, named after the SHA-256
+    digest of its content. Files are placed in their final location through hardlinks to the stored blob,
+    so identical fonts and images shared by several templates only take up disk space once.
+
+    The store may be shared by several processes (e.g. gunicorn workers and render workers). A blob isn't
+    linked from any template directory until it's placed, so blobs are stored and placed within `writing()`, which
+    keeps `prune()` from removing them in the meantime.
+
+        Typical usage:
+
+            with blob_store.writing():
+                digest = blob_store.put(content)
+                blob_store.link(digest, target)
+    """
+    BLOB_MODE = 0o444
+    LOCK_FILE_NAME = ".lock"
+
+    def __init__(self, root_directory: str):
+        self.root_directory = root_directory
+
+    def blob_path(self, digest: str) -> pathlib.Path:
+        """
+        Path for the blob with the given digest. Blobs are sharded by the first two characters of the digest.
+
+        Args:
+            digest (str): the SHA-256 hex digest of the blob content
+
+        Returns:
+            pathlib.Path: the path of the blob
+        """
+        return pathlib.Path(self.root_directory, digest[:2], digest)
+
+    @contextmanager
+    def _lock(self, operation: int) -> Iterator[None]:
+        """
+        Holds a lock on the store, shared by every process using it.
+
+        Args:
+            operation (int): fcntl.LOCK_SH or fcntl.LOCK_EX
+        """
+        pathlib.Path(self.root_directory).mkdir(parents=True, exist_ok=True)
+        with open(pathlib.Path(self.root_directory, self.LOCK_FILE_NAME), mode="a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """
+        Context in which blobs are stored and placed. Several processes may write at once, but blobs aren't pruned
+        until every one of them is done.
+        """
+        with self._lock(fcntl.LOCK_SH):
+            yield
+
+    def put(self, content: bytes) -> str:
+        """
+        Stores the given content, unless a blob with the same content is already stored.
+
+        Args:
+            content (bytes): the file content
+
+        Returns:
+            str: the SHA-256 hex digest of the content
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest)
+        if path.is_file():
+            return digest
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so a concurrent reader never finds a partially written blob
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as temp_file:
+            temp_file.write(content)
+        os.chmod(temp_file.name, self.BLOB_MODE)
+        os.replace(temp_file.name, path)
+        return digest
+
+    def put_stream(self, stream: BinaryIO, chunk_size: int = 1024 * 1024) -> str:
+        """
+        Stores the content read from the given stream, hashing it while it's written to disk,
+        so the content never has to be fully held in memory.
+
+        Args:
+            stream (BinaryIO): the stream to read the file content from
+            chunk_size (int): the size of the chunks read from the stream
+
+        Returns:
+            str: the SHA-256 hex digest of the content
+        """
+        pathlib.Path(self.root_directory).mkdir(parents=True, exist_ok=True)
+        sha256 = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.root_directory, delete=False) as temp_file:
+            while chunk := stream.read(chunk_size):
+                sha256.update(chunk)
+                temp_file.write(chunk)
+
+        digest = sha256.hexdigest()
+        path = self.blob_path(digest)
+        if path.is_file():
+            os.unlink(temp_file.name)
+            return digest
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.chmod(temp_file.name, self.BLOB_MODE)
+        os.replace(temp_file.name, path)
+        return digest
+
+    def link(self, digest: str, target: pathlib.Path) -> None:
+        """
+        Places the blob with the given digest at the target path, replacing any existing file.
+        Falls back to a copy when a hardlink is not possible (e.g. the target is on another filesystem).
+
+        Args:
+            digest (str): the SHA-256 hex digest of the blob
+            target (pathlib.Path): the path where the file should be available
+        """
+        blob = self.blob_path(digest)
+        if target.exists():
+            if target.samefile(blob):
+                return
+            target.unlink()
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(blob, target)
+        except OSError:
+            shutil.copyfile(blob, target)
+
+    def prune(self) -> int:
+        """
+        Removes every blob which is no longer linked from any template directory. Waits for every process storing
+        blobs (see `writing()`) to be done, so blobs which are stored but not placed yet are kept.
+
+        Returns:
+            int: the number of removed blobs
+        """
+        removed = 0
+        with self._lock(fcntl.LOCK_EX):
+            for blob in pathlib.Path(self.root_directory).glob("*/*"):
+                if blob.is_file() and blob.stat().st_nlink == 1:
+                    blob.unlink()
+                    removed += 1
+        return removed
+
+
+@contextmanager
+def template_files_lock(target_directory: str) -> Iterator[None]:
+    """
+    Holds an exclusive lock on a local template directory, shared by every process using it (e.g. gunicorn workers),
+    so only one of them replaces the files of a template at a time.
+
+    Args:
+        target_directory: The local directory holding the templates
+    """
+    pathlib.Path(target_directory).mkdir(parents=True, exist_ok=True)
+    with open(pathlib.Path(target_directory, TEMPLATE_FILES_LOCK_FILE_NAME), mode="a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _loaded_marker_path(target_directory: str, template_id: str) -> pathlib.Path:
+    return pathlib.Path(target_directory, LOADED_TEMPLATES_DIRECTORY_NAME, template_id)
+
+
+def template_loaded_at(target_directory: str, template_id: str) -> float | None:
+    """
+    Tells when the local files of a template were last updated, as recorded by `replace_template_files`.
+
+    Args:
+        target_directory: The local directory holding the templates
+        template_id: The id of the template
+
+    Returns:
+        The epoch timestamp the template was updated at in the DB, or None if unknown
+    """
+    try:
+        return float(_loaded_marker_path(target_directory, template_id).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def replace_template_files(template_id: str, staging_directory: str, target_directory: str,
+                           updated_at: float | None = None) -> None:
+    """
+    Moves the staged template and static files of a template in place of the live ones, so renders never find them
+    missing. The replaced files are moved into the staging directory, to be removed along with it. Must be called
+    within `template_files_lock`.
+
+    Args:
+        template_id: The id of the template
+        staging_directory: The directory the new files were written to, laid out like the target directory
+        target_directory: The local directory holding the templates
+        updated_at: When the template was updated in the DB, as an epoch timestamp, if known
+    """
+    for directory_path in (template_directory_path, template_static_path):
+        live_directory = pathlib.Path(directory_path(target_directory, template_id))
+        staged_directory = pathlib.Path(directory_path(staging_directory, template_id))
+        if live_directory.exists():
+            replaced_directory = pathlib.Path(directory_path(f"{staging_directory}/replaced", template_id))
+            replaced_directory.parent.mkdir(parents=True, exist_ok=True)
+            live_directory.rename(replaced_directory)
+        if staged_directory.exists():
+            live_directory.parent.mkdir(parents=True, exist_ok=True)
+            staged_directory.rename(live_directory)
+
+    loaded_marker = _loaded_marker_path(target_directory, template_id)
+    if updated_at is None:
+        loaded_marker.unlink(missing_ok=True)
+    else:
+        loaded_marker.parent.mkdir(exist_ok=True)
+        loaded_marker.write_text(repr(updated_at))
+
+
 class PlatoFileStorage(ABC):
     def __init__(self, data_directory: str):
         self.files_directory_name = data_directory
+        self.blob_store = BlobStore(f"{data_directory}/blobs")
 
-    @staticmethod
-    def write_files(files: Dict[str, Any], target_directory: str) -> None:
+    def write_files(self, files: Dict[str, Any], target_directory: str) -> None:
         """
-        Write files to a supplied target directory
+        Write files to a supplied target directory. Each unique file content is stored only once in the
+        blob store, and hardlinked into the target directory.
 
         Args:
             files (Dict[str, Any]): a dict representing files needing to be written in the target directory
                 with key as the file url and the value as file content
             target_directory (str): the directory all the files will reside in
         """
-        for key, content in files.items():
-            path = pathlib.Path(f"{target_directory}/{key}")
-            path.parent.mkdir(parents=True, exist_ok=True)
-            with open(path, mode="wb") as file:
-                file.write(content)
+        with self.blob_store.writing():
+            for key, content in files.items():
+                digest = self.blob_store.put(content)
+                self.blob_store.link(digest, pathlib.Path(f"{target_directory}/{key}"))
 
     def get_file(self, path: str, template_directory: str) -> Dict[str, Any]:
         """
@@ -103,10 +338,105 @@ class PlatoFileStorage(ABC):
                 raise NoIndexTemplateFound(template.id)
             self.write_files(files=template_files, target_directory=target_directory)
 
+        self.blob_store.prune()
+
+    def put_file(self, path: str, file: BinaryIO) -> None:
+        """
+        Uploads a file to the storage service, streaming its content.
+        Note: This method does nothing if the file storage is disk, as files are written straight to the
+        template directory
+
+        Args:
+            path (str): the url the file will be available at
+            file (BinaryIO): the file content
+        """
+        pass
+
+    def load_template(self, target_directory: str, template_directory_name: str, template_id: str,
+                      updated_at: float | None = None) -> None:
+        """
+        Gets the files of a single template, and its static files, from the bucket, replacing the local ones.
+        Note: This method does nothing if the file storage is disk
+
+        Every process sharing the target directory loads a template when it changes, but only the first one downloads
+        it: the others find the local files are already as recent as the change, and only have to clear their caches.
+        The files are downloaded into a staging directory, which then replaces the local one.
+
+        Args:
+            target_directory: Target directory to store the template in
+            template_directory_name: Base directory
+            template_id: The id of the template
+            updated_at: When the template was updated in the DB, as an epoch timestamp. If unknown, the template is
+                always downloaded
+        """
+        if type(self) == DiskFileStorage: return
+
+        with template_files_lock(target_directory):
+            loaded_at = template_loaded_at(target_directory, template_id)
+            if updated_at is not None and loaded_at is not None and loaded_at >= updated_at:
+                return
+
+            template_files = self.get_file(path=template_directory_path(template_directory_name, template_id),
+                                           template_directory=template_directory_name)
+            if not template_files:
+                raise NoIndexTemplateFound(template_id)
+
+            static_files = self.get_file(path=template_static_path(template_directory_name, template_id),
+                                         template_directory=template_directory_name)
+
+            with tempfile.TemporaryDirectory(dir=target_directory, prefix=".load-") as staging_directory:
+                self.write_files(files={**template_files, **static_files}, target_directory=staging_directory)
+                replace_template_files(template_id, staging_directory, target_directory, updated_at)
+
 
 class DiskFileStorage(PlatoFileStorage):
     def __init__(self, data_directory: str):
         super().__init__(data_directory)
+        self._watch_stop_event: threading.Event | None = None
+
+    def watch(self, target_directory: str, on_change: Callable[[Set[str]], None]) -> threading.Event:
+        """
+        Starts watching the target directory for changes in a background thread (inotify based on Linux).
+        Changes are debounced and reported in batches. Errors raised by `on_change` are logged, and watching goes on.
+
+        Args:
+            target_directory: The directory holding the templates and their static files
+            on_change: Called with the set of changed paths (created, modified or deleted) after every batch of changes
+
+        Returns:
+            threading.Event: Set once the watcher is registered, so changes made from then on are reported
+        """
+        from watchfiles import watch
+
+        self.stop_watching()
+        stop_event = threading.Event()
+        ready = threading.Event()
+
+        def watch_loop():
+            try:
+                for changes in watch(target_directory, stop_event=stop_event, recursive=True, yield_on_timeout=True,
+                                     rust_timeout=WATCH_TIMEOUT_MS):
+                    ready.set()
+                    if not changes:
+                        continue
+                    try:
+                        on_change({path for _, path in changes})
+                    except Exception:
+                        logger.exception("Failed to handle changes to the files in %s", target_directory)
+            except Exception:
+                logger.exception("Stopped watching %s", target_directory)
+
+        threading.Thread(target=watch_loop, name="plato-template-watcher", daemon=True).start()
+        self._watch_stop_event = stop_event
+        return ready
+
+    def stop_watching(self) -> None:
+        """
+        Stops watching for changes, if a watch was started.
+        """
+        if self._watch_stop_event is not None:
+            self._watch_stop_event.set()
+            self._watch_stop_event = None
 
 
 class S3FileStorage(PlatoFileStorage):
@@ -127,6 +457,8 @@ class S3FileStorage(PlatoFileStorage):
         Returns:
          A dictionary with key as file's relative location on s3-bucket and value as file's content
         """
+        from smart_open import s3
+
         key_content_mapping: dict = {}
         for key, content in s3.iter_bucket(bucket_name=self.bucket_name, prefix=path, **self.aws_credentials_dict):
             if key[-1] == '/' or not content:
@@ -137,6 +469,21 @@ class S3FileStorage(PlatoFileStorage):
             key_content_mapping[new_key] = content
         return key_content_mapping
 
+    def put_file(self, path: str, file: BinaryIO) -> None:
+        """
+        Uploads a file to S3, streaming it through a multipart upload
+
+        Args:
+            path (str): the s3-bucket key the file will be available at
+            file (BinaryIO): the file content
+        """
+        import boto3
+        from smart_open import s3
+
+        client = boto3.Session(**self.aws_credentials_dict).client("s3")
+        with s3.open(self.bucket_name, path, "wb", client=client) as s3_file:
+            shutil.copyfileobj(file, s3_file)
+
     @staticmethod
     def get_aws_credentials(path_to_file: str) -> Dict[str, Any]:
         try:
@@ -154,6 +501,9 @@ class GCSFileStorage(PlatoFileStorage):
     def __init__(self, data_directory: str, bucket_name: str):
         super().__init__(data_directory)
         self.bucket_name = bucket_name
+
+        from google.cloud.storage import Client
+
         self.gcs_client = Client.from_service_account_json(f"{get_settings().CREDENTIALS_DIR}/service_account_key.json")
 
     def get_file(self, path: str, template_directory: str) -> Dict[str, Any]:
@@ -176,4 +526,14 @@ class GCSFileStorage(PlatoFileStorage):
             key_content_mapping[new_key] = blob.download_as_bytes()
         return key_content_mapping
 
+    def put_file(self, path: str, file: BinaryIO) -> None:
+        """
+        Uploads a file to GCS, streaming it through a resumable upload
+
+        Args:
+            path (str): the gcs-bucket path the file will be available at
+            file (BinaryIO): the file content
+        """
+        self.gcs_client.bucket(self.bucket_name).blob(path).upload_from_file(file)
+
 
@@ -1,43 +1,139 @@
-from contextlib import asynccontextmanager
+import io
+import json
+import time
+from contextlib import asynccontextmanager, contextmanager
 from mimetypes import guess_extension
-from typing import Callable, List, Annotated
+from typing import Callable, Iterator, List, Annotated, Set
 
 from accept_types import get_best_match
-from fastapi import Body, Depends, FastAPI, Query, Header
+from fastapi import Depends, FastAPI, File, Query, Header, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from jinja2 import Environment as JinjaEnv
 from jsonschema import ValidationError
-from sqlalchemy import ARRAY, String, cast as db_cast
-from sqlalchemy.orm import Session, Query as SqlQuery
+from sqlalchemy import ARRAY, ColumnElement, String, cast as db_cast
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette import status
 
-from app.compose.renderer import InvalidPageNumber, Renderer, RendererNotFound, compose
-from app.db.session import db_session
-from app.deps import get_db, get_jinja_env, get_template_static_directory
+from app.compose.examples import discard_examples, example_key, get_example, prerender_examples
+from app.compose.idempotency import MAX_IDEMPOTENCY_KEY_LENGTH, IdempotencyKeyReused, idempotency_store
+from app.compose.job_queue import RenderJobFailed, RenderJobTimeout, job_queue
+from app.compose.layout_cache import layout_cache
+from app.compose.limits import PageLimitExceeded
+from app.compose.render_pool import RENDER_THREAD_NAME_PREFIX, RenderPriorityEnum, render_pool
+from app.compose.renderer import InvalidPageNumber, LayoutUnsupported, Renderer, RendererNotFound, compose, \
+    layout
+from app.db.notifications import TemplateChangeListener
+from app.db.session import async_engine, db_session
+from app.db.template_json import ALL_TEMPLATE_FIELDS, catalogue_version_query, template_json_query, \
+    template_list_json_query, template_version_query
+from app.deps import get_async_db, get_db, get_jinja_env, get_template_static_directory, get_file_storage, get_template_directory, \
+    require_admin_key, get_profile_request, get_compose_payload
 from app.exceptions import UnsupportedMIMEType, PNGCompositionUnavailable, UnsupportedResizingException, \
     SinglePageUnsupportedException, TemplateNotFoundException, InvalidPageNumberException, \
-    JSONSchemaVerificationErrorException
+    JSONSchemaVerificationErrorException, InvalidTemplateBundleException, ProfileNotFoundException, \
+    ProfilerBusyException, PageLimitExceededException, RenderMemoryExceededException, PdfOptionsUnsupportedException, \
+    RangeNotSatisfiableException, InvalidIdempotencyKeyException, IdempotencyKeyConflictException, \
+    RenderJobFailedException, RenderTimeoutException, LayoutUnsupportedException
+from app.file_storage import PlatoFileStorage
+from app.metrics import COMPOSE_OUTPUT_BYTES, COMPOSE_STAGE_SECONDS, HTTP_REQUEST_SECONDS, HTTP_REQUESTS, \
+    PROMETHEUS_CONTENT_TYPE, TEMPLATE_SYNC_SECONDS, MetricsDirectory, render_metrics
 from app.models.template import Template
+from app.preload import prepare_templates
+from app.profiling import PROFILE_ID_PATTERN, ProfileKindEnum, ProfileRequest, ProfilerBusy, StackSampler, \
+    cpu_profile_path, memory_profile_path, profiled
+from app.publish import InvalidTemplateBundle, publish_template
 from app.schemas.compose import ComposeBaseSchema, ComposeSchema
-from app.schemas.template_detail import TemplateDetailSchema, MIMETypeEnum
+from app.schemas.layout import LayoutSchema, PageSizeSchema
+from app.schemas.template_detail import TemplateDetailSchema, MIMETypeEnum, TemplatePartialSchema, TemplateFieldEnum, \
+    TagsMatchEnum
 from app.settings import get_settings
-from app.util.setup_util import create_template_environment, initialize_file_storage
+from app.util.cache_util import invalidate_changed_files, invalidate_template
+from app.util.http_util import RangeNotSatisfiable, encode_content, etag_matches, negotiate_encoding, \
+    parse_byte_range, strong_etag
+from app.util.timing_util import timed_stage, track_stages
 
 ALL_AVAILABLE_MIME_TYPES = list(Renderer.renderers.keys())
+COMPRESSIBLE_MIME_TYPES = {MIMETypeEnum.HTML_MIME.value}
+
+MAX_TEMPLATES_PAGE_SIZE = 1000
+SUMMARY_FIELDS = [TemplateFieldEnum.TEMPLATE_ID, TemplateFieldEnum.TAGS]
 
 
 @asynccontextmanager
 async def lifespan(api: FastAPI):
     settings = get_settings()
-    api.state.file_storage = initialize_file_storage(settings.STORAGE_TYPE, settings.DATA_DIR, settings.BUCKET_NAME)
+    # already done by the server's master process when preloading (see app.preload)
+    if not getattr(api.state, "preloaded", False):
+        prepare_templates(api.state)
+    watch_templates = api.state.watch_templates
+
+    def refresh_examples(template_ids: Set[str] | None) -> None:
+        """
+        Discards the examples and cached layouts of the given templates (or every template, if None), pre-rendering
+        the examples again.
+        """
+        if template_ids is None:
+            discard_examples()
+            layout_cache.discard()
+        for template_id in template_ids or []:
+            discard_examples(template_id)
+            layout_cache.discard(template_id)
+
+        if not settings.PRERENDER_EXAMPLES:
+            return
+        with db_session() as db:
+            query = db.query(Template)
+            if template_ids is not None:
+                query = query.filter(Template.id.in_(template_ids))
+            for template in query:
+                prerender_examples(template, api.state.jinja_env, api.state.template_static_directory)
+
+    # examples are pre-rendered by the master process when preloading, and otherwise rendered on first use, rather
+    # than by every worker on startup
 
-    with db_session() as db:
-        api.state.file_storage.load_templates(settings.TEMPLATE_DIRECTORY, settings.TEMPLATE_DIRECTORY_NAME, db)
+    if watch_templates:
+        api.state.file_storage.watch(
+            settings.TEMPLATE_DIRECTORY,
+            lambda changed_paths: refresh_examples(
+                invalidate_changed_files(api.state.jinja_env, settings.TEMPLATE_DIRECTORY, changed_paths)
+            )
+        )
 
-    api.state.jinja_env = create_template_environment(settings.TEMPLATE_DIRECTORY)
-    api.state.template_static_directory = f"{settings.TEMPLATE_DIRECTORY}/static"
+    def refresh_template(template_id: str, updated_at: float | None) -> None:
+        with TEMPLATE_SYNC_SECONDS.time(operation="refresh"):
+            api.state.file_storage.load_template(settings.TEMPLATE_DIRECTORY, settings.TEMPLATE_DIRECTORY_NAME,
+                                                 template_id, updated_at)
+        invalidate_template(api.state.jinja_env, template_id)
+        refresh_examples({template_id})
+
+    # templates published through other nodes
+    template_change_listener = TemplateChangeListener(settings.SQLALCHEMY_DATABASE_URI, refresh_template)
+    template_change_listener.start()
+
+    if settings.CONTINUOUS_PROFILING_INTERVAL > 0:
+        api.state.stack_sampler = StackSampler(settings.CONTINUOUS_PROFILING_INTERVAL, RENDER_THREAD_NAME_PREFIX)
+        api.state.stack_sampler.start()
+
+    # metrics shared with the other worker processes of the server (see gunicorn.conf.py)
+    api.state.metrics_directory = MetricsDirectory(settings.METRICS_DIRECTORY) if settings.METRICS_DIRECTORY else None
+    if api.state.metrics_directory is not None:
+        api.state.metrics_directory.start_writing()
     yield
 
+    if settings.CONTINUOUS_PROFILING_INTERVAL > 0:
+        api.state.stack_sampler.stop()
+
+    template_change_listener.stop()
+    if watch_templates:
+        api.state.file_storage.stop_watching()
+    render_pool.shutdown(wait=False)
+    await async_engine.dispose()
+    # last, so the metrics of the requests served until the process exits are kept
+    if api.state.metrics_directory is not None:
+        api.state.metrics_directory.stop_writing()
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -50,79 +146,389 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next: Callable) -> Response:
+    start = time.perf_counter()
+    response = await call_next(request)
+    # labelled by the route's path template (e.g. /templates/{template_id}), not the requested path
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route_path)
+    HTTP_REQUESTS.inc(method=request.method, route=route_path, status=str(response.status_code))
+    return response
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics(request: Request) -> Response:
+    """
+    Metrics of every worker process of the server, or of this process if they don't share a metrics directory, in
+    the Prometheus text format.
+    """
+    metrics_directory = getattr(request.app.state, "metrics_directory", None)
+    content = metrics_directory.render() if metrics_directory is not None else render_metrics()
+    return Response(content=content, media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.get("/templates/{template_id}", response_model=TemplateDetailSchema)
-def template_by_id(template_id: str, db: Annotated[Session, Depends(get_db)]) -> Template:
+async def template_by_id(template_id: str, db: Annotated[AsyncSession, Depends(get_async_db)],
+                         if_none_match: Annotated[str | None, Header()] = None) -> Response:
+    """
+    Gets a template's details. The JSON document is built by the database, matching TemplateDetailSchema.
+
+    Responses carry an ETag derived from the template's version; when it matches the `If-None-Match` header,
+    an empty 304 response is returned instead.
+    """
+    if if_none_match is not None:
+        version = (await db.execute(template_version_query(template_id))).one_or_none()
+        if version is None:
+            raise TemplateNotFoundException(template_id)
+        etag = strong_etag(template_id, *version)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
 
-    template = db.query(Template).filter_by(id=template_id).one_or_none()
-    if template is None:
+    row = (await db.execute(template_json_query(template_id))).one_or_none()
+    if row is None:
         raise TemplateNotFoundException(template_id)
 
-    return template
+    document, *version = row
+    return Response(content=document, media_type="application/json",
+                    headers={"ETag": strong_etag(template_id, *version), "Cache-Control": "no-cache"})
 
 
-@app.get("/templates", response_model=List[TemplateDetailSchema])
-def templates(db: Annotated[Session, Depends(get_db)], tags: Annotated[List[str] | None, Query(...)] = None) -> List[Template]:
-    template_query: SqlQuery = db.query(Template)
+def tags_filter(tags: List[str], tags_match: TagsMatchEnum) -> ColumnElement[bool]:
+    """
+    Filter for templates having all (or any) of the given tags. Both are served by the GIN index on the tags column.
+    """
+    tags_array = db_cast(tags, ARRAY(String))
+    if tags_match == TagsMatchEnum.ANY:
+        return Template.tags.overlap(tags_array)
+    return Template.tags.contains(tags_array)
 
-    if tags:
-        template_query = template_query.filter(Template.tags.contains(db_cast(tags, ARRAY(String))))
 
-    return template_query.all()
+@app.get("/templates", response_model=List[TemplatePartialSchema], response_model_exclude_unset=True)
+async def templates(request: Request, db: Annotated[AsyncSession, Depends(get_async_db)],
+                    tags: Annotated[List[str] | None, Query(...)] = None,
+                    tags_match: TagsMatchEnum = TagsMatchEnum.ALL,
+                    limit: Annotated[int | None, Query(ge=1, le=MAX_TEMPLATES_PAGE_SIZE)] = None,
+                    after: Annotated[str | None, Query()] = None,
+                    fields: Annotated[List[TemplateFieldEnum] | None, Query()] = None,
+                    summary: bool = False,
+                    if_none_match: Annotated[str | None, Header()] = None) -> Response:
+    """
+    Lists templates, optionally filtered by tags: by default templates must have all the given tags, or any of them
+    if `tags_match` is `any`.
 
+    Pages are requested with `limit`; when more templates may be available, the `X-Next-Cursor` response header holds
+    the cursor to be given as `after` to get the next page. `fields` restricts the response to the given fields, and
+    `summary` to the templates' ids and tags.
 
-@app.post("/template/{template_id}/compose", response_model=None)
-def compose_file(template_id: str, compose_file_schema: Annotated[ComposeSchema, Query(...)],
-                 payload: Annotated[dict, Body(...)], jinja_env: Annotated[JinjaEnv, Depends(get_jinja_env)],
+    The JSON array is built by the database, matching TemplateDetailSchema, so templates are never loaded as
+    ORM objects.
+
+    Responses carry an ETag derived from the versions of every matching template and the query parameters;
+    when it matches the `If-None-Match` header, an empty 304 response is returned without building the documents.
+    """
+    if summary:
+        fields = SUMMARY_FIELDS
+
+    filters = [tags_filter(tags, tags_match)] if tags else []
+    etag = strong_etag(*(await db.execute(catalogue_version_query(*filters))).one(), request.url.query)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    query = template_list_json_query(*filters, fields=fields or ALL_TEMPLATE_FIELDS, after=after, limit=limit)
+    documents, count, last_template_id = (await db.execute(query)).one()
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if limit is not None and count == limit:
+        headers["X-Next-Cursor"] = last_template_id
+    return Response(content=documents, media_type="application/json", headers=headers)
+
+
+@app.put("/templates/{template_id}", response_model=TemplateDetailSchema, dependencies=[Depends(require_admin_key)])
+def publish(template_id: str, bundle: Annotated[UploadFile, File(...)], db: Annotated[Session, Depends(get_db)],
+            jinja_env: Annotated[JinjaEnv, Depends(get_jinja_env)],
+            file_storage: Annotated[PlatoFileStorage, Depends(get_file_storage)],
+            template_directory: Annotated[str, Depends(get_template_directory)],
+            template_static_directory: Annotated[str, Depends(get_template_static_directory)]) -> Template:
+    settings = get_settings()
+    try:
+        with TEMPLATE_SYNC_SECONDS.time(operation="publish"):
+            template = publish_template(template_id, bundle.file, file_storage, db, jinja_env, template_directory,
+                                        settings.TEMPLATE_DIRECTORY_NAME)
+    except InvalidTemplateBundle as e:
+        raise InvalidTemplateBundleException(e.message) from e
+
+    if settings.PRERENDER_EXAMPLES:
+        prerender_examples(template, jinja_env, template_static_directory)
+    return template
+
+
+@app.post("/template/{template_id}/compose", response_model=None,
+          openapi_extra={"requestBody": {"required": True,
+                                         "content": {"application/json": {"schema": {"type": "object"}}}}})
+def compose_file(request: Request, template_id: str, compose_file_schema: Annotated[ComposeSchema, Query(...)],
+                 payload: Annotated[dict, Depends(get_compose_payload)],
+                 jinja_env: Annotated[JinjaEnv, Depends(get_jinja_env)],
                  template_static_directory: Annotated[str, Depends(get_template_static_directory)],
                  db: Annotated[Session, Depends(get_db)],
-                 custom_accept: Annotated[str | None, Header(...)] = None) -> StreamingResponse:
-    return _compose(db, jinja_env, template_static_directory,
-                    lambda t: payload, template_id, "compose", compose_file_schema, custom_accept)
+                 profile_request: Annotated[ProfileRequest | None, Depends(get_profile_request)],
+                 custom_accept: Annotated[str | None, Header(...)] = None,
+                 idempotency_key: Annotated[str | None, Header()] = None,
+                 x_plato_priority: Annotated[RenderPriorityEnum, Header()] = RenderPriorityEnum.INTERACTIVE,
+                 x_plato_caller: Annotated[str | None, Header()] = None) -> Response:
+    """
+    Composes a template with the given payload.
+
+    Renders are queued by the priority class in the `X-Plato-Priority` header: `interactive` (the default) renders
+    run before `bulk` ones, which only use the remaining capacity. Within a class, renders are shared fairly between
+    callers, identified by the `X-Plato-Caller` header, or between templates for requests without it.
+
+    Retries of a request sent with an `Idempotency-Key` header get the result of the first request with that key
+    (waiting for it, if it's still rendering) instead of rendering it again, marked by the `Idempotent-Replayed`
+    response header, for IDEMPOTENCY_WINDOW_SECONDS.
+    """
+    return _compose(request, db, jinja_env, template_static_directory,
+                    lambda t: payload, template_id, "compose", compose_file_schema, custom_accept,
+                    profile_request=profile_request, idempotency_key=idempotency_key, priority=x_plato_priority,
+                    flow=x_plato_caller or template_id)
+
+
+@app.post("/template/{template_id}/layout", response_model=LayoutSchema,
+          openapi_extra={"requestBody": {"required": True,
+                                         "content": {"application/json": {"schema": {"type": "object"}}}}})
+def layout_composition(template_id: str, compose_file_schema: Annotated[ComposeSchema, Query(...)],
+                       payload: Annotated[dict, Depends(get_compose_payload)],
+                       jinja_env: Annotated[JinjaEnv, Depends(get_jinja_env)],
+                       template_static_directory: Annotated[str, Depends(get_template_static_directory)],
+                       db: Annotated[Session, Depends(get_db)],
+                       custom_accept: Annotated[str | None, Header(...)] = None,
+                       x_plato_priority: Annotated[RenderPriorityEnum, Header()] = RenderPriorityEnum.INTERACTIVE,
+                       x_plato_caller: Annotated[str | None, Header()] = None) -> Response:
+    """
+    Lays out a template composed with the given payload, as it would be for the requested MIME type (PDF by default,
+    or PNG), returning its number of pages and their size, without writing the composed file.
+
+    The layout is cached, so composing the same payload afterwards with the same options, or any of its pages as PNG,
+    doesn't lay it out again. Layouts are always done by the server, even with RENDER_FARM enabled.
+    """
+    mime_type = _output_mime_type(custom_accept, compose_file_schema)
+    with track_stages() as timings:
+        with timed_stage("db"):
+            template_model: Template | None = db.query(Template).filter_by(id=template_id).one_or_none()
+        if template_model is None:
+            raise TemplateNotFoundException(template_id)
+
+        with _render_errors(compose_file_schema):
+            page_sizes, cached = render_pool.run(layout, template_model, payload, mime_type, jinja_env,
+                                                 template_static_directory, priority=x_plato_priority,
+                                                 flow=x_plato_caller or template_id,
+                                                 **compose_file_schema.model_dump(exclude_none=True))
+
+    document = LayoutSchema(pages=len(page_sizes), cached=cached, timings=timings.stages,
+                            page_sizes=[PageSizeSchema(width=width, height=height) for width, height in page_sizes])
+    return Response(content=document.model_dump_json(), media_type="application/json",
+                    headers={"Server-Timing": timings.server_timing()})
 
 
 @app.get("/template/{template_id}/example", response_model=None)
-def example_compose(template_id: str, compose_file_schema: Annotated[ComposeSchema, Query(...)],
+def example_compose(request: Request, template_id: str, compose_file_schema: Annotated[ComposeSchema, Query(...)],
                     jinja_env: Annotated[JinjaEnv, Depends(get_jinja_env)],
                     template_static_directory: Annotated[str, Depends(get_template_static_directory)],
                     db: Annotated[Session, Depends(get_db)],
-                    custom_accept: Annotated[str | None, Header(...)] = None) -> StreamingResponse:
-    return _compose(db, jinja_env, template_static_directory,
-                    lambda t: t.example_composition, template_id, "example", compose_file_schema, custom_accept)
+                    profile_request: Annotated[ProfileRequest | None, Depends(get_profile_request)],
+                    custom_accept: Annotated[str | None, Header(...)] = None) -> Response:
+    """
+    Composes a template's example. Examples are pre-rendered when templates are loaded, and served from the output
+    cache, unless profiling is requested. Cached examples support byte range requests (e.g. to resume downloads),
+    validated with `If-Range` against their ETag.
+    """
+    return _compose(request, db, jinja_env, template_static_directory,
+                    lambda t: t.example_composition, template_id, "example", compose_file_schema, custom_accept,
+                    use_example_cache=profile_request is None, profile_request=profile_request)
 
 
-def _compose(db: Session, jinja_env: JinjaEnv, template_static_directory: str,
+def _compose(request: Request, db: Session, jinja_env: JinjaEnv, template_static_directory: str,
              compose_retrieval_function: Callable[[Template], dict], template_id: str, file_name: str,
-             compose_schema: ComposeBaseSchema, custom_accept: str | None) -> StreamingResponse:
+             compose_schema: ComposeBaseSchema, custom_accept: str | None,
+             use_example_cache: bool = False, profile_request: ProfileRequest | None = None,
+             idempotency_key: str | None = None, priority: RenderPriorityEnum = RenderPriorityEnum.INTERACTIVE,
+             flow: str | None = None) -> Response:
+    mime_type = _output_mime_type(custom_accept, compose_schema)
+    if mime_type == MIMETypeEnum.PNG_MIME:
+        raise PNGCompositionUnavailable()
+
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise InvalidIdempotencyKeyException(MAX_IDEMPOTENCY_KEY_LENGTH)
+
+    replayed = False
+    with track_stages() as timings:
+        with timed_stage("db"):
+            template_model: Template | None = db.query(Template).filter_by(id=template_id).one_or_none()
+        if template_model is None:
+            raise TemplateNotFoundException(template_id)
+
+        with _render_errors(compose_schema):
+            if use_example_cache:
+                composed_file = get_example(template_model, mime_type, jinja_env, template_static_directory,
+                                            **compose_schema.model_dump(exclude_none=True))
+            else:
+                compose_data = compose_retrieval_function(template_model)
+                render = compose if profile_request is None else profiled(compose, profile_request,
+                                                                           get_settings().PROFILE_DIRECTORY,
+                                                                           render_pool)
+                options = compose_schema.model_dump(exclude_none=True)
+
+                def render_file() -> io.BytesIO:
+                    # profiled requests are rendered locally, where they can be profiled
+                    if get_settings().RENDER_FARM and profile_request is None:
+                        with timed_stage("farm"):
+                            return io.BytesIO(job_queue.run(template_id, compose_data, mime_type, options, priority))
+                    return render_pool.run(render, template_model, compose_data, mime_type, jinja_env,
+                                           template_static_directory, priority=priority, flow=flow, **options)
+
+                # profiled requests are always rendered, as their profile is what's requested
+                if idempotency_key is None or profile_request is not None:
+                    composed_file = render_file()
+                else:
+                    fingerprint = strong_etag(template_id, mime_type, sorted(options.items()),
+                                              json.dumps(compose_data, sort_keys=True))
+                    content, replayed = idempotency_store.run(idempotency_key, fingerprint,
+                                                              lambda: render_file().getvalue())
+                    composed_file = io.BytesIO(content)
+
+    for stage, seconds in timings.stages.items():
+        COMPOSE_STAGE_SECONDS.observe(seconds, stage=stage, template_id=template_id, mime_type=mime_type)
+    COMPOSE_OUTPUT_BYTES.observe(composed_file.getbuffer().nbytes, template_id=template_id, mime_type=mime_type)
+
+    headers = {
+        "Content-Disposition": f"attachment; filename={file_name}{guess_extension(mime_type)}",
+        "Server-Timing": timings.server_timing(),
+    }
+    if profile_request is not None:
+        headers["X-Profile-Id"] = profile_request.profile_id
+    if replayed:
+        headers["Idempotent-Replayed"] = "true"
+    # only outputs served from the output cache are stable enough to be requested in ranges
+    etag = strong_etag(*example_key(template_model, mime_type, **compose_schema.model_dump(exclude_none=True))) \
+        if use_example_cache else None
+    return _output_response(request, composed_file.getvalue(), mime_type, headers, etag)
+
+
+def _output_mime_type(custom_accept: str | None, compose_schema: ComposeBaseSchema) -> str:
+    """
+    Negotiates the MIME type of a composition, PDF by default, checking the given options apply to it.
+    """
     accept_header = custom_accept or MIMETypeEnum.PDF_MIME.value
     mime_type = get_best_match(accept_header, ALL_AVAILABLE_MIME_TYPES)
 
     if mime_type is None:
         raise UnsupportedMIMEType(accept_header)
 
-    if mime_type == MIMETypeEnum.PNG_MIME:
-        raise PNGCompositionUnavailable()
-
     if (compose_schema.width is not None or compose_schema.height is not None) and mime_type != MIMETypeEnum.PNG_MIME:
         raise UnsupportedResizingException(mime_type)
 
     if compose_schema.page is not None and mime_type != MIMETypeEnum.PNG_MIME:
         raise SinglePageUnsupportedException(mime_type)
 
-    template_model: Template | None = db.query(Template).filter_by(id=template_id).one_or_none()
-    if template_model is None:
-        raise TemplateNotFoundException(template_id)
+    if compose_schema.pdf_options() and mime_type != MIMETypeEnum.PDF_MIME:
+        raise PdfOptionsUnsupportedException(mime_type)
+    return mime_type
 
+
+@contextmanager
+def _render_errors(compose_schema: ComposeBaseSchema) -> Iterator[None]:
+    """
+    Raises the HTTP error matching each error a render can fail with.
+    """
     try:
-        compose_data = compose_retrieval_function(template_model)
-        composed_file = compose(template_model, compose_data, mime_type, jinja_env, template_static_directory,
-                                **compose_schema.model_dump(exclude_none=True))
-        return StreamingResponse(composed_file, media_type=mime_type,
-                                 headers={
-                                     "Content-Disposition": f"attachment; filename={file_name}{guess_extension(mime_type)}"
-                                 })
+        yield
     except RendererNotFound as e:
-        raise UnsupportedMIMEType(mime_type) from e
+        raise UnsupportedMIMEType(e.args[0]) from e
+    except LayoutUnsupported as e:
+        raise LayoutUnsupportedException(e.args[0]) from e
     except InvalidPageNumber as e:
         raise InvalidPageNumberException(compose_schema.page) from e
+    except PageLimitExceeded as e:
+        raise PageLimitExceededException(e.max_pages) from e
+    except MemoryError as e:
+        raise RenderMemoryExceededException() from e
     except ValidationError as ve:
         raise JSONSchemaVerificationErrorException() from ve
+    except IdempotencyKeyReused as e:
+        raise IdempotencyKeyConflictException() from e
+    except RenderJobFailed as e:
+        raise RenderJobFailedException(e.message) from e
+    except RenderJobTimeout as e:
+        raise RenderTimeoutException(job_queue.timeout_seconds) from e
+    except ProfilerBusy as e:
+        raise ProfilerBusyException() from e
+
+
+def _output_response(request: Request, content: bytes, mime_type: str, headers: dict,
+                     etag: str | None = None) -> Response:
+    """
+    Builds the response for a composed file, with its Content-Length. Compressible outputs are encoded with the best
+    coding accepted by the client. When an ETag is given, a single byte range of the output may be requested, as
+    long as the `If-Range` header (if any) matches it; ranges are always sent unencoded.
+    """
+    if etag is not None:
+        headers["Accept-Ranges"] = "bytes"
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header is not None and if_range in (None, etag):
+            try:
+                byte_range = parse_byte_range(range_header, len(content))
+            except RangeNotSatisfiable as e:
+                raise RangeNotSatisfiableException(len(content)) from e
+            if byte_range is not None:
+                start, end = byte_range
+                headers["ETag"] = etag
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+                return Response(content=content[start:end + 1], status_code=status.HTTP_206_PARTIAL_CONTENT,
+                                media_type=mime_type, headers=headers)
+
+    if mime_type in COMPRESSIBLE_MIME_TYPES:
+        headers["Vary"] = "Accept-Encoding"
+        coding = negotiate_encoding(request.headers.get("accept-encoding")) \
+            if len(content) >= get_settings().COMPRESSION_MIN_BYTES else None
+        if coding is not None:
+            content = encode_content(content, coding)
+            headers["Content-Encoding"] = coding
+            # each coding is a distinct representation, with its own ETag
+            etag = f'{etag[:-1]}-{coding}"' if etag is not None else None
+
+    if etag is not None:
+        headers["ETag"] = etag
+    return Response(content=content, media_type=mime_type, headers=headers)
+
+
+@app.get("/profiles/continuous", response_class=PlainTextResponse, dependencies=[Depends(require_admin_key)])
+def continuous_profile(request: Request) -> str:
+    """
+    Gets the stacks sampled by the continuous profiler of this process, as folded stacks.
+    Only available when CONTINUOUS_PROFILING_INTERVAL is set.
+    """
+    stack_sampler: StackSampler | None = getattr(request.app.state, "stack_sampler", None)
+    if stack_sampler is None:
+        raise ProfileNotFoundException("continuous")
+    return stack_sampler.folded()
+
+
+@app.get("/profiles/{profile_id}", response_class=FileResponse, dependencies=[Depends(require_admin_key)])
+def profile(profile_id: str, kind: ProfileKindEnum = ProfileKindEnum.CPU) -> FileResponse:
+    """
+    Gets the profile of a composition requested with the X-Plato-Profile header: the cProfile profile (`cpu`),
+    loadable with pstats, or the memory allocation statistics (`memory`).
+    """
+    profile_directory = get_settings().PROFILE_DIRECTORY
+    if PROFILE_ID_PATTERN.fullmatch(profile_id) is None:
+        raise ProfileNotFoundException(profile_id)
+
+    if kind == ProfileKindEnum.MEMORY:
+        path = memory_profile_path(profile_directory, profile_id)
+    else:
+        path = cpu_profile_path(profile_directory, profile_id)
+    if not path.is_file():
+        raise ProfileNotFoundException(profile_id)
+    return FileResponse(path, filename=path.name)
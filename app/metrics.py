@@ -0,0 +1,502 @@
+import bisect
+import fcntl
+import json
+import os
+import pathlib
+import resource
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""
+Default histogram buckets, in seconds
+"""
+
+SIZE_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(10))
+"""
+Histogram buckets for sizes, from 1 KiB to 256 MiB
+"""
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+Snapshot = List[list]
+"""
+The state of a metric in a process, as JSON serializable rows (see `Metric.snapshot`)
+"""
+
+
+class Metric(ABC):
+    """
+    Base class for in-process metrics, exposed in the Prometheus text format by `render_metrics`, or along with the
+    metrics of other processes by `MetricsDirectory`.
+    Every metric is registered on creation.
+    """
+    type_: str
+
+    registry: List['Metric'] = []
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        Metric.registry.append(self)
+
+    def render(self, snapshot: Snapshot | None = None) -> List[str]:
+        """
+        Renders the metric in the Prometheus text format.
+
+        Args:
+            snapshot: The state of the metric to render, rather than its state in this process
+
+        Returns:
+            List[str]: The lines of the metric
+        """
+        samples = self.samples() if snapshot is None else self.samples_of(snapshot)
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type_}", *samples]
+
+    def samples(self) -> List[str]:
+        """
+        Renders every sample of the metric, as Prometheus text format lines.
+        """
+        return self.samples_of(self.snapshot())
+
+    @abstractmethod
+    def snapshot(self) -> Snapshot:
+        """
+        The state of the metric in this process, which can be written to a file and merged with the state of the
+        metric in other processes.
+        """
+        ...
+
+    @abstractmethod
+    def merge(self, snapshots: List[Tuple[int | None, Snapshot]]) -> Snapshot:
+        """
+        Merges the states of the metric in several processes.
+
+        Args:
+            snapshots: The state of the metric in each process, by process id, or None for processes which exited
+
+        Returns:
+            Snapshot: The merged state
+        """
+        ...
+
+    @abstractmethod
+    def samples_of(self, snapshot: Snapshot) -> List[str]:
+        """
+        Renders every sample of a state of the metric, as Prometheus text format lines.
+        """
+        ...
+
+    def reset(self) -> None:
+        """
+        Forgets the values recorded by this process, e.g. in a process forked from the one which recorded them.
+        """
+        pass
+
+    def _label_values(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels[label_name]) for label_name in self.label_names)
+
+    def _format_labels(self, label_values: LabelValues, **extra_labels: str) -> str:
+        labels = {**dict(zip(self.label_names, label_values)), **extra_labels}
+        if not labels:
+            return ""
+        escaped_labels = (f'{name}="{_escape_label_value(value)}"' for name, value in labels.items())
+        return "{" + ",".join(escaped_labels) + "}"
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing count, for each combination of label values.
+    """
+    type_ = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Increments the count.
+
+        Args:
+            amount: The increment
+            labels: The value of every label of the counter
+        """
+        label_values = self._label_values(labels)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """
+        Current count for the given label values.
+
+        Args:
+            labels: The value of every label of the counter
+
+        Returns:
+            float: The count
+        """
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def snapshot(self) -> Snapshot:
+        with self._lock:
+            return [[list(label_values), value] for label_values, value in self._values.items()]
+
+    def merge(self, snapshots: List[Tuple[int | None, Snapshot]]) -> Snapshot:
+        values: Dict[LabelValues, float] = {}
+        for _, snapshot in snapshots:
+            for label_values, value in snapshot:
+                values[tuple(label_values)] = values.get(tuple(label_values), 0) + value
+        return [[list(label_values), value] for label_values, value in values.items()]
+
+    def samples_of(self, snapshot: Snapshot) -> List[str]:
+        return [f"{self.name}{self._format_labels(tuple(label_values))} {value}" for label_values, value in snapshot]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(Metric):
+    """
+    Unlabelled value which can go up and down, read from a function whenever metrics are rendered.
+
+        Typical usage:
+
+            RENDER_QUEUE_DEPTH = Gauge("plato_render_queue_depth", "Renders waiting for a worker")
+            RENDER_QUEUE_DEPTH.set_function(lambda: render_pool.queued)
+    """
+    type_ = "gauge"
+
+    def __init__(self, name: str, description: str, function: Callable[[], float] | None = None):
+        super().__init__(name, description)
+        self._function = function
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Sets the function providing the value of the gauge.
+
+        Args:
+            function: The function providing the value
+        """
+        self._function = function
+
+    def snapshot(self) -> Snapshot:
+        if self._function is None:
+            return []
+        return [[None, self._function()]]
+
+    def merge(self, snapshots: List[Tuple[int | None, Snapshot]]) -> Snapshot:
+        # the values of different processes don't add up, so each one is labelled by its process id, and the ones of
+        # processes which exited are dropped
+        return [[str(pid), value] for pid, snapshot in snapshots if pid is not None for _, value in snapshot]
+
+    def samples_of(self, snapshot: Snapshot) -> List[str]:
+        return [f"{self.name}{self._format_labels((), **({'pid': pid} if pid is not None else {}))} {value}"
+                for pid, value in snapshot]
+
+
+class Histogram(Metric):
+    """
+    In-process histogram, counting observations in cumulative buckets for each combination of label values,
+    following Prometheus' histogram semantics.
+
+        Typical usage:
+
+            COMPOSE_SECONDS = Histogram("plato_compose_seconds", "Compose duration", ["template_id"])
+            COMPOSE_SECONDS.observe(0.42, template_id="certificate")
+    """
+    type_ = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._bucket_counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Records an observation.
+
+        Args:
+            value: The observed value
+            labels: The value of every label of the histogram
+        """
+        label_values = self._label_values(labels)
+        with self._lock:
+            bucket_counts = self._bucket_counts.setdefault(label_values, [0] * (len(self.buckets) + 1))
+            # the last count is the +Inf bucket
+            bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[label_values] = self._sums.get(label_values, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observes the duration of the block, in seconds.
+
+        Args:
+            labels: The value of every label of the histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        """
+        Number of observations for the given label values.
+
+        Args:
+            labels: The value of every label of the histogram
+
+        Returns:
+            int: The number of observations
+        """
+        with self._lock:
+            return sum(self._bucket_counts.get(self._label_values(labels), []))
+
+    def sum(self, **labels: str) -> float:
+        """
+        Sum of the observations for the given label values.
+
+        Args:
+            labels: The value of every label of the histogram
+
+        Returns:
+            float: The sum of the observed values
+        """
+        with self._lock:
+            return self._sums.get(self._label_values(labels), 0.0)
+
+    def snapshot(self) -> Snapshot:
+        with self._lock:
+            return [[list(label_values), list(bucket_counts), self._sums[label_values]]
+                    for label_values, bucket_counts in self._bucket_counts.items()]
+
+    def merge(self, snapshots: List[Tuple[int | None, Snapshot]]) -> Snapshot:
+        series: Dict[LabelValues, Tuple[List[int], float]] = {}
+        for _, snapshot in snapshots:
+            for label_values, bucket_counts, sum_ in snapshot:
+                merged_counts, merged_sum = series.get(tuple(label_values), ([0] * len(bucket_counts), 0.0))
+                series[tuple(label_values)] = ([merged + count for merged, count in zip(merged_counts, bucket_counts)],
+                                               merged_sum + sum_)
+        return [[list(label_values), bucket_counts, sum_] for label_values, (bucket_counts, sum_) in series.items()]
+
+    def samples_of(self, snapshot: Snapshot) -> List[str]:
+        lines = []
+        for label_values, bucket_counts, sum_ in snapshot:
+            label_values = tuple(label_values)
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip([*map(str, self.buckets), "+Inf"], bucket_counts):
+                cumulative_count += bucket_count
+                lines.append(f"{self.name}_bucket{self._format_labels(label_values, le=upper_bound)} "
+                             f"{cumulative_count}")
+            lines.append(f"{self.name}_sum{self._format_labels(label_values)} {sum_}")
+            lines.append(f"{self.name}_count{self._format_labels(label_values)} {cumulative_count}")
+        return lines
+
+    def reset(self) -> None:
+        with self._lock:
+            self._bucket_counts.clear()
+            self._sums.clear()
+
+
+def render_metrics() -> str:
+    """
+    Renders every registered metric of this process in the Prometheus text format.
+
+    Returns:
+        str: The metrics
+    """
+    return "\n".join(line for metric in Metric.registry for line in metric.render()) + "\n"
+
+
+class MetricsDirectory:
+    """
+    Directory through which the processes of a server (e.g. gunicorn workers) share their metrics, so whichever of
+    them serves a scrape renders the metrics of all of them. Every process writes its metrics to a file of its own,
+    periodically and before exiting; once it exited, its counters and histograms are merged into an archive, so they
+    keep adding up, while its gauges are dropped. Gauges are labelled by process id, as their values don't add up.
+
+        Typical usage:
+
+            metrics_directory = MetricsDirectory(settings.METRICS_DIRECTORY)
+            metrics_directory.start_writing()  # in every process
+            metrics = metrics_directory.render()
+            metrics_directory.stop_writing()  # before the process exits
+            metrics_directory.archive(pid)  # in the parent, once the process exited
+    """
+    ARCHIVE_FILE_NAME = "archive.json"
+    LOCK_FILE_NAME = ".lock"
+    WRITE_INTERVAL_SECONDS = 1
+
+    def __init__(self, path: str):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def write(self) -> None:
+        """
+        Writes the metrics of this process to its file, replacing the previous ones.
+        """
+        self._write_snapshots(self._process_file(os.getpid()),
+                              {metric.name: metric.snapshot() for metric in Metric.registry})
+
+    def start_writing(self) -> None:
+        """
+        Writes the metrics of this process every `WRITE_INTERVAL_SECONDS`, in a background thread.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._write_periodically, name="plato-metrics-writer", daemon=True)
+        self._thread.start()
+
+    def stop_writing(self) -> None:
+        """
+        Stops writing the metrics of this process periodically, writing them one last time.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def render(self) -> str:
+        """
+        Renders the metrics of every process writing to the directory, or which did, in the Prometheus text format,
+        with the current metrics of this process.
+
+        Returns:
+            str: The metrics
+        """
+        self.write()
+        with self._locked(fcntl.LOCK_SH):
+            process_snapshots = [(self._process_id(path), self._read_snapshots(path))
+                                 for path in self.path.glob("*.json")]
+        return "\n".join(line for metric in Metric.registry for line in metric.render(
+            metric.merge([(pid, snapshots[metric.name]) for pid, snapshots in process_snapshots
+                          if metric.name in snapshots])
+        )) + "\n"
+
+    def archive(self, pid: int) -> None:
+        """
+        Merges the counters and histograms of a process which exited into the archive, removing its file.
+
+        Args:
+            pid: The id of the process
+        """
+        process_file = self._process_file(pid)
+        with self._locked(fcntl.LOCK_EX):
+            process_snapshots = self._read_snapshots(process_file)
+            if not process_snapshots:
+                return
+            archive_file = self.path / self.ARCHIVE_FILE_NAME
+            archived_snapshots = self._read_snapshots(archive_file)
+            self._write_snapshots(archive_file, {
+                metric.name: metric.merge([(None, snapshots[metric.name])
+                                           for snapshots in (archived_snapshots, process_snapshots)
+                                           if metric.name in snapshots])
+                for metric in Metric.registry
+            })
+            process_file.unlink()
+
+    def clear(self) -> None:
+        """
+        Removes the metrics of every process, e.g. left by a previous server.
+        """
+        with self._locked(fcntl.LOCK_EX):
+            for path in self.path.glob("*.json"):
+                path.unlink()
+
+    def _write_periodically(self) -> None:
+        while not self._stop_event.wait(self.WRITE_INTERVAL_SECONDS):
+            self.write()
+
+    def _process_file(self, pid: int) -> pathlib.Path:
+        return self.path / f"{pid}.json"
+
+    def _process_id(self, path: pathlib.Path) -> int | None:
+        return None if path.name == self.ARCHIVE_FILE_NAME else int(path.stem)
+
+    @staticmethod
+    def _read_snapshots(path: pathlib.Path) -> Dict[str, Snapshot]:
+        try:
+            return json.loads(path.read_text())
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _write_snapshots(path: pathlib.Path, snapshots: Dict[str, Snapshot]) -> None:
+        # written beside the file and renamed over it, so it's never read half written
+        temporary_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        temporary_path.write_text(json.dumps(snapshots))
+        temporary_path.rename(path)
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        with open(self.path / self.LOCK_FILE_NAME, mode="a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _reset_metrics() -> None:
+    for metric in Metric.registry:
+        metric.reset()
+
+
+# a forked process starts counting from zero, so the values of its parent aren't counted twice once they're shared
+os.register_at_fork(after_in_child=_reset_metrics)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def process_rss_bytes() -> float:
+    """
+    Current resident set size of this process, or its peak where /proc isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+HTTP_REQUESTS = Counter("plato_http_requests_total", "HTTP requests handled, by route and status code",
+                        ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram("plato_http_request_duration_seconds",
+                                 "Duration of HTTP requests until the response starts, by route",
+                                 ["method", "route"])
+COMPOSE_STAGE_SECONDS = Histogram("plato_compose_stage_seconds",
+                                  "Duration of each stage of the compose pipeline",
+                                  ["stage", "template_id", "mime_type"])
+COMPOSE_OUTPUT_BYTES = Histogram("plato_compose_output_bytes", "Size of composed outputs",
+                                 ["template_id", "mime_type"], buckets=SIZE_BUCKETS)
+RENDER_QUEUE_DEPTH = Gauge("plato_render_queue_depth", "Renders waiting for a render worker")
+RENDERS = Counter("plato_renders_total", "Renders run by this worker process's render pool")
+RENDER_RECYCLES = Counter("plato_render_recycles_total",
+                          "Worker processes recycled by their render pool, by reason (renders or memory)", ["reason"])
+RENDER_QUEUE_WAIT_SECONDS = Histogram("plato_render_queue_wait_seconds",
+                                      "Time renders waited for a render worker, by priority class", ["priority"])
+RENDER_JOBS = Counter("plato_render_jobs_total",
+                      "Render jobs sent to the render farm, by outcome (queued, done, failed or timeout)", ["outcome"])
+CACHE_REQUESTS = Counter("plato_cache_requests_total", "Cache lookups, by cache and result (hit or miss)",
+                         ["cache", "result"])
+TEMPLATE_SYNC_SECONDS = Histogram("plato_template_sync_seconds",
+                                  "Duration of template synchronization from the file storage, by operation",
+                                  ["operation"])
+PROCESS_RSS_BYTES = Gauge("plato_process_resident_memory_bytes", "Resident memory of this worker process",
+                          process_rss_bytes)
@@ -1,4 +1,6 @@
+from app.models.idempotency_key import IdempotencyKey
+from app.models.render_job import RenderJob
 from app.models.template import Template
 
 # Import all the models, so that Base has them before being imported by Alembic
-__all__ = ["Template"]
+__all__ = ["IdempotencyKey", "RenderJob", "Template"]
@@ -0,0 +1,28 @@
+from sqlalchemy import Column, DateTime, Index, LargeBinary, String, func
+
+from app.db.base_class import Base
+
+
+class IdempotencyKey(Base):
+    """
+    Database model for a request sent with an idempotency key, holding its result once done (see IdempotencyStore).
+    Attributes:
+        key (str): The idempotency key
+        fingerprint (str): Identifies the request the key was used for
+        result (bytes): The composed file, once done
+        locked_until (datetime): When the lease of the process running the request expires, so a retry can take over
+        created_at (datetime): When the request started
+    """
+    __tablename__ = "idempotency_key"
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    result = Column(LargeBinary, nullable=True)
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.clock_timestamp())
+
+    __table_args__ = (
+        Index("ix_idempotency_key_created_at", created_at),
+    )
+
+    def __repr__(self):
+        return '<IdempotencyKey %r>' % self.key
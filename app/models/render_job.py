@@ -0,0 +1,54 @@
+from sqlalchemy import Column, DateTime, Index, Integer, LargeBinary, SmallInteger, String, func, text
+from sqlalchemy.dialects.postgresql import ENUM, JSONB
+
+from app.db.base_class import Base
+
+RENDER_JOB_STATUSES = ("queued", "running", "done", "failed")
+
+
+class RenderJob(Base):
+    """
+    Database model for a render job, queued by the API for render workers when renders are sent to a render farm
+    (see PostgresJobQueue).
+    Attributes:
+        id (str): The id for the job
+        template_id (str): The id of the template to compose
+        mime_type (str): The MIME type to compose the template in
+        compose_data (dict): The data to fill the template with
+        options (dict): Additional options for the renderer
+        priority (int): The rank of the job's priority class, lower ranks being claimed first
+        status (str): One of 'queued', 'running', 'done' or 'failed'
+        attempts (int): How many times the job was claimed by a worker
+        worker_id (str): The worker which last claimed the job
+        locked_until (datetime): When the worker's claim on the running job expires, so another worker can retry it
+        result (bytes): The composed file, once done
+        error (dict): The type and message of the error the job failed with
+        created_at (datetime): When the job was queued
+        finished_at (datetime): When the job was done or failed
+    """
+    __tablename__ = "render_job"
+    id = Column(String, primary_key=True)
+    template_id = Column(String, nullable=False)
+    mime_type = Column(String, nullable=False)
+    compose_data = Column(JSONB, nullable=False)
+    options = Column(JSONB, nullable=False, server_default="{}")
+    priority = Column(SmallInteger, nullable=False, server_default="0")
+    status = Column(ENUM(*RENDER_JOB_STATUSES, name="render_job_status"), nullable=False, server_default="queued")
+    attempts = Column(Integer, nullable=False, server_default="0")
+    worker_id = Column(String, nullable=True)
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+    result = Column(LargeBinary, nullable=True)
+    error = Column(JSONB, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.clock_timestamp())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # the queue, in the order jobs are claimed
+        Index("ix_render_job_queued", priority, created_at, postgresql_where=text("status = 'queued'")),
+        # claims which may have expired
+        Index("ix_render_job_running", locked_until, postgresql_where=text("status = 'running'")),
+        Index("ix_render_job_finished_at", finished_at),
+    )
+
+    def __repr__(self):
+        return '<RenderJob %r>' % self.id
@@ -1,5 +1,5 @@
 from typing import List, Sequence
-from sqlalchemy import Column, String
+from sqlalchemy import Column, DateTime, Index, Integer, String, func, literal_column
 from sqlalchemy.dialects.postgresql import ENUM, JSONB, ARRAY
 
 from app.db.base_class import Base
@@ -15,6 +15,11 @@ class Template(Base):
             are the urls to be transformed into QR codes.
             Examples
                 "course.organization.contact.website_url"
+        pdf_options
+            The default WeasyPrint options for PDF compositions of the template (see PdfOptionsSchema), which
+            can be overridden per composition.
+            Examples
+                {"jpeg_quality": 80, "dpi": 150}
     Attributes:
         id (str): The id for the template
         schema (dict): JSON dictionary with jsonschema used for validation in said template
@@ -22,6 +27,8 @@ class Template(Base):
         metadata_ (dict): JSON dictionary for arbitrary data useful for owner
         example_composition (dict): A dictionary containing example compose data for the template
         tags (list): A list of identifying tags for the template
+        version (int): Incremented on every update of the template, used to build ETags
+        updated_at (datetime): When the template was created or last updated, used to build ETags
     """
     __tablename__ = "template"
     id = Column(String, primary_key=True)
@@ -30,6 +37,16 @@ class Template(Base):
     metadata_ = Column(JSONB, name="metadata", nullable=True)
     example_composition = Column(JSONB, nullable=False)
     tags = Column(ARRAY(String), name="tags", nullable=False, server_default="{}")
+    # also maintained by a database trigger, for updates made outside the ORM
+    version = Column(Integer, nullable=False, server_default="1", onupdate=literal_column("template.version + 1"))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.clock_timestamp(),
+                        onupdate=func.clock_timestamp())
+
+    __table_args__ = (
+        # GIN index supporting the tag filters (both the @> and && array operators)
+        Index("ix_template_tags", tags, postgresql_using="gin"),
+        Index("ix_template_updated_at", updated_at),
+    )
 
     def __init__(self, id_: str, schema: dict, type_: str,
                  metadata: dict,
@@ -51,5 +68,13 @@ class Template(Base):
         """
         return self.metadata_.get("qr_entries", [])
 
+    def get_pdf_options(self) -> dict:
+        """
+        Fetches the default PDF options for the template
+        Returns:
+            dict
+        """
+        return self.metadata_.get("pdf_options", {})
+
     def __repr__(self):
         return '<Template %r>' % self.id
@@ -0,0 +1,113 @@
+import gc
+import logging
+import os
+from concurrent.futures import wait
+
+from fastapi import FastAPI
+from jinja2 import TemplateNotFound
+from starlette.datastructures import State
+
+from app.compose.examples import prerender_examples
+from app.compose.render_pool import render_pool
+from app.compose.static_assets import static_asset_cache
+from app.db.session import db_session, engine
+from app.file_storage import DiskFileStorage
+from app.metrics import TEMPLATE_SYNC_SECONDS
+from app.models.template import Template
+from app.settings import get_settings
+from app.util.setup_util import create_template_environment, initialize_file_storage
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_templates(state: State) -> None:
+    """
+    Syncs the templates from the file storage, and loads everything needed to render them into memory: compiled
+    templates, static assets (fonts, images, stylesheets) and the renderers' libraries and font configuration.
+    The resulting file storage and Jinja environment are kept in the given state (the app's, or a render worker's).
+
+    Args:
+        state: The state the file storage and Jinja environment are kept in
+    """
+    settings = get_settings()
+    state.file_storage = initialize_file_storage(settings.STORAGE_TYPE, settings.DATA_DIR, settings.BUCKET_NAME)
+
+    with db_session() as db, TEMPLATE_SYNC_SECONDS.time(operation="load_all"):
+        state.file_storage.load_templates(settings.TEMPLATE_DIRECTORY, settings.TEMPLATE_DIRECTORY_NAME, db)
+
+    state.watch_templates = settings.WATCH_TEMPLATES and isinstance(state.file_storage, DiskFileStorage)
+    state.jinja_env = create_template_environment(settings.TEMPLATE_DIRECTORY,
+                                                  auto_reload=not state.watch_templates)
+    state.template_directory = settings.TEMPLATE_DIRECTORY
+    state.template_static_directory = f"{settings.TEMPLATE_DIRECTORY}/static"
+
+    with db_session() as db:
+        template_ids = [template_id for template_id, in db.query(Template.id)]
+    for template_id in template_ids:
+        try:
+            state.jinja_env.get_template(f"{template_id}/{template_id}")
+        except TemplateNotFound:
+            logger.warning("Template '%s' has no template file, it won't be compiled", template_id)
+
+    _load_static_assets(state.template_static_directory, settings.STATIC_ASSET_CACHE_MAX_BYTES)
+    _load_renderers()
+
+
+def preload(api: FastAPI) -> None:
+    """
+    Prepares the templates and pre-renders their examples in a server's master process, before its workers are
+    forked: the workers then share the loaded memory pages copy-on-write, instead of each holding a copy of them, and
+    skip preparing the templates themselves on startup.
+
+    Nothing which can't be shared across a fork (threads, database connections) is left behind.
+
+    Args:
+        api: The app, as loaded in the master process
+    """
+    prepare_templates(api.state)
+    if get_settings().PRERENDER_EXAMPLES:
+        _prerender_examples(api.state)
+    engine.dispose()
+
+    # objects allocated so far are moved out of the garbage collector's reach: collections in the workers would
+    # otherwise write to the pages holding them, un-sharing those pages
+    gc.collect()
+    gc.freeze()
+    api.state.preloaded = True
+
+
+def _prerender_examples(state: State) -> None:
+    """
+    Renders the example of every template into the output cache, then stops the render pool's threads.
+    """
+    with db_session() as db:
+        futures = [prerender_examples(template, state.jinja_env, state.template_static_directory)
+                   for template in db.query(Template)]
+    wait(futures)
+    render_pool.shutdown()
+
+
+def _load_static_assets(static_directory: str, max_bytes: int) -> None:
+    """
+    Reads the static assets into the static asset cache, until it's full.
+    """
+    loaded_bytes = 0
+    for directory, _, file_names in os.walk(static_directory):
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            loaded_bytes += os.path.getsize(path)
+            if loaded_bytes > max_bytes:
+                return
+            static_asset_cache.get(path)
+
+
+def _load_renderers() -> None:
+    """
+    Imports the renderers' libraries, which are otherwise imported on first use, and renders a minimal document so
+    their font configuration is loaded.
+    """
+    from qrcode import make
+    from weasyprint import HTML
+
+    make("plato")
+    HTML(string="<p>plato</p>").render()
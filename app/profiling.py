@@ -0,0 +1,180 @@
+import cProfile
+import functools
+import re
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from enum import Enum
+from pathlib import Path
+from typing import Callable, TypeVar
+
+from app.compose.render_pool import RenderPool
+
+T = TypeVar("T")
+
+PROFILE_HEADER_CPU = "cpu"
+PROFILE_HEADER_MEMORY = "memory"
+
+PROFILE_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+MEMORY_STATISTICS_LIMIT = 50
+
+# held while a composition is profiled
+_profiler_lock = threading.Lock()
+
+
+class ProfileKindEnum(str, Enum):
+    CPU = PROFILE_HEADER_CPU
+    MEMORY = PROFILE_HEADER_MEMORY
+
+
+class ProfilerBusy(Exception):
+    """
+    Exception to be raised when a composition is profiled while another one is: a process runs a single profiler at
+    a time, as cProfile relies on sys.monitoring since Python 3.12, and tracemalloc traces every thread
+    """
+    ...
+
+
+class ProfileRequest:
+    """
+    Request for a single composition to be profiled, with the id its profile is stored under
+    """
+
+    def __init__(self, profile_id: str, memory: bool = False):
+        if PROFILE_ID_PATTERN.fullmatch(profile_id) is None:
+            raise ValueError(f"Invalid profile id: '{profile_id}'")
+        self.profile_id = profile_id
+        self.memory = memory
+
+
+def cpu_profile_path(profile_directory: str, profile_id: str) -> Path:
+    """
+    Path of a stored cProfile profile, which can be loaded with pstats (or tools such as snakeviz).
+    """
+    return Path(profile_directory, f"{profile_id}.prof")
+
+
+def memory_profile_path(profile_directory: str, profile_id: str) -> Path:
+    """
+    Path of a stored tracemalloc profile, listing the lines which allocated the most memory.
+    """
+    return Path(profile_directory, f"{profile_id}.memory.txt")
+
+
+def profiled(function: Callable[..., T], profile_request: ProfileRequest, profile_directory: str,
+             render_pool: RenderPool) -> Callable[..., T]:
+    """
+    Wraps a render so it runs under cProfile (and tracemalloc, if requested), storing its profiles in the profile
+    directory. The wrapped function is meant to be submitted as is to the render pool.
+
+    Since Python 3.12, cProfile records the calls of every thread, like tracemalloc records their allocations, so the
+    profiled render runs alone on the render pool: it waits for the renders already running to be done, and no other
+    render starts until it is. Profiles still include what other threads (e.g. the event loop) do meanwhile. Only one
+    composition is profiled at a time by a process: the wrapped function raises ProfilerBusy while another one is.
+
+    Args:
+        function: The function to profile
+        profile_request: The profiling options
+        profile_directory: The directory the profiles are stored in
+        render_pool: The render pool the profiled render runs on
+
+    Returns:
+        Callable[..., T]: The profiled function
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs) -> T:
+        if not _profiler_lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            with render_pool.running_alone():
+                return _run_profiled(function, profile_request, profile_directory, *args, **kwargs)
+        finally:
+            _profiler_lock.release()
+
+    return wrapper
+
+
+def _run_profiled(function: Callable[..., T], profile_request: ProfileRequest, profile_directory: str,
+                  *args, **kwargs) -> T:
+    Path(profile_directory).mkdir(parents=True, exist_ok=True)
+    trace_memory = profile_request.memory and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(cpu_profile_path(profile_directory, profile_request.profile_id))
+        if trace_memory:
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:MEMORY_STATISTICS_LIMIT]
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            memory_profile_path(profile_directory, profile_request.profile_id).write_text(
+                "\n".join([f"Peak traced memory: {peak} bytes", *map(str, statistics)]) + "\n"
+            )
+
+
+class StackSampler:
+    """
+    Sampling profiler for continuous use in production: every `interval` seconds, it records the current stack of
+    every thread whose name starts with `thread_name_prefix` (e.g. render workers). Its overhead is bounded by the
+    sampling interval, rather than proportional to the number of calls like cProfile.
+
+    Samples are aggregated as folded stacks, which can be turned into flame graphs by most profiling tools.
+
+        Typical usage:
+
+            sampler = StackSampler(0.01, "plato-render")
+            sampler.start()
+            ...
+            print(sampler.folded())
+            sampler.stop()
+    """
+
+    def __init__(self, interval: float, thread_name_prefix: str):
+        self.interval = interval
+        self.thread_name_prefix = thread_name_prefix
+        self._samples: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="plato-stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+
+    def sample(self) -> None:
+        """
+        Records the current stack of every sampled thread.
+        """
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if not threads.get(thread_id, "").startswith(self.thread_name_prefix):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_code.co_firstlineno})")
+                frame = frame.f_back
+            stacks.append(";".join(reversed(stack)))
+
+        with self._lock:
+            self._samples.update(stacks)
+
+    def folded(self) -> str:
+        """
+        Gets every sample recorded so far, as folded stacks.
+
+        Returns:
+            str: One line per distinct stack, with its frames separated by semicolons followed by its number of samples
+        """
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._samples.most_common())
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.sample()
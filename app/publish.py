@@ -0,0 +1,213 @@
+import json
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Dict, Iterator, Tuple
+
+from jinja2 import Environment as JinjaEnv, TemplateSyntaxError
+from jsonschema import SchemaError, ValidationError
+from jsonschema.validators import validator_for
+from pydantic import ValidationError as OptionsValidationError
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.db.notifications import notify_template_changed
+from app.file_storage import PlatoFileStorage, replace_template_files, template_files_lock
+from app.models.template import Template
+from app.schemas.compose import PdfOptionsSchema
+from app.schemas.template_detail import MIMETypeEnum
+from app.util.cache_util import invalidate_template
+
+BUNDLE_TEMPLATE_DIRECTORY = "template"
+BUNDLE_STATIC_DIRECTORY = "static"
+BUNDLE_INDEX_FILE = "index.html"
+BUNDLE_SCHEMA_FILE = "schema.json"
+BUNDLE_EXAMPLE_FILE = "example.json"
+BUNDLE_METADATA_FILE = "metadata.json"
+BUNDLE_TAGS_FILE = "tags.json"
+BUNDLE_JSON_FILES = (BUNDLE_SCHEMA_FILE, BUNDLE_EXAMPLE_FILE, BUNDLE_METADATA_FILE, BUNDLE_TAGS_FILE)
+
+
+class InvalidTemplateBundle(Exception):
+    """
+    Exception to be raised when a template bundle is malformed, or its content is invalid
+    """
+    message: str
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(message)
+
+
+def publish_template(template_id: str, bundle: BinaryIO, file_storage: PlatoFileStorage, db: Session,
+                     jinja_env: JinjaEnv, target_directory: str, template_directory_name: str) -> Template:
+    """
+    Publishes a template bundle: stores its files locally and on the file storage, creates or updates the template
+    in the database, precompiles it and notifies every other Plato node that it changed.
+
+    A bundle is a zip or tar (optionally compressed) archive with the following structure:
+        template/index.html     The template HTML, stored as templates/{template_id}/{template_id}
+        template/...            Other template files (e.g. partials), stored in templates/{template_id}/
+        static/...              Static files, stored in static/{template_id}/
+        schema.json             The jsonschema used to validate compositions
+        example.json            An example composition, which must be valid according to the schema
+        metadata.json           Optional, the template metadata
+        tags.json               Optional, a list of tags for the template
+
+    Archive members are streamed into the local blob store one at a time, so the bundle is never fully held in memory.
+    The local files are staged, and only replace the live ones once the new version is committed.
+
+    Args:
+        template_id: The id of the template
+        bundle: The bundle archive
+        file_storage: The file storage the template files are uploaded to
+        db: The database session
+        jinja_env: The Jinja environment the template is precompiled in
+        target_directory: The local directory holding the templates
+        template_directory_name: The base directory of the templates in the file storage
+
+    Raises:
+        InvalidTemplateBundle: When the bundle is malformed, or its content is invalid
+
+    Returns:
+        Template: The published template
+    """
+    if template_id in (".", "..") or PurePosixPath(template_id).name != template_id:
+        raise InvalidTemplateBundle(f"Invalid template id: '{template_id}'")
+
+    Path(target_directory).mkdir(parents=True, exist_ok=True)
+    # the bundle files are only linked from the template directory once it's valid, so they mustn't be pruned before
+    with file_storage.blob_store.writing(), \
+            tempfile.TemporaryDirectory(dir=target_directory, prefix=".publish-") as staging_directory:
+        files, documents = _extract_bundle(template_id, bundle, file_storage)
+        _validate_bundle(template_id, files, documents, file_storage, jinja_env)
+
+        for key, digest in files.items():
+            file_storage.blob_store.link(digest, Path(f"{staging_directory}/{key}"))
+            with open(file_storage.blob_store.blob_path(digest), mode="rb") as file:
+                file_storage.put_file(f"{template_directory_name}/{key}", file)
+
+        template = db.get(Template, template_id)
+        if template is None:
+            template = Template(id_=template_id, schema={}, type_=MIMETypeEnum.HTML_MIME.value, metadata={},
+                                example_composition={}, tags=[])
+            db.add(template)
+        template.schema = documents[BUNDLE_SCHEMA_FILE]
+        template.example_composition = documents[BUNDLE_EXAMPLE_FILE]
+        template.metadata_ = documents.get(BUNDLE_METADATA_FILE, {})
+        template.tags = documents.get(BUNDLE_TAGS_FILE, [])
+        # the template files may have changed even if none of its columns did, so a new version is always created
+        template.updated_at = func.clock_timestamp()
+        notify_template_changed(db, template_id)
+        updated_at = float(db.scalar(select(func.extract("epoch", Template.updated_at))
+                                     .where(Template.id == template_id)))
+        db.commit()
+
+        with template_files_lock(target_directory):
+            replace_template_files(template_id, staging_directory, target_directory, updated_at)
+
+    invalidate_template(jinja_env, template_id)
+    jinja_env.get_template(f"{template_id}/{template_id}")
+    return template
+
+
+def _extract_bundle(template_id: str, bundle: BinaryIO,
+                    file_storage: PlatoFileStorage) -> Tuple[Dict[str, str], Dict[str, object]]:
+    """
+    Reads every member of the bundle, storing template and static files in the blob store and parsing JSON documents.
+
+    Returns:
+        Tuple[Dict[str, str], Dict[str, object]]: The digest of every file, by its location relative to the template
+            directory, and the parsed JSON documents, by their file name
+    """
+    files: Dict[str, str] = {}
+    documents: Dict[str, object] = {}
+
+    for name, member in _iter_bundle_members(bundle):
+        path = PurePosixPath(name.removeprefix("./"))
+        if path.is_absolute() or ".." in path.parts:
+            raise InvalidTemplateBundle(f"Invalid path in bundle: '{name}'")
+
+        if str(path) in BUNDLE_JSON_FILES:
+            try:
+                documents[str(path)] = json.load(member)
+            except ValueError as e:
+                raise InvalidTemplateBundle(f"Invalid JSON in bundle file '{path}'") from e
+        elif path.parts[0] == BUNDLE_TEMPLATE_DIRECTORY and len(path.parts) > 1:
+            relative_path = path.relative_to(BUNDLE_TEMPLATE_DIRECTORY)
+            file_name = template_id if str(relative_path) == BUNDLE_INDEX_FILE else str(relative_path)
+            files[f"templates/{template_id}/{file_name}"] = file_storage.blob_store.put_stream(member)
+        elif path.parts[0] == BUNDLE_STATIC_DIRECTORY and len(path.parts) > 1:
+            relative_path = path.relative_to(BUNDLE_STATIC_DIRECTORY)
+            files[f"static/{template_id}/{relative_path}"] = file_storage.blob_store.put_stream(member)
+        else:
+            raise InvalidTemplateBundle(f"Unexpected file in bundle: '{name}'")
+
+    return files, documents
+
+
+def _iter_bundle_members(bundle: BinaryIO) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Iterates over the files in a zip or tar archive. Tar archives are read as a stream.
+    """
+    if bundle.seekable() and zipfile.is_zipfile(bundle):
+        bundle.seek(0)
+        with zipfile.ZipFile(bundle) as zip_file:
+            for info in zip_file.infolist():
+                if not info.is_dir():
+                    with zip_file.open(info) as member:
+                        yield info.filename, member
+        return
+
+    if bundle.seekable():
+        bundle.seek(0)
+    try:
+        with tarfile.open(fileobj=bundle, mode="r|*") as tar_file:
+            for info in tar_file:
+                if info.isfile():
+                    yield info.name, tar_file.extractfile(info)
+    except tarfile.TarError as e:
+        raise InvalidTemplateBundle("The bundle is not a valid zip or tar archive") from e
+
+
+def _validate_bundle(template_id: str, files: Dict[str, str], documents: Dict[str, object],
+                     file_storage: PlatoFileStorage, jinja_env: JinjaEnv) -> None:
+    """
+    Checks that every required file is in the bundle, the schema is valid, the example is valid according to the
+    schema, the PDF options in the metadata are valid, and the template compiles.
+    """
+    index_key = f"templates/{template_id}/{template_id}"
+    required_files = {f"{BUNDLE_TEMPLATE_DIRECTORY}/{BUNDLE_INDEX_FILE}": index_key in files,
+                      BUNDLE_SCHEMA_FILE: BUNDLE_SCHEMA_FILE in documents,
+                      BUNDLE_EXAMPLE_FILE: BUNDLE_EXAMPLE_FILE in documents}
+    missing_files = [file_name for file_name, is_present in required_files.items() if not is_present]
+    if missing_files:
+        raise InvalidTemplateBundle(f"Missing files in bundle: {', '.join(missing_files)}")
+
+    if not isinstance(documents[BUNDLE_SCHEMA_FILE], dict):
+        raise InvalidTemplateBundle(f"'{BUNDLE_SCHEMA_FILE}' must contain an object")
+    if not isinstance(documents.get(BUNDLE_TAGS_FILE, []), list):
+        raise InvalidTemplateBundle(f"'{BUNDLE_TAGS_FILE}' must contain a list of tags")
+    if not isinstance(documents.get(BUNDLE_METADATA_FILE, {}), dict):
+        raise InvalidTemplateBundle(f"'{BUNDLE_METADATA_FILE}' must contain an object")
+    try:
+        PdfOptionsSchema.model_validate(documents.get(BUNDLE_METADATA_FILE, {}).get("pdf_options", {}))
+    except OptionsValidationError as e:
+        raise InvalidTemplateBundle(f"Invalid PDF options in '{BUNDLE_METADATA_FILE}': {e.errors()[0]['msg']}") from e
+
+    schema = documents[BUNDLE_SCHEMA_FILE]
+    try:
+        validator = validator_for(schema)
+        validator.check_schema(schema)
+        validator(schema).validate(documents[BUNDLE_EXAMPLE_FILE])
+    except SchemaError as e:
+        raise InvalidTemplateBundle(f"Invalid schema: {e.message}") from e
+    except ValidationError as e:
+        raise InvalidTemplateBundle(f"The example composition does not match the schema: {e.message}") from e
+
+    with open(file_storage.blob_store.blob_path(files[index_key]), encoding="utf-8") as index_file:
+        try:
+            jinja_env.parse(index_file.read())
+        except TemplateSyntaxError as e:
+            raise InvalidTemplateBundle(f"Invalid template: {e.message}") from e
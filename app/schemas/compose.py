@@ -1,21 +1,54 @@
 from typing import Annotated
 
 from fastapi import Query
-from pydantic import BaseModel, model_validator, NonNegativeInt
+from pydantic import BaseModel, Field, model_validator, NonNegativeInt, PositiveInt
 
 from app.exceptions import AspectRatioCompromisedException
 
+JpegQuality = Annotated[int, Field(ge=0, le=95)]
 
-class ComposeBaseSchema(BaseModel):
+
+class PdfOptionsSchema(BaseModel):
+    """
+    WeasyPrint options trading PDF size for render time, set per template in the `pdf_options` metadata entry
+    or per composition.
+
+        optimize_images: Recompress images losslessly
+        jpeg_quality: Reencode JPEG images with this quality (0-95)
+        dpi: Downsample images to this maximum resolution
+        full_fonts: Embed whole fonts instead of the used glyphs only
+        uncompressed_pdf: Leave the PDF streams uncompressed
+    """
+    optimize_images: bool | None = None
+    jpeg_quality: JpegQuality | None = None
+    dpi: PositiveInt | None = None
+    full_fonts: bool | None = None
+    uncompressed_pdf: bool | None = None
+
+
+class ComposeBaseSchema(PdfOptionsSchema):
     page: NonNegativeInt | None = None
     width: NonNegativeInt | None = None
     height: NonNegativeInt | None = None
 
+    def pdf_options(self) -> dict:
+        """
+        The PDF options given for the composition
+
+        :returns: the options which were set, by name
+        """
+        return self.model_dump(include=set(PdfOptionsSchema.model_fields), exclude_none=True)
+
 
 class ComposeSchema(ComposeBaseSchema):
     page: Annotated[NonNegativeInt, Query(...)] | None = None
     width: Annotated[NonNegativeInt, Query(...)] | None = None
     height: Annotated[NonNegativeInt, Query(...)] | None = None
+    optimize_images: Annotated[bool, Query(...)] | None = None
+    jpeg_quality: Annotated[JpegQuality, Query(...)] | None = None
+    dpi: Annotated[PositiveInt, Query(...)] | None = None
+    full_fonts: Annotated[bool, Query(...)] | None = None
+    uncompressed_pdf: Annotated[bool, Query(...)] | None = None
 
 
     @model_validator(mode="after")
@@ -28,4 +61,3 @@ class ComposeSchema(ComposeBaseSchema):
         if self.width is not None and self.height is not None:
             raise ValueError(AspectRatioCompromisedException().detail)
         return self
-
@@ -0,0 +1,26 @@
+from typing import Dict, List
+
+from pydantic import BaseModel
+
+
+class PageSizeSchema(BaseModel):
+    """
+    The size of a page, in points (1/72 inch)
+    """
+    width: float
+    height: float
+
+
+class LayoutSchema(BaseModel):
+    """
+    The layout of a composition, without the composed file.
+
+        pages: The number of pages
+        page_sizes: The size of every page
+        cached: Whether the layout was already cached (e.g. by an earlier layout request for the same composition)
+        timings: The duration of each stage of the request, in seconds
+    """
+    pages: int
+    page_sizes: List[PageSizeSchema]
+    cached: bool
+    timings: Dict[str, float]
@@ -18,6 +18,35 @@ class TemplateDetailSchema(BaseModel):
     model_config = ConfigDict(from_attributes=True, extra='forbid')
 
 
+class TemplatePartialSchema(BaseModel):
+    """
+    Template details restricted to a set of requested fields. Fields which weren't requested are left unset,
+    so they can be excluded from the response.
+    """
+    template_id: str | None = Field(None, alias='id', serialization_alias='template_id')
+    template_schema: dict | None = Field(None, alias='schema', serialization_alias='template_schema')
+    type: str | None = None
+    metadata: dict | None = Field(None, alias='metadata_', serialization_alias='metadata')
+    tags: Set[str] | None = None
+    example_composition: dict | None = None
+
+    model_config = ConfigDict(from_attributes=True, extra='forbid')
+
+
+class TemplateFieldEnum(str, Enum):
+    TEMPLATE_ID = "template_id"
+    TEMPLATE_SCHEMA = "template_schema"
+    TYPE = "type"
+    METADATA = "metadata"
+    TAGS = "tags"
+    EXAMPLE_COMPOSITION = "example_composition"
+
+
+class TagsMatchEnum(str, Enum):
+    ALL = "all"
+    ANY = "any"
+
+
 class MIMETypeEnum(str, Enum):
     PDF_MIME = "application/pdf"
     HTML_MIME = "text/html"
@@ -1,9 +1,11 @@
 import os
 from functools import lru_cache
+from typing import Dict
 
 from pydantic import field_validator, PostgresDsn
 from pydantic_core.core_schema import ValidationInfo
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from sqlalchemy import make_url
 
 SETTINGS_DIR = os.path.dirname(__file__)
 
@@ -14,8 +16,14 @@ class Settings(BaseSettings):
     DB_HOST: str 
     DB_PORT: int
     SQLALCHEMY_DATABASE_URI: str | None = None
+    ASYNC_SQLALCHEMY_DATABASE_URI: str | None = None
     POSTGRES_VER: str
 
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+
     STORAGE_TYPE: str
     TEMPLATE_DIRECTORY: str
     TEMPLATE_DIRECTORY_NAME: str
@@ -24,6 +32,45 @@ class Settings(BaseSettings):
 
     BUCKET_NAME: str | None
 
+    WATCH_TEMPLATES: bool = False
+
+    ADMIN_API_KEY: str | None = None
+
+    STATIC_ASSET_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    OUTPUT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    LAYOUT_CACHE_MAX_PAGES: int = 256
+    LAYOUT_CACHE_MAX_DOCUMENT_PAGES: int = 32
+
+    RENDER_WORKERS: int = os.cpu_count() or 1
+    PRERENDER_EXAMPLES: bool = True
+    RENDER_MAX_RENDERS: int = 0
+    RENDER_MAX_RENDERS_JITTER: int = 0
+    RENDER_MAX_RSS_BYTES: int = 0
+    RENDER_MAX_MEMORY_BYTES: int = 0
+    RENDER_MAX_PAGES: int = 1000
+    RENDER_RESERVED_WORKERS: int = 0
+    RENDER_FLOW_WEIGHTS: Dict[str, float] = {}
+    RENDER_FARM: bool = False
+    RENDER_JOB_QUEUE: str = "postgres"
+    RENDER_JOB_TIMEOUT_SECONDS: float = 300
+    RENDER_JOB_LEASE_SECONDS: float = 30
+    RENDER_JOB_MAX_ATTEMPTS: int = 3
+    RENDER_JOB_POLL_INTERVAL: float = 0.5
+    RENDER_JOB_RETENTION_SECONDS: float = 60 * 60
+
+    COMPOSE_MAX_PAYLOAD_BYTES: int = 10 * 1024 * 1024
+    COMPOSE_MAX_PAYLOAD_DEPTH: int = 64
+    COMPRESSION_MIN_BYTES: int = 1024
+    IDEMPOTENCY_WINDOW_SECONDS: int = 60 * 60
+    IDEMPOTENCY_MAX_BYTES: int = 64 * 1024 * 1024
+    IDEMPOTENCY_LEASE_SECONDS: float = 30
+    IDEMPOTENCY_POLL_INTERVAL: float = 0.5
+    PRELOAD_APP: bool = True
+
+    PROFILE_DIRECTORY: str | None = None
+    METRICS_DIRECTORY: str | None = None
+    CONTINUOUS_PROFILING_INTERVAL: float = 0
+
     IN_DOCKER: bool = False
 
     @field_validator("SQLALCHEMY_DATABASE_URI", mode="before")
@@ -37,6 +84,29 @@ class Settings(BaseSettings):
             path=values.data['DB_DATABASE'],
         ).unicode_string()
 
+    @field_validator("ASYNC_SQLALCHEMY_DATABASE_URI", mode="before")
+    def assemble_async_db_connection(cls, v: str | None, values: ValidationInfo) -> str:
+        if v:
+            return v
+        # the same database as SQLALCHEMY_DATABASE_URI, through asyncpg, which names the sslmode parameter ssl
+        url = make_url(values.data["SQLALCHEMY_DATABASE_URI"]).set(drivername="postgresql+asyncpg")
+        if "sslmode" in url.query:
+            url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": url.query["sslmode"]})
+        return url.render_as_string(hide_password=False)
+
+    @field_validator("RENDER_JOB_LEASE_SECONDS")
+    def check_render_job_lease(cls, v: float, values: ValidationInfo) -> float:
+        # workers renew the lease of the jobs they render, so it's short: a job whose worker died is claimed again
+        # long before the server waiting for it gives up
+        timeout_seconds = values.data.get("RENDER_JOB_TIMEOUT_SECONDS")
+        if v <= 0 or (timeout_seconds is not None and v >= timeout_seconds):
+            raise ValueError(f"must be positive and shorter than RENDER_JOB_TIMEOUT_SECONDS ({timeout_seconds})")
+        return v
+
+    @field_validator("PROFILE_DIRECTORY", mode="before")
+    def assemble_profile_directory(cls, v: str | None, values: ValidationInfo) -> str:
+        return v or f"{values.data['DATA_DIR']}/profiles"
+
     model_config = SettingsConfigDict(
         extra="ignore",
         env_file=[os.path.join(SETTINGS_DIR, "../.env")]
@@ -0,0 +1,98 @@
+import weakref
+from pathlib import PurePath
+from typing import Iterable, Set
+
+from jinja2 import Environment as JinjaEnv
+
+from app.compose.static_assets import static_asset_cache
+
+
+def invalidate_changed_files(jinja_env: JinjaEnv, template_directory: str, changed_paths: Iterable[str]) -> Set[str] | None:
+    """
+    Drops every cached entry derived from the given changed files: compiled Jinja templates for changed template
+    files, and cached content for changed static files.
+
+    Expected directory structure is {template_directory}/templates/{template_id}/... for template files, and
+    {template_directory}/static/{template_id}/... for static files.
+
+    Args:
+        jinja_env: The Jinja environment whose compiled templates should be invalidated
+        template_directory: The directory holding the templates and their static files
+        changed_paths: The paths of the changed files
+
+    Returns:
+        Set[str] | None: The ids of the templates whose output may have changed, or None if a shared file changed
+            and every template may be affected
+    """
+    affected_template_ids: Set[str] | None = set()
+
+    for changed_path in changed_paths:
+        try:
+            relative_path = PurePath(changed_path).relative_to(template_directory)
+        except ValueError:
+            continue
+
+        static_asset_cache.invalidate(changed_path)
+        if len(relative_path.parts) < 2 or relative_path.parts[0] not in ("templates", "static"):
+            continue
+
+        directory, *inner_parts = relative_path.parts
+        if directory == "templates":
+            invalidate_jinja_template(jinja_env, "/".join(inner_parts))
+
+        if affected_template_ids is not None and len(inner_parts) > 1:
+            affected_template_ids.add(inner_parts[0])
+        else:
+            # a file shared between templates (e.g. base static files or partials) changed
+            affected_template_ids = None
+
+    return affected_template_ids
+
+
+def invalidate_jinja_template(jinja_env: JinjaEnv, name: str) -> None:
+    """
+    Removes a compiled template from the Jinja environment's cache, so it's recompiled on its next use.
+    Templates which include or extend it don't need to be invalidated, as Jinja resolves them on every render.
+
+    Args:
+        jinja_env: The Jinja environment
+        name: The name of the template, relative to the environment's loader
+    """
+    if jinja_env.cache is None:
+        return
+
+    try:
+        del jinja_env.cache[(weakref.ref(jinja_env.loader), name)]
+    except KeyError:
+        pass
+
+
+def is_jinja_template_cached(jinja_env: JinjaEnv, name: str) -> bool:
+    """
+    Checks if a template is compiled in the Jinja environment's cache. With auto reload enabled, Jinja may still
+    recompile it if it changed on disk.
+
+    Args:
+        jinja_env: The Jinja environment
+        name: The name of the template, relative to the environment's loader
+
+    Returns:
+        bool: True if the compiled template is cached
+    """
+    return jinja_env.cache is not None and (weakref.ref(jinja_env.loader), name) in jinja_env.cache
+
+
+def invalidate_template(jinja_env: JinjaEnv, template_id: str) -> None:
+    """
+    Removes every compiled file of a template from the Jinja environment's cache.
+
+    Args:
+        jinja_env: The Jinja environment
+        template_id: The id of the template
+    """
+    if jinja_env.cache is None:
+        return
+
+    for cache_key in jinja_env.cache.keys():
+        if cache_key[1].startswith(f"{template_id}/"):
+            invalidate_jinja_template(jinja_env, cache_key[1])
@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import re
+from importlib.util import find_spec
+from typing import Dict, Sequence, Tuple
+
+# brotli is only available on CPython, as a dependency of WeasyPrint
+CONTENT_ENCODINGS: Tuple[str, ...] = ("br", "gzip") if find_spec("brotli") is not None else ("gzip",)
+"""
+Content codings applied to compressible responses, by preference
+"""
+
+# favour speed, as responses are compressed on every request
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+_BYTE_RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)", re.IGNORECASE)
+
+
+def strong_etag(*parts: object) -> str:
+    """
+    Builds a strong ETag from the given parts, which should identify a representation's version.
+
+    Args:
+        parts: The values the representation depends on
+
+    Returns:
+        str: The quoted ETag
+    """
+    return f'"{hashlib.sha256(":".join(map(str, parts)).encode()).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Checks if an If-None-Match header matches the given ETag, using the weak comparison required for
+    conditional GET requests.
+
+    Args:
+        if_none_match: The value of the If-None-Match header
+        etag: The current ETag of the representation
+
+    Returns:
+        bool: True if the client's representation is still current
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+class RangeNotSatisfiable(ValueError):
+    """
+    Exception to be raised when none of the requested byte ranges overlap the representation
+    """
+    ...
+
+
+def parse_byte_range(range_header: str, size: int) -> Tuple[int, int] | None:
+    """
+    Parses a Range header for a representation of the given size. Only single byte ranges are supported: any other
+    range (e.g. multiple ranges, or another unit) is ignored, and the whole representation should be sent.
+
+    Args:
+        range_header: The value of the Range header, e.g. `bytes=0-1023`, `bytes=1024-` or `bytes=-1024`
+        size: The size of the representation, in bytes
+
+    Raises:
+        RangeNotSatisfiable: When the range doesn't overlap the representation
+
+    Returns:
+        Tuple[int, int] | None: The first and last (inclusive) positions of the range, or None if it's ignored
+    """
+    match = _BYTE_RANGE_PATTERN.fullmatch(range_header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+        if last and end < start:
+            return None
+    elif last:
+        start, end = size - min(int(last), size), size - 1
+    else:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable(range_header)
+    return start, min(end, size - 1)
+
+
+def negotiate_encoding(accept_encoding: str | None, available: Sequence[str] = CONTENT_ENCODINGS) -> str | None:
+    """
+    Chooses a content coding accepted by the client, according to an Accept-Encoding header. Ties between
+    equally preferred codings are broken by the order of `available`.
+
+    Args:
+        accept_encoding: The value of the Accept-Encoding header
+        available: The codings the server can apply, by preference
+
+    Returns:
+        str | None: The chosen coding, or None if the content should be sent unencoded
+    """
+    if not accept_encoding:
+        return None
+
+    qualities: Dict[str, float] = {}
+    for coding in accept_encoding.split(","):
+        name, *parameters = (part.strip() for part in coding.split(";"))
+        quality = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+
+    default_quality = qualities.get("*", 0.0)
+    best_coding, best_quality = None, 0.0
+    for coding in available:
+        quality = qualities.get(coding, default_quality)
+        if quality > best_quality:
+            best_coding, best_quality = coding, quality
+    return best_coding
+
+
+def encode_content(content: bytes, coding: str) -> bytes:
+    """
+    Applies a content coding.
+
+    Args:
+        content: The content to be encoded
+        coding: One of CONTENT_ENCODINGS
+
+    Returns:
+        bytes: The encoded content
+    """
+    if coding == "br":
+        import brotli
+
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=GZIP_LEVEL)
@@ -10,3 +10,17 @@ def base_static_path(template_dir: str) -> str:
         Returns the base path for the static content
     """
     return f"{template_dir}/static"
+
+
+def template_directory_path(template_dir: str, template_id: str) -> str:
+    """
+        Returns the path for the directory holding every file of a certain template
+    """
+    return f"{template_dir}/templates/{template_id}/"
+
+
+def template_static_path(template_dir: str, template_id: str) -> str:
+    """
+        Returns the path for the static content of a certain template
+    """
+    return f"{base_static_path(template_dir)}/{template_id}/"
@@ -15,7 +15,7 @@ class InvalidFileStorageTypeException(Exception):
         super(InvalidFileStorageTypeException, self).__init__(type_)
 
 
-def create_template_environment(template_directory_path: str) -> JinjaEnv:
+def create_template_environment(template_directory_path: str, auto_reload: bool = True) -> JinjaEnv:
     """
     Setup jinja2 templating engine from a given directory path.
     Also adds all available filters to the JinjaEnv, which are available to be directly used within the template HTML files.
@@ -23,13 +23,16 @@ def create_template_environment(template_directory_path: str) -> JinjaEnv:
 
     Args:
         template_directory_path: Path to the directory where templates are stored
+        auto_reload: Whether Jinja should check if a template changed on disk every time it's used.
+            Can be disabled when changes are reported by a file storage watcher instead.
 
     Returns:
         JinjaEnv: Jinja2 Environment with templating
     """
     env = JinjaEnv(
         loader=FileSystemLoader(f"{template_directory_path}/templates"),
-        autoescape=select_autoescape(["html", "xml"])
+        autoescape=select_autoescape(["html", "xml"]),
+        auto_reload=auto_reload
     )
     env.filters.update({filter_.__name__: filter_ for filter_ in FILTERS})
     return env
@@ -0,0 +1,94 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator
+
+TOTAL_STAGE = "total"
+
+
+class StageTimings:
+    """
+    Durations of the stages of a request, in the order they were first run. Stages run more than once are added up.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        """
+        Records the duration of a stage.
+
+        Args:
+            stage: The name of the stage
+            seconds: The duration of the stage
+        """
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """
+        Formats the durations as a Server-Timing header value, in milliseconds.
+
+        Returns:
+            str: The Server-Timing header value
+        """
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items())
+
+
+_current_timings: ContextVar[StageTimings | None] = ContextVar("current_timings", default=None)
+
+
+@contextmanager
+def track_stages() -> Iterator[StageTimings]:
+    """
+    Tracks the stages timed with `timed_stage` or `record_stage` in the current context (including renders it submits
+    to the render pool), adding up the whole duration as the `total` stage.
+
+        Typical usage:
+
+            with track_stages() as timings:
+                ...
+            response.headers["Server-Timing"] = timings.server_timing()
+
+    Returns:
+        Iterator[StageTimings]: The tracked durations
+    """
+    timings = StageTimings()
+    token = _current_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        timings.record(TOTAL_STAGE, time.perf_counter() - start)
+        _current_timings.reset(token)
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """
+    Times a stage, when stages are tracked in the current context. Otherwise, does nothing.
+
+    Args:
+        stage: The name of the stage
+    """
+    if _current_timings.get() is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """
+    Records the duration of a stage timed elsewhere, when stages are tracked in the current context.
+
+    Args:
+        stage: The name of the stage
+        seconds: The duration of the stage
+    """
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.record(stage, seconds)
@@ -0,0 +1,190 @@
+import logging
+import os
+import signal
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Set
+
+import typer
+from starlette.datastructures import State
+
+from app.compose.job_queue import JobQueue, QueuedJob, RenderJobFailed, job_error, job_queue
+from app.compose.layout_cache import layout_cache
+from app.compose.render_pool import render_pool
+from app.compose.renderer import compose
+from app.db.notifications import TemplateChangeListener
+from app.db.session import db_session
+from app.metrics import TEMPLATE_SYNC_SECONDS
+from app.models.template import Template
+from app.preload import prepare_templates
+from app.settings import get_settings
+from app.util.cache_util import invalidate_changed_files, invalidate_template
+
+PURGE_INTERVAL_SECONDS = 60
+# the lease of a job being rendered is renewed this many times per lease, so a late renewal doesn't lose it
+LEASE_RENEWALS = 3
+
+worker_cli = typer.Typer()
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class RenderWorker:
+    """
+    Render worker of a render farm: consumes the render jobs queued by the API (see JobQueue) and stores their
+    results in the queue. Each of its `consumers` threads claims a job at a time, rendering it on the render pool, so
+    a worker should have as many consumers as the pool has workers. The lease of a job is renewed while it's rendered,
+    so it's only claimed again if the worker dies, however long the render takes.
+
+        Typical usage:
+
+            worker = RenderWorker(job_queue, state, consumers=4)
+            worker.start()
+            ...
+            worker.stop()
+    """
+
+    def __init__(self, job_queue: JobQueue, state: State, consumers: int, worker_id: str | None = None):
+        self.job_queue = job_queue
+        self.state = state
+        self.consumers = consumers
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        self._stop_event.clear()
+        self._threads = [threading.Thread(target=self._consume, args=(f"{self.worker_id}/{i}",), daemon=True,
+                                          name=f"plato-worker_{i}") for i in range(self.consumers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops claiming jobs, and waits for the jobs being rendered to be done.
+        """
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _consume(self, consumer_id: str) -> None:
+        while not self._stop_event.is_set():
+            try:
+                job = self.job_queue.claim(consumer_id)
+            except Exception:
+                logger.exception("Failed to claim a render job")
+                job = None
+            if job is None:
+                self._stop_event.wait(self.job_queue.poll_interval)
+                continue
+
+            try:
+                try:
+                    with self._renewing_lease(job, consumer_id):
+                        content = self._render(job)
+                except Exception as e:
+                    logger.info("Render job %s failed: %s", job.id, e)
+                    self.job_queue.fail(job.id, job_error(e))
+                else:
+                    self.job_queue.complete(job.id, content)
+            except Exception:
+                # the job is claimed again once its lease expires
+                logger.exception("Failed to store the outcome of render job %s", job.id)
+
+    @contextmanager
+    def _renewing_lease(self, job: QueuedJob, consumer_id: str) -> Iterator[None]:
+        """
+        Renews the lease of a claimed job in the background, until the context exits or the job isn't leased anymore.
+        """
+        done = threading.Event()
+
+        def renew() -> None:
+            while not done.wait(self.job_queue.lease_seconds / LEASE_RENEWALS):
+                try:
+                    if not self.job_queue.renew(job.id, consumer_id):
+                        return
+                except Exception:
+                    logger.exception("Failed to renew the lease of render job %s", job.id)
+
+        thread = threading.Thread(target=renew, daemon=True, name=f"{threading.current_thread().name}_lease")
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def _render(self, job: QueuedJob) -> bytes:
+        with db_session() as db:
+            template_model = db.query(Template).filter_by(id=job.template_id).one_or_none()
+            if template_model is None:
+                raise RenderJobFailed(f"Template '{job.template_id}' not found")
+
+        composed_file = render_pool.run(compose, template_model, job.compose_data, job.mime_type,
+                                        self.state.jinja_env, self.state.template_static_directory,
+                                        priority=job.priority, flow=job.template_id, **job.options)
+        return composed_file.getvalue()
+
+
+@worker_cli.command()
+def run(consumers: int = typer.Option(settings.RENDER_WORKERS, help="Number of jobs rendered concurrently")):
+    """
+    Run a render worker, rendering the jobs queued by Plato servers with RENDER_FARM enabled until it's stopped
+    (SIGTERM or SIGINT). Jobs being rendered are finished before the worker exits.
+    """
+    logging.basicConfig(level=logging.INFO)
+    state = State()
+    prepare_templates(state)
+
+    def discard_layouts(template_ids: Set[str] | None) -> None:
+        if template_ids is None:
+            layout_cache.discard()
+        for template_id in template_ids or []:
+            layout_cache.discard(template_id)
+
+    if state.watch_templates:
+        state.file_storage.watch(
+            settings.TEMPLATE_DIRECTORY,
+            lambda changed_paths: discard_layouts(
+                invalidate_changed_files(state.jinja_env, settings.TEMPLATE_DIRECTORY, changed_paths)
+            )
+        )
+
+    def refresh_template(template_id: str, updated_at: float | None) -> None:
+        with TEMPLATE_SYNC_SECONDS.time(operation="refresh"):
+            state.file_storage.load_template(settings.TEMPLATE_DIRECTORY, settings.TEMPLATE_DIRECTORY_NAME,
+                                             template_id, updated_at)
+        invalidate_template(state.jinja_env, template_id)
+        layout_cache.discard(template_id)
+
+    # templates published through Plato nodes
+    template_change_listener = TemplateChangeListener(settings.SQLALCHEMY_DATABASE_URI, refresh_template)
+    template_change_listener.start()
+
+    stop_event = threading.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: stop_event.set())
+
+    worker = RenderWorker(job_queue, state, consumers)
+    worker.start()
+    logger.info("Render worker %s started, with %d consumers", worker.worker_id, consumers)
+
+    # results the API never collected (e.g. after it timed out) are forgotten after a while
+    while not stop_event.wait(PURGE_INTERVAL_SECONDS):
+        try:
+            job_queue.purge(settings.RENDER_JOB_RETENTION_SECONDS)
+        except Exception:
+            logger.exception("Failed to purge finished render jobs")
+
+    logger.info("Render worker %s stopping", worker.worker_id)
+    worker.stop()
+    template_change_listener.stop()
+    if state.watch_templates:
+        state.file_storage.stop_watching()
+    render_pool.shutdown()
+
+
+if __name__ == "__main__":
+    worker_cli()
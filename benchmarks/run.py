@@ -0,0 +1,334 @@
+"""
+Benchmarks of the render pipeline, through `compose()` and through the HTTP app.
+
+    Typical usage:
+
+        python -m benchmarks.run --output results.json --baseline benchmarks/baseline.json
+"""
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from importlib.metadata import version
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import typer
+from fastapi import FastAPI
+from jinja2 import Environment as JinjaEnv
+
+from app.compose.renderer import compose
+from app.schemas.template_detail import MIMETypeEnum
+from app.util.setup_util import create_template_environment
+from app.util.timing_util import TOTAL_STAGE, track_stages
+from benchmarks.templates import BENCHMARK_MIME_TYPES, BENCHMARK_TEMPLATES, BenchmarkTemplate
+
+COMPOSE_MODE = "compose"
+HTTP_MODE = "http"
+
+PDF_OPTION_SETS: Dict[str, dict] = {
+    "default": {},
+    "optimize_images": {"optimize_images": True},
+    "jpeg_quality_60": {"jpeg_quality": 60},
+    "dpi_150": {"dpi": 150},
+    "dpi_72": {"dpi": 72},
+    "full_fonts": {"full_fonts": True},
+    "uncompressed_pdf": {"uncompressed_pdf": True},
+}
+"""
+WeasyPrint PDF options benchmarked against each other (see PdfOptionsSchema), by name
+"""
+
+benchmark_cli = typer.Typer()
+
+
+def benchmark_compose(template: BenchmarkTemplate, mime_type: str, jinja_env: JinjaEnv, template_static_directory: str,
+                      iterations: int, warmup: int, pdf_options: str | None = None) -> dict:
+    """
+    Benchmarks `compose()` for a template and MIME type: per-stage durations, latency, throughput, peak memory
+    (traced in an extra run, as tracing slows rendering down) and output size. `pdf_options` names the set of
+    PDF_OPTION_SETS to render with.
+    """
+    template_model = template.model()
+    options = PDF_OPTION_SETS[pdf_options] if pdf_options is not None else {}
+
+    def render() -> bytes:
+        return compose(template_model, template.example_composition, mime_type, jinja_env,
+                       template_static_directory, **options).getvalue()
+
+    for _ in range(warmup):
+        render()
+
+    stage_durations: Dict[str, List[float]] = defaultdict(list)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with track_stages() as timings:
+            output = render()
+        for stage, seconds in timings.stages.items():
+            stage_durations[stage].append(seconds)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        render()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = _result(COMPOSE_MODE, template, mime_type, iterations, elapsed, stage_durations,
+                     peak_memory_bytes=peak_memory, output_bytes=len(output))
+    if pdf_options is not None:
+        result["pdf_options"] = pdf_options
+    return result
+
+
+def benchmark_http(template: BenchmarkTemplate, mime_type: str, client, iterations: int, warmup: int) -> dict:
+    """
+    Benchmarks the compose endpoint for a template and MIME type, reading per-stage durations from the Server-Timing
+    response header.
+    """
+    def request():
+        response = client.post(f"/template/{template.template_id}/compose", json=template.example_composition,
+                               headers={"custom-accept": mime_type})
+        response.raise_for_status()
+        return response
+
+    for _ in range(warmup):
+        request()
+
+    stage_durations: Dict[str, List[float]] = defaultdict(list)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        response = request()
+        for metric in response.headers["Server-Timing"].split(", "):
+            stage, duration = metric.split(";dur=")
+            stage_durations[stage].append(float(duration) / 1000)
+    elapsed = time.perf_counter() - start
+
+    return _result(HTTP_MODE, template, mime_type, iterations, elapsed, stage_durations,
+                   peak_memory_bytes=None, output_bytes=len(response.content))
+
+
+def _result(mode: str, template: BenchmarkTemplate, mime_type: str, iterations: int, elapsed: float,
+            stage_durations: Dict[str, List[float]], peak_memory_bytes: int | None, output_bytes: int) -> dict:
+    latencies = sorted(stage_durations[TOTAL_STAGE])
+    return {
+        "mode": mode,
+        "template_id": template.template_id,
+        "mime_type": mime_type,
+        "iterations": iterations,
+        "docs_per_second": iterations / elapsed,
+        "latency_seconds": {
+            "mean": statistics.fmean(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        },
+        "stage_seconds": {stage: statistics.fmean(durations) for stage, durations in stage_durations.items()},
+        "peak_memory_bytes": peak_memory_bytes,
+        "output_bytes": output_bytes,
+    }
+
+
+def run_compose_benchmarks(templates: List[BenchmarkTemplate], mime_types: List[str], template_directory: Path,
+                           iterations: int, warmup: int) -> List[dict]:
+    jinja_env = create_template_environment(str(template_directory))
+    results = []
+    for template in templates:
+        for mime_type in mime_types:
+            typer.echo(f"{COMPOSE_MODE} {template.template_id} {mime_type}", err=True)
+            try:
+                results.append(benchmark_compose(template, mime_type, jinja_env, f"{template_directory}/static",
+                                                 iterations, warmup))
+            except Exception as e:
+                results.append(_error(COMPOSE_MODE, template, mime_type, e))
+    return results
+
+
+def run_pdf_option_benchmarks(templates: List[BenchmarkTemplate], template_directory: Path, iterations: int,
+                              warmup: int) -> List[dict]:
+    """
+    Benchmarks PDF compositions of every template with each set of PDF_OPTION_SETS, to compare the output size
+    and render time trade-offs of each option.
+    """
+    jinja_env = create_template_environment(str(template_directory))
+    mime_type = MIMETypeEnum.PDF_MIME.value
+    results = []
+    for template in templates:
+        for pdf_options in PDF_OPTION_SETS:
+            typer.echo(f"{COMPOSE_MODE} {template.template_id} {mime_type} {pdf_options}", err=True)
+            try:
+                results.append(benchmark_compose(template, mime_type, jinja_env, f"{template_directory}/static",
+                                                 iterations, warmup, pdf_options=pdf_options))
+            except Exception as e:
+                results.append({**_error(COMPOSE_MODE, template, mime_type, e), "pdf_options": pdf_options})
+    return results
+
+
+def pdf_option_tradeoffs(results: List[dict]) -> List[str]:
+    """
+    Describes the output size and throughput of every PDF options benchmark, relative to the default options
+    for the same template.
+
+    Returns:
+        List[str]: A description of every PDF options benchmark
+    """
+    defaults = {result["template_id"]: result for result in results
+                if result.get("pdf_options") == "default" and "error" not in result}
+    tradeoffs = []
+    for result in results:
+        default = defaults.get(result["template_id"])
+        if result.get("pdf_options") is None or default is None or "error" in result:
+            continue
+        tradeoffs.append(f"{result['template_id']} {result['pdf_options']}: {result['output_bytes']} bytes "
+                         f"({result['output_bytes'] / default['output_bytes']:.0%} of default), "
+                         f"{result['docs_per_second']:.2f} docs/s "
+                         f"({result['docs_per_second'] / default['docs_per_second']:.0%} of default)")
+    return tradeoffs
+
+
+def run_http_benchmarks(templates: List[BenchmarkTemplate], mime_types: List[str], template_directory: Path,
+                        iterations: int, warmup: int) -> List[dict]:
+    """
+    Runs the benchmarks through the HTTP app, with the benchmark templates stored in the configured database.
+    """
+    from fastapi.testclient import TestClient
+
+    from app.db.session import db_session
+    from app.main import app
+    from app.models.template import Template
+
+    @asynccontextmanager
+    async def benchmark_lifespan(api: FastAPI):
+        api.state.jinja_env = create_template_environment(str(template_directory))
+        api.state.template_directory = str(template_directory)
+        api.state.template_static_directory = f"{template_directory}/static"
+        yield
+
+    template_ids = [template.template_id for template in templates]
+    with db_session() as db:
+        db.query(Template).filter(Template.id.in_(template_ids)).delete()
+        db.add_all(template.model() for template in templates)
+        db.commit()
+
+    app.router.lifespan_context = benchmark_lifespan
+    results = []
+    try:
+        with TestClient(app) as client:
+            for template in templates:
+                for mime_type in mime_types:
+                    typer.echo(f"{HTTP_MODE} {template.template_id} {mime_type}", err=True)
+                    try:
+                        results.append(benchmark_http(template, mime_type, client, iterations, warmup))
+                    except Exception as e:
+                        results.append(_error(HTTP_MODE, template, mime_type, e))
+    finally:
+        with db_session() as db:
+            db.query(Template).filter(Template.id.in_(template_ids)).delete()
+            db.commit()
+    return results
+
+
+def _error(mode: str, template: BenchmarkTemplate, mime_type: str, error: Exception) -> dict:
+    return {"mode": mode, "template_id": template.template_id, "mime_type": mime_type,
+            "error": f"{type(error).__name__}: {error}"}
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """
+    Compares benchmark results with a baseline, reporting throughput drops and peak memory increases larger than
+    the tolerance (e.g. 0.1 for 10%), and benchmarks which failed but succeeded in the baseline.
+
+    Returns:
+        List[str]: A description of every regression
+    """
+    def result_key(result: dict) -> tuple:
+        return result["mode"], result["template_id"], result["mime_type"], result.get("pdf_options")
+
+    baseline_by_key = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        baseline_result = baseline_by_key.get(key)
+        if baseline_result is None or "error" in baseline_result:
+            continue
+        name = " ".join(part for part in key if part is not None)
+        if "error" in result:
+            regressions.append(f"{name}: failed ({result['error']})")
+            continue
+
+        if result["docs_per_second"] < baseline_result["docs_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['docs_per_second']:.2f} docs/s, "
+                               f"baseline {baseline_result['docs_per_second']:.2f} docs/s")
+        if (result["peak_memory_bytes"] is not None and baseline_result["peak_memory_bytes"] is not None
+                and result["peak_memory_bytes"] > baseline_result["peak_memory_bytes"] * (1 + tolerance)):
+            regressions.append(f"{name}: {result['peak_memory_bytes']} bytes peak memory, "
+                               f"baseline {baseline_result['peak_memory_bytes']} bytes")
+    return regressions
+
+
+def environment() -> dict:
+    """
+    Describes the environment the benchmarks ran in, as results are only comparable within the same environment.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "weasyprint": version("weasyprint"),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "commit": commit,
+    }
+
+
+@benchmark_cli.command()
+def run(output: Path = typer.Option(Path("benchmark-results.json"), help="Where the results are written"),
+        baseline: Optional[Path] = typer.Option(None, help="Results to compare with"),
+        tolerance: float = typer.Option(0.1, help="Tolerated throughput drop and peak memory increase, as a ratio"),
+        template: Optional[List[str]] = typer.Option(None, help="Templates to benchmark (all by default)"),
+        mime_type: Optional[List[str]] = typer.Option(None, help="MIME types to benchmark (all by default)"),
+        iterations: int = typer.Option(10, help="Measured renders per benchmark"),
+        warmup: int = typer.Option(2, help="Renders run before measuring, to warm up caches"),
+        http: bool = typer.Option(False, help="Also benchmark the HTTP app, which requires the configured database"),
+        pdf_options: bool = typer.Option(False, help="Also benchmark PDF compositions with each set of PDF options")):
+    """
+    Runs the benchmarks, writing the results as JSON. Exits with an error when a baseline is given and a benchmark
+    regressed beyond the tolerance.
+    """
+    templates = [BENCHMARK_TEMPLATES[template_id] for template_id in template] if template \
+        else list(BENCHMARK_TEMPLATES.values())
+    mime_types = mime_type or BENCHMARK_MIME_TYPES
+
+    with tempfile.TemporaryDirectory() as template_directory:
+        for benchmark_template in templates:
+            benchmark_template.install(Path(template_directory))
+
+        results = run_compose_benchmarks(templates, mime_types, Path(template_directory), iterations, warmup)
+        if http:
+            results += run_http_benchmarks(templates, mime_types, Path(template_directory), iterations, warmup)
+        if pdf_options:
+            option_results = run_pdf_option_benchmarks(templates, Path(template_directory), iterations, warmup)
+            for tradeoff in pdf_option_tradeoffs(option_results):
+                typer.echo(tradeoff, err=True)
+            results += option_results
+
+    output.write_text(json.dumps({"environment": environment(), "results": results}, indent=2))
+    typer.echo(f"Results written to {output}")
+
+    if baseline is not None:
+        regressions = compare(results, json.loads(baseline.read_text())["results"], tolerance)
+        for regression in regressions:
+            typer.echo(f"Regression: {regression}", err=True)
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    benchmark_cli()
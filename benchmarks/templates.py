@@ -0,0 +1,161 @@
+import random
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from PIL import Image
+
+from app.models.template import Template
+from app.schemas.template_detail import MIMETypeEnum
+
+
+class BenchmarkTemplate:
+    """
+    A representative template for the benchmarks, with its example composition used as the benchmark payload
+    """
+
+    def __init__(self, template_id: str, html: str, schema: dict, example_composition: dict, metadata: dict | None = None,
+                 write_static_files: Callable[[Path], None] | None = None):
+        self.template_id = template_id
+        self.html = html
+        self.schema = schema
+        self.example_composition = example_composition
+        self.metadata = metadata or {}
+        self.write_static_files = write_static_files
+
+    def model(self) -> Template:
+        template = Template(id_=self.template_id, schema=self.schema, type_=MIMETypeEnum.HTML_MIME.value,
+                            metadata=self.metadata, example_composition=self.example_composition, tags=["benchmark"])
+        template.version = 1
+        return template
+
+    def install(self, template_directory: Path) -> None:
+        """
+        Writes the template and its static files with the layout expected by Plato.
+        """
+        template_path = template_directory / "templates" / self.template_id / self.template_id
+        template_path.parent.mkdir(parents=True, exist_ok=True)
+        template_path.write_text(self.html, encoding="utf-8")
+        if self.write_static_files is not None:
+            static_directory = template_directory / "static" / self.template_id
+            static_directory.mkdir(parents=True, exist_ok=True)
+            self.write_static_files(static_directory)
+
+
+CERTIFICATE = BenchmarkTemplate(
+    template_id="benchmark_certificate",
+    html="""<!DOCTYPE html>
+<html>
+<head>
+<style>
+  @page { size: A4 landscape; margin: 2cm; }
+  body { font-family: serif; text-align: center; }
+  h1 { font-size: 48pt; margin-top: 3cm; }
+  .name { font-size: 32pt; font-weight: bold; border-bottom: 1px solid #333; display: inline-block; }
+</style>
+</head>
+<body>
+  <h1>Certificate of Completion</h1>
+  <p>This certifies that</p>
+  <p class="name">{{ p.name }}</p>
+  <p>has completed the course <strong>{{ p.course }}</strong> on {{ p.date }}.</p>
+</body>
+</html>
+""",
+    schema={"type": "object", "required": ["name", "course", "date"],
+            "properties": {"name": {"type": "string"}, "course": {"type": "string"}, "date": {"type": "string"}}},
+    example_composition={"name": "Ada Lovelace", "course": "Analytical Engines", "date": "2026-10-19"},
+)
+
+QR_CODE_COUNT = 24
+
+QR_HEAVY = BenchmarkTemplate(
+    template_id="benchmark_qr_heavy",
+    html="""<!DOCTYPE html>
+<html>
+<head><style>img { width: 3cm; height: 3cm; margin: 0.2cm; }</style></head>
+<body>
+  {% for key, path in p.links.items() %}<img src="file://{{ path }}" alt="{{ key }}">{% endfor %}
+</body>
+</html>
+""",
+    schema={"type": "object", "properties": {"links": {"type": "object"}}},
+    example_composition={"links": {f"link{i}": f"https://example.com/tickets/{i:06d}" for i in range(QR_CODE_COUNT)}},
+    metadata={"qr_entries": [f"links.link{i}" for i in range(QR_CODE_COUNT)]},
+)
+
+REPORT_PAGES = 50
+REPORT_ROWS_PER_PAGE = 30
+
+REPORT = BenchmarkTemplate(
+    template_id="benchmark_report",
+    html="""<!DOCTYPE html>
+<html>
+<head>
+<style>
+  @page { size: A4; margin: 1.5cm; @bottom-center { content: counter(page) " / " counter(pages); } }
+  section { page-break-after: always; }
+  table { width: 100%; border-collapse: collapse; font-size: 9pt; }
+  td, th { border: 1px solid #999; padding: 2pt 4pt; }
+</style>
+</head>
+<body>
+  {% for section in p.sections %}
+  <section>
+    <h2>{{ section.title }}</h2>
+    <table>
+      <tr><th>#</th><th>Item</th><th>Quantity</th><th>Amount</th></tr>
+      {% for row in section.rows %}
+      <tr><td>{{ loop.index }}</td><td>{{ row.item }}</td><td>{{ row.quantity }}</td><td>{{ row.amount }}</td></tr>
+      {% endfor %}
+    </table>
+  </section>
+  {% endfor %}
+</body>
+</html>
+""",
+    schema={"type": "object", "properties": {"sections": {"type": "array"}}},
+    example_composition={"sections": [
+        {"title": f"Section {section}",
+         "rows": [{"item": f"Item {section}.{row}", "quantity": row % 7 + 1, "amount": f"{(row * 13.37):.2f}"}
+                  for row in range(REPORT_ROWS_PER_PAGE)]}
+        for section in range(REPORT_PAGES)
+    ]},
+)
+
+IMAGE_COUNT = 12
+IMAGE_SIZE = (1600, 1200)
+
+
+def write_images(static_directory: Path) -> None:
+    """
+    Writes photo-like images (a gradient with noise, which compresses poorly), generated deterministically.
+    """
+    generator = random.Random(42)
+    for i in range(IMAGE_COUNT):
+        image = Image.linear_gradient("L").resize(IMAGE_SIZE).convert("RGB")
+        noise = Image.frombytes("RGB", IMAGE_SIZE, generator.randbytes(IMAGE_SIZE[0] * IMAGE_SIZE[1] * 3))
+        Image.blend(image, noise, 0.3).save(static_directory / f"image{i}.png")
+
+
+IMAGE_HEAVY = BenchmarkTemplate(
+    template_id="benchmark_image_heavy",
+    html="""<!DOCTYPE html>
+<html>
+<head><style>img { width: 100%; page-break-inside: avoid; margin-bottom: 1cm; }</style></head>
+<body>
+  <h1>{{ p.title }}</h1>
+  {% for i in range(p.images) %}<img src="file://{{ template_static }}image{{ i }}.png">{% endfor %}
+</body>
+</html>
+""",
+    schema={"type": "object", "properties": {"title": {"type": "string"}, "images": {"type": "integer"}}},
+    example_composition={"title": "Photo album", "images": IMAGE_COUNT},
+    write_static_files=write_images,
+)
+
+BENCHMARK_TEMPLATES: Dict[str, BenchmarkTemplate] = {
+    template.template_id: template for template in (CERTIFICATE, QR_HEAVY, REPORT, IMAGE_HEAVY)
+}
+
+BENCHMARK_MIME_TYPES: List[str] = [MIMETypeEnum.PDF_MIME.value, MIMETypeEnum.PNG_MIME.value,
+                                   MIMETypeEnum.HTML_MIME.value]
@@ -0,0 +1,53 @@
+"""
+Gunicorn configuration, loaded when gunicorn runs from the project directory:
+
+    gunicorn app.main:app --bind 0.0.0.0:8000 --workers 4
+
+With PRELOAD_APP enabled, the templates are prepared once in the master process, and the workers forked from it
+share that memory copy-on-write (see app.preload).
+
+The workers share their metrics through METRICS_DIRECTORY, or a temporary directory if it isn't set, so any of them
+serves the metrics of all of them, including the ones of workers which exited (see app.metrics.MetricsDirectory).
+"""
+import os
+import shutil
+import tempfile
+
+from app.metrics import MetricsDirectory
+from app.settings import get_settings
+
+settings = get_settings()
+temporary_metrics_directory = None
+if not settings.METRICS_DIRECTORY:
+    # set before the workers load the settings, or inherit them from this process
+    temporary_metrics_directory = os.environ["METRICS_DIRECTORY"] = tempfile.mkdtemp(prefix="plato-metrics-")
+    get_settings.cache_clear()
+    settings = get_settings()
+metrics_directory = MetricsDirectory(settings.METRICS_DIRECTORY)
+
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = settings.PRELOAD_APP
+
+
+def on_starting(server):
+    metrics_directory.clear()
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from app.main import app
+        from app.preload import preload
+
+        preload(app)
+        # the metrics of preloading are kept, while the workers start counting from zero
+        metrics_directory.write()
+        metrics_directory.archive(os.getpid())
+
+
+def child_exit(server, worker):
+    metrics_directory.archive(worker.pid)
+
+
+def on_exit(server):
+    if temporary_metrics_directory is not None:
+        shutil.rmtree(temporary_metrics_directory, ignore_errors=True)
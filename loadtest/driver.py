@@ -0,0 +1,142 @@
+import asyncio
+import random
+import statistics
+import time
+from typing import List
+
+import httpx
+
+from loadtest.scenario import Phase, Scenario, ScenarioRequest
+
+
+class RequestOutcome:
+    """
+    Outcome of a single request: its latency, and its status code or the error which prevented a response
+    """
+
+    def __init__(self, latency: float, status_code: int | None = None, error: str | None = None):
+        self.latency = latency
+        self.status_code = status_code
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code is not None and self.status_code < 400
+
+
+class PhaseResult:
+    """
+    Outcomes of the requests sent during a phase, along with the requests which weren't sent because too many
+    were already in flight
+    """
+
+    def __init__(self, phase: Phase, outcomes: List[RequestOutcome], dropped: int, elapsed: float):
+        self.phase = phase
+        self.outcomes = outcomes
+        self.dropped = dropped
+        self.elapsed = elapsed
+
+    @property
+    def error_rate(self) -> float:
+        total = len(self.outcomes) + self.dropped
+        errors = sum(not outcome.ok for outcome in self.outcomes) + self.dropped
+        return errors / total if total else 0.0
+
+    @property
+    def throughput(self) -> float:
+        return sum(outcome.ok for outcome in self.outcomes) / self.elapsed
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        latencies = sorted(outcome.latency for outcome in self.outcomes if outcome.ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def saturated(self, scenario: Scenario) -> bool:
+        """
+        Whether the server couldn't keep up with the phase's arrival rate: it failed too many requests, answered too
+        slowly, or completed noticeably fewer requests than were offered.
+        """
+        p99 = self.latency_percentile(99)
+        return (self.error_rate > scenario.max_error_rate
+                or p99 is None or p99 > scenario.p99_seconds
+                or self.throughput < self.phase.rate * scenario.min_throughput_ratio)
+
+    def summary(self, scenario: Scenario) -> dict:
+        latencies = [outcome.latency for outcome in self.outcomes if outcome.ok]
+        errors: dict = {}
+        for outcome in self.outcomes:
+            if not outcome.ok:
+                key = outcome.error or str(outcome.status_code)
+                errors[key] = errors.get(key, 0) + 1
+        return {
+            "offered_rate": self.phase.rate,
+            "duration": self.phase.duration,
+            "sent": len(self.outcomes),
+            "dropped": self.dropped,
+            "throughput": self.throughput,
+            "error_rate": self.error_rate,
+            "errors": errors,
+            "latency_seconds": {
+                "mean": statistics.fmean(latencies) if latencies else None,
+                **{f"p{percentile}": self.latency_percentile(percentile) for percentile in (50, 90, 95, 99)},
+            },
+            "saturated": self.saturated(scenario),
+        }
+
+
+async def send(client: httpx.AsyncClient, request: ScenarioRequest, template_count: int,
+               rng: random.Random) -> RequestOutcome:
+    template_id = request.seeded_template_id(rng.randrange(template_count))
+    headers = {"custom-accept": request.mime_type}
+    start = time.perf_counter()
+    try:
+        if request.endpoint == "example":
+            response = await client.get(f"/template/{template_id}/example", headers=headers)
+        else:
+            response = await client.post(f"/template/{template_id}/compose", json=request.payload(), headers=headers)
+        await response.aread()
+    except httpx.HTTPError as e:
+        return RequestOutcome(time.perf_counter() - start, error=type(e).__name__)
+    return RequestOutcome(time.perf_counter() - start, status_code=response.status_code)
+
+
+async def run_phase(client: httpx.AsyncClient, scenario: Scenario, phase: Phase, rng: random.Random) -> PhaseResult:
+    """
+    Sends requests with exponentially distributed inter-arrival times at the phase's rate (an open-loop, Poisson
+    arrival process): requests are sent on schedule whether or not earlier ones completed, as real clients do, so
+    queueing in the server shows up as latency instead of silently lowering the load. Requests due while
+    `max_in_flight` requests are pending are counted as dropped.
+    """
+    in_flight: set = set()
+    outcomes: List[RequestOutcome] = []
+    dropped = 0
+    weights = [request.weight for request in scenario.requests]
+
+    start = time.perf_counter()
+    next_arrival = rng.expovariate(phase.rate)
+    while next_arrival < phase.duration:
+        await asyncio.sleep(max(0.0, start + next_arrival - time.perf_counter()))
+        if len(in_flight) >= scenario.max_in_flight:
+            dropped += 1
+        else:
+            request = rng.choices(scenario.requests, weights)[0]
+            task = asyncio.create_task(send(client, request, scenario.templates, rng))
+            in_flight.add(task)
+            task.add_done_callback(lambda done_task: (in_flight.discard(done_task),
+                                                      outcomes.append(done_task.result())))
+        next_arrival += rng.expovariate(phase.rate)
+
+    if in_flight:
+        await asyncio.wait(set(in_flight))
+    return PhaseResult(phase, outcomes, dropped, time.perf_counter() - start)
+
+
+async def run_scenario(base_url: str, scenario: Scenario, seed: int = 0) -> List[PhaseResult]:
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=scenario.max_in_flight, max_keepalive_connections=scenario.max_in_flight)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=scenario.timeout_seconds) as client:
+        results = []
+        for phase in scenario.phases:
+            results.append(await run_phase(client, scenario, phase, rng))
+        return results
@@ -0,0 +1,136 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from app.models.template import Template
+from benchmarks.templates import BenchmarkTemplate
+from loadtest.scenario import Scenario, seeded_template_id
+
+POSTGRES_VERSION = "17.5"
+PROJECT_DIRECTORY = Path(__file__).resolve().parent.parent
+SERVER_STARTUP_TIMEOUT_SECONDS = 120
+
+
+@contextmanager
+def local_postgres(database_uri: str | None = None) -> Iterator[str]:
+    """
+    Provides a database for the load test: the given one, or a throwaway Postgres container.
+
+    Returns:
+        Iterator[str]: The database URI
+    """
+    if database_uri is not None:
+        yield database_uri
+        return
+
+    from testcontainers.postgres import PostgresContainer
+
+    with PostgresContainer(image=f"postgres:{POSTGRES_VERSION}") as container:
+        yield container.get_connection_url()
+
+
+def server_environment(database_uri: str, data_directory: Path, render_workers: int) -> Dict[str, str]:
+    """
+    Environment for a Plato server using the given database, with disk storage standing in for the bucket.
+    """
+    url = make_url(database_uri)
+    return {
+        **os.environ,
+        "DB_HOST": url.host,
+        "DB_PORT": str(url.port or 5432),
+        "DB_USERNAME": url.username,
+        "DB_PASSWORD": url.password or "",
+        "DB_DATABASE": url.database,
+        "SQLALCHEMY_DATABASE_URI": url.set(drivername="postgresql").render_as_string(hide_password=False),
+        "ASYNC_SQLALCHEMY_DATABASE_URI": url.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False),
+        "POSTGRES_VER": POSTGRES_VERSION,
+        "STORAGE_TYPE": "disk",
+        "DATA_DIR": str(data_directory),
+        "CREDENTIALS_DIR": str(data_directory / "credentials"),
+        "TEMPLATE_DIRECTORY": str(data_directory / "templates"),
+        "TEMPLATE_DIRECTORY_NAME": "templating",
+        "BUCKET_NAME": "loadtest",
+        "RENDER_WORKERS": str(render_workers),
+    }
+
+
+def seed(database_uri: str, data_directory: Path, scenario: Scenario) -> None:
+    """
+    Migrates the database and seeds `scenario.templates` copies of every template used by the scenario,
+    in the database and in the template directory.
+    """
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=PROJECT_DIRECTORY, check=True,
+                   env=server_environment(database_uri, data_directory, render_workers=1))
+
+    template_directory = data_directory / "templates"
+    engine = create_engine(make_url(database_uri).set(drivername="postgresql"))
+    with Session(engine) as db:
+        for template in scenario.seeded_templates():
+            seeded_ids = [seeded_template_id(template, index) for index in range(scenario.templates)]
+            db.query(Template).filter(Template.id.in_(seeded_ids)).delete()
+            for seeded_id in seeded_ids:
+                seeded_template = BenchmarkTemplate(seeded_id, template.html, template.schema,
+                                                    template.example_composition, template.metadata,
+                                                    template.write_static_files)
+                seeded_template.install(template_directory)
+                db.add(seeded_template.model())
+        db.commit()
+    engine.dispose()
+
+
+@contextmanager
+def plato_server(database_uri: str, data_directory: Path, processes: int, render_workers: int) -> Iterator[str]:
+    """
+    Runs a Plato server with the given number of worker processes, and render workers per process.
+
+    Returns:
+        Iterator[str]: The base URL of the server, once it is ready
+    """
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        port = free_socket.getsockname()[1]
+
+    log_path = data_directory / f"server-{processes}x{render_workers}.log"
+    with open(log_path, mode="wb") as log_file:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(processes), "--no-access-log"],
+            cwd=PROJECT_DIRECTORY, env=server_environment(database_uri, data_directory, render_workers),
+            stdout=log_file, stderr=subprocess.STDOUT,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            _wait_until_ready(server, base_url, log_path)
+            yield base_url
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+def _wait_until_ready(server: subprocess.Popen, base_url: str, log_path: Path) -> None:
+    deadline = time.monotonic() + SERVER_STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The Plato server exited during startup:\n{_log_tail(log_path)}")
+        try:
+            if httpx.get(f"{base_url}/metrics").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"The Plato server didn't start in {SERVER_STARTUP_TIMEOUT_SECONDS} seconds:\n"
+                       f"{_log_tail(log_path)}")
+
+
+def _log_tail(log_path: Path, lines: int = 20) -> str:
+    return "\n".join(log_path.read_text(errors="replace").splitlines()[-lines:])
@@ -0,0 +1,77 @@
+"""
+Load tests of a local Plato server, against a throwaway Postgres container (or a given database) with disk storage
+standing in for the bucket.
+
+    Typical usage:
+
+        python -m loadtest.run loadtest/scenarios/ramp.json --config 1x2 --config 2x2 --output report.json
+"""
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+
+from loadtest.driver import run_scenario
+from loadtest.environment import local_postgres, plato_server, seed
+from loadtest.scenario import Scenario
+
+loadtest_cli = typer.Typer()
+
+
+def parse_config(config: str) -> tuple[int, int]:
+    """
+    Parses a worker configuration, as `{processes}x{render workers per process}`.
+    """
+    processes, _, render_workers = config.partition("x")
+    return int(processes), int(render_workers or 1)
+
+
+@loadtest_cli.command()
+def run(scenario_path: Path = typer.Argument(..., help="The scenario, as JSON"),
+        config: Optional[List[str]] = typer.Option(None, help="Worker configurations to test, as "
+                                                                "{processes}x{render workers}, e.g. 2x4"),
+        database_uri: Optional[str] = typer.Option(None, help="Database to use instead of a Postgres container; "
+                                                              "its seeded templates are replaced"),
+        output: Path = typer.Option(Path("loadtest-report.json"), help="Where the report is written"),
+        seed_value: int = typer.Option(0, "--seed", help="Seed for arrival times and request choices")):
+    """
+    Runs a scenario against a Plato server for each worker configuration, reporting latency percentiles, error rates
+    and throughput per phase, and the saturation point of each configuration: the first arrival rate it couldn't
+    sustain.
+    """
+    scenario = Scenario.load(scenario_path)
+    configs = [parse_config(worker_config) for worker_config in config or ["1x1"]]
+
+    report = {"scenario": scenario.name, "configs": []}
+    with local_postgres(database_uri) as uri, tempfile.TemporaryDirectory() as data_directory:
+        seed(uri, Path(data_directory), scenario)
+        for processes, render_workers in configs:
+            typer.echo(f"Running '{scenario.name}' with {processes} processes x {render_workers} render workers")
+            with plato_server(uri, Path(data_directory), processes, render_workers) as base_url:
+                phase_results = asyncio.run(run_scenario(base_url, scenario, seed_value))
+
+            phases = [result.summary(scenario) for result in phase_results]
+            saturated_rates = [phase["offered_rate"] for phase in phases if phase["saturated"]]
+            sustained_rates = [phase["offered_rate"] for phase in phases if not phase["saturated"]]
+            report["configs"].append({
+                "processes": processes,
+                "render_workers": render_workers,
+                "saturation_rate": min(saturated_rates, default=None),
+                "max_sustained_rate": max(sustained_rates, default=None),
+                "phases": phases,
+            })
+            for phase in phases:
+                p99 = phase["latency_seconds"]["p99"]
+                typer.echo(f"  {phase['offered_rate']:>7.1f} req/s offered  {phase['throughput']:>7.1f} req/s served  "
+                           f"p99 {'-' if p99 is None else f'{p99:.3f}s':>8}  errors {phase['error_rate']:.1%}"
+                           f"{'  SATURATED' if phase['saturated'] else ''}")
+
+    output.write_text(json.dumps(report, indent=2))
+    typer.echo(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    loadtest_cli()
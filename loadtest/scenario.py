@@ -0,0 +1,70 @@
+import json
+from pathlib import Path
+from typing import List
+
+from benchmarks.templates import BENCHMARK_TEMPLATES, BenchmarkTemplate
+
+
+class ScenarioRequest:
+    """
+    A kind of request in a scenario's request mix, chosen in proportion to its weight. Requests are spread across
+    every seeded copy of their template.
+    """
+
+    def __init__(self, template: str, mime_type: str = "application/pdf", endpoint: str = "compose",
+                 weight: float = 1):
+        if template not in BENCHMARK_TEMPLATES:
+            raise ValueError(f"Unknown template '{template}', expected one of: {', '.join(BENCHMARK_TEMPLATES)}")
+        if endpoint not in ("compose", "example"):
+            raise ValueError(f"Unknown endpoint '{endpoint}', expected 'compose' or 'example'")
+        self.template = BENCHMARK_TEMPLATES[template]
+        self.mime_type = mime_type
+        self.endpoint = endpoint
+        self.weight = weight
+
+    def seeded_template_id(self, index: int) -> str:
+        return seeded_template_id(self.template, index)
+
+    def payload(self) -> dict:
+        return self.template.example_composition
+
+
+class Phase:
+    """
+    A period with a constant arrival rate, in requests per second
+    """
+
+    def __init__(self, rate: float, duration: float):
+        self.rate = rate
+        self.duration = duration
+
+
+class Scenario:
+    """
+    A load test: the templates to seed, the request mix, the phases (usually of increasing arrival rates), and the
+    service level beyond which a phase is considered saturated.
+    """
+
+    def __init__(self, name: str, requests: List[dict], phases: List[dict], templates: int = 10,
+                 max_in_flight: int = 500, timeout_seconds: float = 60, p99_seconds: float = 5,
+                 max_error_rate: float = 0.01, min_throughput_ratio: float = 0.9):
+        self.name = name
+        self.requests = [ScenarioRequest(**request) for request in requests]
+        self.phases = [Phase(**phase) for phase in phases]
+        self.templates = templates
+        self.max_in_flight = max_in_flight
+        self.timeout_seconds = timeout_seconds
+        self.p99_seconds = p99_seconds
+        self.max_error_rate = max_error_rate
+        self.min_throughput_ratio = min_throughput_ratio
+
+    @classmethod
+    def load(cls, path: Path) -> 'Scenario':
+        return cls(**json.loads(path.read_text()))
+
+    def seeded_templates(self) -> List[BenchmarkTemplate]:
+        return list({request.template.template_id: request.template for request in self.requests}.values())
+
+
+def seeded_template_id(template: BenchmarkTemplate, index: int) -> str:
+    return f"{template.template_id}_{index}"
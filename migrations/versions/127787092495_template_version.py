@@ -0,0 +1,46 @@
+"""Template version
+
+Revision ID: 127787092495
+Revises: 202677a47794
+Create Date: 2026-10-19 11:03:27.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '127787092495'
+down_revision = '202677a47794'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('template', sa.Column('version', sa.Integer(), nullable=False, server_default="1"))
+    op.add_column('template', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False,
+                                        server_default=sa.text("clock_timestamp()")))
+    op.create_index('ix_template_updated_at', 'template', ['updated_at'], unique=False)
+
+    # keeps the version up to date for updates made outside the application
+    op.execute("""
+        CREATE FUNCTION template_bump_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := OLD.version + 1;
+            NEW.updated_at := clock_timestamp();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER template_bump_version BEFORE UPDATE ON template
+        FOR EACH ROW EXECUTE FUNCTION template_bump_version()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER template_bump_version ON template")
+    op.execute("DROP FUNCTION template_bump_version()")
+    op.drop_index('ix_template_updated_at', table_name='template')
+    op.drop_column('template', 'updated_at')
+    op.drop_column('template', 'version')
@@ -0,0 +1,23 @@
+"""Tags GIN index
+
+Revision ID: 202677a47794
+Revises: b08bee53dee3
+Create Date: 2026-10-19 10:12:41.518203
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '202677a47794'
+down_revision = 'b08bee53dee3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_template_tags', 'template', ['tags'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_template_tags', table_name='template', postgresql_using='gin')
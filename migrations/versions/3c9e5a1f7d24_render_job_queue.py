@@ -0,0 +1,52 @@
+"""Render job queue
+
+Revision ID: 3c9e5a1f7d24
+Revises: 127787092495
+Create Date: 2026-10-19 14:21:08.331942
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e5a1f7d24'
+down_revision = '127787092495'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('render_job',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('template_id', sa.String(), nullable=False),
+    sa.Column('mime_type', sa.String(), nullable=False),
+    sa.Column('compose_data', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('options', postgresql.JSONB(astext_type=sa.Text()), nullable=False, server_default='{}'),
+    sa.Column('priority', sa.SmallInteger(), nullable=False, server_default='0'),
+    sa.Column('status', postgresql.ENUM('queued', 'running', 'done', 'failed', name='render_job_status'),
+              nullable=False, server_default='queued'),
+    sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('worker_id', sa.String(), nullable=True),
+    sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('result', sa.LargeBinary(), nullable=True),
+    sa.Column('error', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False,
+              server_default=sa.text('clock_timestamp()')),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_render_job_queued', 'render_job', ['priority', 'created_at'], unique=False,
+                    postgresql_where=sa.text("status = 'queued'"))
+    op.create_index('ix_render_job_running', 'render_job', ['locked_until'], unique=False,
+                    postgresql_where=sa.text("status = 'running'"))
+    op.create_index('ix_render_job_finished_at', 'render_job', ['finished_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_render_job_finished_at', table_name='render_job')
+    op.drop_index('ix_render_job_running', table_name='render_job', postgresql_where=sa.text("status = 'running'"))
+    op.drop_index('ix_render_job_queued', table_name='render_job', postgresql_where=sa.text("status = 'queued'"))
+    op.drop_table('render_job')
+    postgresql.ENUM(name='render_job_status').drop(op.get_bind())
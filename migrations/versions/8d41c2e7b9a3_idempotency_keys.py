@@ -0,0 +1,34 @@
+"""Idempotency keys
+
+Revision ID: 8d41c2e7b9a3
+Revises: 3c9e5a1f7d24
+Create Date: 2026-10-19 16:02:47.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41c2e7b9a3'
+down_revision = '3c9e5a1f7d24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('idempotency_key',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('fingerprint', sa.String(), nullable=False),
+    sa.Column('result', sa.LargeBinary(), nullable=True),
+    sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False,
+              server_default=sa.text('clock_timestamp()')),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_idempotency_key_created_at', 'idempotency_key', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_idempotency_key_created_at', table_name='idempotency_key')
+    op.drop_table('idempotency_key')
@@ -1,5 +1,9 @@
+import socket
+import subprocess
+import sys
 import tempfile
-from contextlib import asynccontextmanager
+import time
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
 from unittest import mock
 from unittest.mock import MagicMock
@@ -10,14 +14,17 @@ from google.cloud import storage
 from google.cloud.storage import Client
 from jinja2 import Environment as JinjaEnv, DictLoader, select_autoescape
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
 from testcontainers.postgres import PostgresContainer
 
 from app.db.base_class import Base
-from app.deps import get_db
+from app.deps import get_async_db, get_db
 from app.file_storage import DiskFileStorage, S3FileStorage, GCSFileStorage
 from app.main import app
 from app.settings import get_settings
+from loadtest.environment import PROJECT_DIRECTORY, server_environment
 
 settings = get_settings()
 settings.BUCKET_NAME = 'test_template_bucket'
@@ -45,8 +52,24 @@ def _setup_test_db(database_uri):
         db.close()
 
 
+@pytest.fixture(scope="session")
+def async_db(db: Session):
+    """
+    Dependency override providing asyncio sessions on the test database. Connections aren't pooled, as each test
+    client runs the application in its own event loop.
+    """
+    async_engine = create_async_engine(db.get_bind().url.set(drivername="postgresql+asyncpg"), poolclass=NullPool)
+    AsyncTestingSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
+
+    async def get_test_async_db():
+        async with AsyncTestingSessionLocal() as async_session:
+            yield async_session
+
+    return get_test_async_db
+
+
 @pytest.fixture(scope='class')
-def fastapi_client_s3_storage(db):
+def fastapi_client_s3_storage(db, async_db):
     @asynccontextmanager
     async def mock_lifespan(app):
         with tempfile.TemporaryDirectory() as file_dir, mock.patch("app.file_storage.S3FileStorage.get_aws_credentials") as mock_get_aws_credentials:
@@ -64,6 +87,7 @@ def fastapi_client_s3_storage(db):
             yield
 
     app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[get_async_db] = async_db
     app.router.lifespan_context = mock_lifespan
 
     with TestClient(app) as client:
@@ -71,7 +95,7 @@ def fastapi_client_s3_storage(db):
 
 
 @pytest.fixture(scope='class')
-def fastapi_client_gcs_storage(db):
+def fastapi_client_gcs_storage(db, async_db):
     @asynccontextmanager
     async def mock_lifespan(app):
         with tempfile.TemporaryDirectory() as file_dir, mock.patch.object(Client, "from_service_account_json") as mock_init_client:
@@ -91,6 +115,7 @@ def fastapi_client_gcs_storage(db):
             yield
 
     app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[get_async_db] = async_db
     app.router.lifespan_context = mock_lifespan
 
     with TestClient(app) as client:
@@ -98,7 +123,7 @@ def fastapi_client_gcs_storage(db):
 
 
 @pytest.fixture(scope='class')
-def fastapi_client_local_storage(db):
+def fastapi_client_local_storage(db, async_db):
     @asynccontextmanager
     async def mock_lifespan(app):
         with tempfile.TemporaryDirectory() as file_dir:
@@ -113,7 +138,41 @@ def fastapi_client_local_storage(db):
             yield
 
     app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[get_async_db] = async_db
     app.router.lifespan_context = mock_lifespan
 
     with TestClient(app) as client:
-        yield client
\ No newline at end of file
+        yield client
+
+@pytest.fixture
+def gunicorn_server(db, tmp_path):
+    """
+    Starts gunicorn serving the app on the test database, with tmp_path as its data directory (and disk storage),
+    the given number of workers and settings. Waits until every worker started, yielding the server process and
+    its base URL.
+    """
+    @contextmanager
+    def start(workers: int, **settings: str):
+        with socket.socket() as free_socket:
+            free_socket.bind(("127.0.0.1", 0))
+            port = free_socket.getsockname()[1]
+
+        database_uri = db.get_bind().url.render_as_string(hide_password=False)
+        env = {**server_environment(database_uri, tmp_path, render_workers=1), "PRERENDER_EXAMPLES": "false",
+               **settings}
+        log_path = tmp_path / f"gunicorn-{port}.log"
+        with open(log_path, mode="wb") as log_file:
+            server = subprocess.Popen([sys.executable, "-m", "gunicorn", "app.main:app", "--workers", str(workers),
+                                       "--bind", f"127.0.0.1:{port}"],
+                                      cwd=PROJECT_DIRECTORY, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        try:
+            deadline = time.monotonic() + 120
+            while log_path.read_text().count("Application startup complete") < workers:
+                assert server.poll() is None and time.monotonic() < deadline, log_path.read_text()
+                time.sleep(0.5)
+            yield server, f"http://127.0.0.1:{port}"
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    return start
@@ -0,0 +1,51 @@
+from pathlib import Path
+
+from app.schemas.template_detail import MIMETypeEnum
+from benchmarks.run import COMPOSE_MODE, compare, pdf_option_tradeoffs, run_compose_benchmarks
+from benchmarks.templates import CERTIFICATE, QR_HEAVY
+
+
+def test_compose_benchmarks(tmp_path: Path):
+    for template in (CERTIFICATE, QR_HEAVY):
+        template.install(tmp_path)
+
+    results = run_compose_benchmarks([CERTIFICATE, QR_HEAVY], [MIMETypeEnum.HTML_MIME.value], tmp_path,
+                                     iterations=2, warmup=0)
+
+    assert [result["template_id"] for result in results] == [CERTIFICATE.template_id, QR_HEAVY.template_id]
+    for result in results:
+        assert "error" not in result
+        assert result["docs_per_second"] > 0
+        assert result["peak_memory_bytes"] > 0
+        assert {"validate", "qr", "jinja", "total"} <= result["stage_seconds"].keys()
+    assert results[1]["stage_seconds"]["qr"] > results[0]["stage_seconds"]["qr"]
+
+
+def test_compare_with_baseline():
+    def result(docs_per_second: float, peak_memory_bytes: int, template_id: str = "certificate") -> dict:
+        return {"mode": COMPOSE_MODE, "template_id": template_id, "mime_type": MIMETypeEnum.PDF_MIME.value,
+                "docs_per_second": docs_per_second, "peak_memory_bytes": peak_memory_bytes}
+
+    baseline = [result(10, 1000), result(10, 1000, "report")]
+    assert compare([result(9.5, 1050), result(20, 500, "report")], baseline, tolerance=0.1) == []
+
+    regressions = compare([result(8, 1200), {**result(10, 1000, "report"), "error": "RuntimeError"}], baseline,
+                          tolerance=0.1)
+    assert len(regressions) == 3
+
+
+def test_pdf_option_tradeoffs():
+    def result(pdf_options: str, output_bytes: int, docs_per_second: float) -> dict:
+        return {"mode": COMPOSE_MODE, "template_id": "image_heavy", "mime_type": MIMETypeEnum.PDF_MIME.value,
+                "pdf_options": pdf_options, "output_bytes": output_bytes, "docs_per_second": docs_per_second,
+                "peak_memory_bytes": None}
+
+    results = [result("default", 1000, 10), result("dpi_72", 250, 8)]
+    assert pdf_option_tradeoffs(results) == [
+        "image_heavy default: 1000 bytes (100% of default), 10.00 docs/s (100% of default)",
+        "image_heavy dpi_72: 250 bytes (25% of default), 8.00 docs/s (80% of default)",
+    ]
+    # benchmarks with different options are compared with their own baseline
+    assert compare([result("default", 1000, 10), result("dpi_72", 250, 5)], results, tolerance=0.1) == [
+        f"{COMPOSE_MODE} image_heavy {MIMETypeEnum.PDF_MIME.value} dpi_72: 5.00 docs/s, baseline 8.00 docs/s"
+    ]
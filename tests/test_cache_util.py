@@ -0,0 +1,63 @@
+import pathlib
+from tempfile import TemporaryDirectory
+
+from jinja2 import Environment as JinjaEnv, FileSystemLoader
+
+from app.compose.static_assets import static_asset_cache
+from app.util.cache_util import invalidate_changed_files
+
+
+def create_template_files(template_directory: str):
+    for template_id in ("0", "1"):
+        template_file = pathlib.Path(template_directory, "templates", template_id, template_id)
+        template_file.parent.mkdir(parents=True)
+        template_file.write_text(f"template {template_id}")
+
+        static_file = pathlib.Path(template_directory, "static", template_id, "logo.png")
+        static_file.parent.mkdir(parents=True)
+        static_file.write_bytes(f"logo {template_id}".encode())
+
+
+class TestCacheInvalidation:
+    def test_only_changed_template_is_invalidated(self):
+        with TemporaryDirectory() as template_directory:
+            create_template_files(template_directory)
+            jinja_env = JinjaEnv(loader=FileSystemLoader(f"{template_directory}/templates"), auto_reload=False)
+            template_0 = jinja_env.get_template("0/0")
+            template_1 = jinja_env.get_template("1/1")
+
+            affected = invalidate_changed_files(jinja_env, template_directory,
+                                                {f"{template_directory}/templates/0/0"})
+
+            assert affected == {"0"}
+            assert jinja_env.get_template("0/0") is not template_0
+            assert jinja_env.get_template("1/1") is template_1
+
+    def test_changed_static_file_is_invalidated(self):
+        with TemporaryDirectory() as template_directory:
+            create_template_files(template_directory)
+            jinja_env = JinjaEnv(loader=FileSystemLoader(f"{template_directory}/templates"), auto_reload=False)
+            logo_path = f"{template_directory}/static/1/logo.png"
+            static_asset_cache.get(logo_path)
+
+            affected = invalidate_changed_files(jinja_env, template_directory, {logo_path})
+
+            assert affected == {"1"}
+            assert logo_path not in static_asset_cache._paths
+
+    def test_shared_file_affects_every_template(self):
+        with TemporaryDirectory() as template_directory:
+            create_template_files(template_directory)
+            jinja_env = JinjaEnv(loader=FileSystemLoader(f"{template_directory}/templates"), auto_reload=False)
+
+            affected = invalidate_changed_files(jinja_env, template_directory,
+                                                {f"{template_directory}/templates/0/0",
+                                                 f"{template_directory}/static/base.css"})
+
+            assert affected is None
+
+    def test_files_outside_template_directory_are_ignored(self):
+        with TemporaryDirectory() as template_directory:
+            jinja_env = JinjaEnv(loader=FileSystemLoader(f"{template_directory}/templates"), auto_reload=False)
+
+            assert invalidate_changed_files(jinja_env, template_directory, {"/somewhere/else"}) == set()
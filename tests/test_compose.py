@@ -4,6 +4,7 @@ from contextlib import asynccontextmanager
 from starlette import status
 from math import isclose
 from pathlib import Path
+from unittest import mock
 
 import pytest
 from PIL import Image
@@ -12,13 +13,22 @@ from fastapi.testclient import TestClient
 from jinja2 import DictLoader, select_autoescape
 from jinja2 import Environment as JinjaEnv
 from pypdf import PdfReader
-from sqlalchemy.orm import Session
-
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.compose.examples import example_key, prerender_examples
+from app.compose.idempotency import idempotency_store
+from app.compose.layout_cache import layout_cache, layout_key
+from app.compose.limits import PageLimitExceeded
+from app.compose.output_cache import output_cache
+from app.compose.renderer import PdfRenderer, compose, with_value
 from app.deps import get_db
+from app.metrics import COMPOSE_STAGE_SECONDS, RENDER_QUEUE_WAIT_SECONDS
 from app.file_storage import DiskFileStorage
 from app.main import app
+from app.models.idempotency_key import IdempotencyKey
 from app.models.template import Template
 from app.schemas.template_detail import MIMETypeEnum
+from app.settings import get_settings
 
 PLAIN_TEXT_TEMPLATE_ID = "plain_text"
 PNG_IMAGE_TEMPLATE_ID = "png_image"
@@ -126,6 +136,13 @@ def template_test_examples(client_with_jinjaenv: TestClient, db: Session):
 
 
 
+@pytest.fixture
+def empty_layout_cache():
+    layout_cache.discard()
+    yield
+    layout_cache.discard()
+
+
 @pytest.mark.usefixtures("template_test_examples")
 class TestCompose:
     COMPOSE_ENDPOINT = "/template/{0}/compose"
@@ -171,6 +188,218 @@ class TestCompose:
         real_text = "".join(page.extract_text() or "" for page in pdf_reader.pages)
         assert real_text.strip() == expected_text
 
+    def test_example_prerendered(self, client_with_jinjaenv, db: Session):
+        test_template = db.query(Template).filter_by(id=PLAIN_TEXT_TEMPLATE_ID).one()
+        prerender_examples(test_template, app.state.jinja_env, app.state.template_static_directory).result()
+        assert output_cache.get(example_key(test_template, MIMETypeEnum.HTML_MIME.value)) == b"plain_example"
+
+        with mock.patch("app.compose.examples.compose") as mock_compose:
+            response = client_with_jinjaenv.get(self.EXAMPLE_COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID),
+                                                headers={"custom-accept": MIMETypeEnum.HTML_MIME.value})
+            mock_compose.assert_not_called()
+        assert response.status_code == status.HTTP_200_OK
+        assert response.content == b"plain_example"
+
+    def test_compose_server_timing(self, client_with_jinjaenv):
+        compose_count = COMPOSE_STAGE_SECONDS.count(stage="jinja", template_id=PLAIN_TEXT_TEMPLATE_ID,
+                                                    mime_type=MIMETypeEnum.HTML_MIME.value)
+
+        response = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID), json={"plain": "a"},
+                                             headers={"custom-accept": MIMETypeEnum.HTML_MIME.value})
+        assert response.status_code == status.HTTP_200_OK
+
+        stages = [metric.split(";dur=")[0] for metric in response.headers["Server-Timing"].split(", ")]
+        assert stages == ["db", "queue", "validate", "qr", "jinja", "total"]
+        assert COMPOSE_STAGE_SECONDS.count(stage="jinja", template_id=PLAIN_TEXT_TEMPLATE_ID,
+                                           mime_type=MIMETypeEnum.HTML_MIME.value) == compose_count + 1
+
+    def test_example_cached_on_first_request(self, client_with_jinjaenv, db: Session):
+        test_template = db.query(Template).filter_by(id=PLAIN_TEXT_TEMPLATE_ID).one()
+        output_cache.clear()
+
+        for _ in range(2):
+            response = client_with_jinjaenv.get(self.EXAMPLE_COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID),
+                                                headers={"custom-accept": MIMETypeEnum.HTML_MIME.value})
+            assert response.content == b"plain_example"
+        assert output_cache.get(example_key(test_template, MIMETypeEnum.HTML_MIME.value)) == b"plain_example"
+        assert test_template.example_composition == {"plain": "plain_example"}
+
+    def test_example_range(self, client_with_jinjaenv):
+        endpoint = self.EXAMPLE_COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+        headers = {"custom-accept": MIMETypeEnum.HTML_MIME.value}
+
+        response = client_with_jinjaenv.get(endpoint, headers=headers)
+        assert response.headers["Content-Length"] == str(len(b"plain_example"))
+        assert response.headers["Accept-Ranges"] == "bytes"
+        etag = response.headers["ETag"]
+
+        response = client_with_jinjaenv.get(endpoint, headers={**headers, "Range": "bytes=6-", "If-Range": etag})
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response.content == b"example"
+        assert response.headers["Content-Range"] == "bytes 6-12/13"
+
+        # the example changed since the client's ETag: the whole example is sent
+        response = client_with_jinjaenv.get(endpoint, headers={**headers, "Range": "bytes=6-", "If-Range": '"old"'})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.content == b"plain_example"
+
+        response = client_with_jinjaenv.get(endpoint, headers={**headers, "Range": "bytes=13-"})
+        assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        assert response.headers["Content-Range"] == "bytes */13"
+
+    @pytest.mark.parametrize("accept_encoding, content_encoding", [("gzip", "gzip"), ("br, gzip", "br"),
+                                                                   ("identity", None)])
+    def test_compose_html_compressed(self, client_with_jinjaenv, monkeypatch, accept_encoding: str,
+                                     content_encoding: str | None):
+        monkeypatch.setattr(get_settings(), "COMPRESSION_MIN_BYTES", 0)
+        response = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID), json={"plain": "a"},
+                                             headers={"custom-accept": MIMETypeEnum.HTML_MIME.value,
+                                                      "Accept-Encoding": accept_encoding})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers.get("Content-Encoding") == content_encoding
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert response.content == b"a"
+
+    def test_compose_idempotency_key(self, client_with_jinjaenv, db: Session):
+        endpoint = self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+        headers = {"custom-accept": MIMETypeEnum.HTML_MIME.value, "Idempotency-Key": "compose-plain"}
+
+        with mock.patch.object(idempotency_store, "session_factory", sessionmaker(bind=db.get_bind())):
+            try:
+                with mock.patch("app.main.compose", wraps=compose) as mock_compose:
+                    responses = [client_with_jinjaenv.post(endpoint, json={"plain": "a"}, headers=headers)
+                                 for _ in range(2)]
+                mock_compose.assert_called_once()
+                assert [response.content for response in responses] == [b"a", b"a"]
+                assert "Idempotent-Replayed" not in responses[0].headers
+                assert responses[1].headers["Idempotent-Replayed"] == "true"
+
+                response = client_with_jinjaenv.post(endpoint, json={"plain": "b"}, headers=headers)
+                assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+            finally:
+                db.query(IdempotencyKey).filter_by(key="compose-plain").delete()
+                db.commit()
+
+        response = client_with_jinjaenv.post(endpoint, json={"plain": "a"}, headers={**headers, "Idempotency-Key": ""})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_compose_priority(self, client_with_jinjaenv):
+        endpoint = self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+        bulk_renders = RENDER_QUEUE_WAIT_SECONDS.count(priority="bulk")
+
+        response = client_with_jinjaenv.post(endpoint, json={"plain": "a"},
+                                             headers={"custom-accept": MIMETypeEnum.HTML_MIME.value,
+                                                      "X-Plato-Priority": "bulk", "X-Plato-Caller": "batch"})
+        assert response.status_code == status.HTTP_200_OK
+        assert RENDER_QUEUE_WAIT_SECONDS.count(priority="bulk") == bulk_renders + 1
+
+        response = client_with_jinjaenv.post(endpoint, json={"plain": "a"}, headers={"X-Plato-Priority": "urgent"})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_compose_does_not_change_payload(self, client_with_jinjaenv, db: Session):
+        test_template = db.query(Template).filter_by(id=QR_CODE_TEMPLATE_ID).one()
+        compose_data = {"qr_code": "qr_url.com", "other": {"shared": True}}
+
+        for _ in range(2):
+            html = compose(test_template, compose_data, MIMETypeEnum.HTML_MIME.value, app.state.jinja_env,
+                           app.state.template_static_directory).getvalue().decode()
+            assert html.startswith('<!DOCTYPE html><html><body><img src="file:///')
+            assert '.png" alt="qr_fail">' in html
+        assert compose_data == {"qr_code": "qr_url.com", "other": {"shared": True}}
+
+    def test_compose_payload_too_large(self, client_with_jinjaenv, monkeypatch):
+        monkeypatch.setattr(get_settings(), "COMPOSE_MAX_PAYLOAD_BYTES", 16)
+        endpoint = self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+
+        response = client_with_jinjaenv.post(endpoint, json={"plain": "a" * 16})
+        assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+        # without a Content-Length, the body is only read up to the maximum size
+        chunked_body = (chunk for chunk in [b'{"plain": "', b"a" * 16, b'"}'])
+        response = client_with_jinjaenv.post(endpoint, content=chunked_body,
+                                             headers={"Content-Type": "application/json"})
+        assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+    @pytest.mark.parametrize("body", ['{"plain": ' + "[" * 65 + "]" * 65 + "}", "[]", "{"])
+    def test_compose_invalid_payload(self, client_with_jinjaenv, body: str):
+        response = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID), content=body,
+                                             headers={"Content-Type": "application/json"})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    @pytest.mark.parametrize("error, status_code", [(PageLimitExceeded(10), status.HTTP_422_UNPROCESSABLE_ENTITY),
+                                                    (MemoryError(), status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)])
+    def test_compose_document_too_large(self, client_with_jinjaenv, error: Exception, status_code: int):
+        with mock.patch("app.main.compose", side_effect=error):
+            response = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID),
+                                                 json={"plain": "a"})
+        assert response.status_code == status_code
+
+    LAYOUT_ENDPOINT = "/template/{0}/layout"
+
+    @staticmethod
+    def mock_layout(html: mock.MagicMock, pages: int) -> None:
+        # an A4 page, in CSS pixels
+        html.return_value.render.return_value.pages = [mock.Mock(width=793.7, height=1122.5) for _ in range(pages)]
+        html.return_value.render.return_value.write_pdf.return_value = b"%PDF"
+
+    @pytest.mark.usefixtures("empty_layout_cache")
+    def test_layout(self, client_with_jinjaenv):
+        endpoint = self.LAYOUT_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+
+        with mock.patch("weasyprint.HTML") as html:
+            self.mock_layout(html, pages=2)
+            responses = [client_with_jinjaenv.post(endpoint, json={"plain": "a"}) for _ in range(2)]
+            # composing the same payload writes the cached layout
+            composed = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID),
+                                                 json={"plain": "a"})
+
+        html.return_value.render.assert_called_once()
+        html.return_value.render.return_value.write_pdf.assert_called_once()
+        assert composed.content == b"%PDF"
+        assert [response.status_code for response in responses] == [status.HTTP_200_OK] * 2
+        layout = responses[0].json()
+        assert layout["pages"] == 2
+        assert all(isclose(page["width"], 595.3, abs_tol=0.1) and isclose(page["height"], 841.9, abs_tol=0.1)
+                   for page in layout["page_sizes"])
+        assert [response.json()["cached"] for response in responses] == [False, True]
+        assert {"db", "validate", "jinja", "layout"} <= set(layout["timings"])
+        assert "write" not in layout["timings"]
+        assert "layout;dur=" in responses[0].headers["Server-Timing"]
+
+    @pytest.mark.usefixtures("empty_layout_cache")
+    def test_layout_options(self, client_with_jinjaenv):
+        endpoint = self.LAYOUT_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+
+        with mock.patch("weasyprint.HTML") as html:
+            self.mock_layout(html, pages=1)
+            client_with_jinjaenv.post(endpoint, json={"plain": "a"})
+            response = client_with_jinjaenv.post(f"{endpoint}?dpi=96", json={"plain": "a"})
+        # layouts with different options aren't shared
+        assert html.return_value.render.call_count == 2
+        html.return_value.render.assert_called_with(dpi=96)
+        assert response.json()["cached"] is False
+
+        response = client_with_jinjaenv.post(endpoint, json={"plain": "a"},
+                                             headers={"custom-accept": MIMETypeEnum.HTML_MIME.value})
+        assert response.status_code == status.HTTP_406_NOT_ACCEPTABLE
+
+        response = client_with_jinjaenv.post(endpoint, json={"plain": 1})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        with mock.patch("app.main.layout", side_effect=PageLimitExceeded(10)):
+            response = client_with_jinjaenv.post(endpoint, json={"plain": "a"})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_pdf_options_unsupported(self, client_with_jinjaenv):
+        response = client_with_jinjaenv.post(f"{self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)}?jpeg_quality=60",
+                                             json={"plain": "a"}, headers={"custom-accept": MIMETypeEnum.HTML_MIME.value})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json() == {"detail": f"PDF options unsupported on provided mime_type: {MIMETypeEnum.HTML_MIME.value}"}
+
+        response = client_with_jinjaenv.post(f"{self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)}?jpeg_quality=100",
+                                             json={"plain": "a"})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
     @pytest.mark.skip(reason="PNG composition service is temporarily unavailable")
     def test_resize_ok(self, client_with_jinjaenv):
         error = 1
@@ -254,3 +483,39 @@ class TestCompose:
             for image in page.images:
                 images_.append(image)
         assert len(images_) == 1
+
+
+def test_pdf_options_override_template_defaults():
+    template = Template(id_=PLAIN_TEXT_TEMPLATE_ID, schema={}, type_=MIMETypeEnum.HTML_MIME.value,
+                        metadata={"pdf_options": {"jpeg_quality": 80, "dpi": 150, "unknown": True}},
+                        example_composition={}, tags=[])
+    renderer = PdfRenderer(template, JinjaEnv(), "", dpi=300, optimize_images=True, full_fonts=None,
+                           uncompressed_pdf=True)
+    assert renderer.pdf_options == {"jpeg_quality": 80, "dpi": 300, "optimize_images": True, "uncompressed_pdf": True}
+
+    with mock.patch("weasyprint.HTML") as html:
+        html.return_value.render.return_value.write_pdf.return_value = b"%PDF"
+        assert renderer.print("<p></p>").getvalue() == b"%PDF"
+    html.return_value.render.assert_called_once_with(jpeg_quality=80, dpi=300, optimize_images=True)
+    html.return_value.render.return_value.write_pdf.assert_called_once_with(uncompressed_pdf=True)
+
+
+def test_pdfs_written_differently_share_layouts():
+    template = Template(id_=PLAIN_TEXT_TEMPLATE_ID, schema={}, type_=MIMETypeEnum.HTML_MIME.value,
+                        metadata={}, example_composition={}, tags=[])
+    compressed = PdfRenderer(template, JinjaEnv(), "", dpi=150)
+    uncompressed = PdfRenderer(template, JinjaEnv(), "", dpi=150, uncompressed_pdf=True, full_fonts=True)
+    resampled = PdfRenderer(template, JinjaEnv(), "", dpi=96)
+
+    key = layout_key(template, {}, compressed.layout_options)
+    assert key == layout_key(template, {}, uncompressed.layout_options)
+    assert key != layout_key(template, {}, resampled.layout_options)
+
+
+def test_with_value_copies_only_the_key_path():
+    compose_data = {"course": {"website": "url", "name": "course"}, "student": {"name": "student"}}
+
+    updated_data = with_value(compose_data, ["course", "website"], "qr.png")
+    assert updated_data == {"course": {"website": "qr.png", "name": "course"}, "student": {"name": "student"}}
+    assert compose_data["course"]["website"] == "url"
+    assert updated_data["student"] is compose_data["student"]
@@ -1,11 +1,12 @@
 import pathlib
+import threading
 from tempfile import TemporaryDirectory
 
 from unittest import mock
 from unittest.mock import call, MagicMock, mock_open
 
 import pytest
-from app.file_storage import S3FileStorage, NoIndexTemplateFound, FileStorageError
+from app.file_storage import DiskFileStorage, S3FileStorage, NoIndexTemplateFound, FileStorageError
 from app.models import Template
 from google.cloud.storage import Blob
 from sqlalchemy.orm import Session
@@ -58,6 +59,101 @@ class TestFileStorage:
             assert pathlib.Path(static_file_2).is_file()
             assert pathlib.Path(template_file_1).is_file()
 
+    def test_file_storage_write_files_deduplicates_content(self):
+        files = {"templating/static/0/logo.png": b"same content",
+                 "templating/static/1/logo.png": b"same content",
+                 "templating/static/1/font.ttf": b"other content"}
+
+        with TemporaryDirectory() as temp:
+            template_dir = create_child_temp_folder(temp)
+
+            file_storage = DiskFileStorage(temp)
+            file_storage.write_files(files, template_dir)
+
+            logo_0 = pathlib.Path(f'{template_dir}/templating/{get_local_static_file_path(file_name="logo.png", template_id="0")}')
+            logo_1 = pathlib.Path(f'{template_dir}/templating/{get_local_static_file_path(file_name="logo.png", template_id="1")}')
+            font_1 = pathlib.Path(f'{template_dir}/templating/{get_local_static_file_path(file_name="font.ttf", template_id="1")}')
+
+            assert logo_0.read_bytes() == logo_1.read_bytes() == b"same content"
+            assert logo_0.samefile(logo_1)
+            assert not logo_0.samefile(font_1)
+
+            # the blob is only referenced by the template directory, so it survives a prune
+            assert file_storage.blob_store.prune() == 0
+            font_1.unlink()
+            assert file_storage.blob_store.prune() == 1
+            assert logo_0.read_bytes() == b"same content"
+
+    def test_blob_store_prune_waits_for_writers(self):
+        with TemporaryDirectory() as temp:
+            file_storage = DiskFileStorage(temp)
+            blob_store = file_storage.blob_store
+            target = pathlib.Path(f'{temp}/{get_local_static_file_path(file_name="logo.png", template_id="0")}')
+            pruned = []
+
+            with blob_store.writing():
+                digest = blob_store.put(b"content")
+                # another process pruning the store while the blob isn't placed yet
+                prune_thread = threading.Thread(target=lambda: pruned.append(blob_store.prune()))
+                prune_thread.start()
+                prune_thread.join(0.2)
+                assert prune_thread.is_alive()
+                blob_store.link(digest, target)
+
+            prune_thread.join(5)
+            assert pruned == [0]
+            assert target.read_bytes() == b"content"
+
+    def test_disk_file_storage_watch(self):
+        with TemporaryDirectory() as temp:
+            template_dir = create_child_temp_folder(temp)
+            changed_paths = set()
+            changed = threading.Event()
+
+            def on_change(paths):
+                changed_paths.update(paths)
+                changed.set()
+
+            template_file = pathlib.Path(f'{template_dir}/{get_local_template_file_path(template_id="0")}')
+            template_file.parent.mkdir(parents=True)
+
+            file_storage = DiskFileStorage(temp)
+            try:
+                assert file_storage.watch(template_dir, on_change).wait(5)
+                template_file.write_text("file content")
+
+                assert changed.wait(5)
+            finally:
+                file_storage.stop_watching()
+
+            assert str(template_file) in changed_paths
+
+    def test_disk_file_storage_watch_survives_errors(self):
+        with TemporaryDirectory() as temp:
+            template_dir = create_child_temp_folder(temp)
+            batches = []
+            failed, changed = threading.Event(), threading.Event()
+
+            def on_change(paths):
+                batches.append(paths)
+                if not failed.is_set():
+                    failed.set()
+                    raise RuntimeError("failed to prerender")
+                changed.set()
+
+            file_storage = DiskFileStorage(temp)
+            try:
+                assert file_storage.watch(template_dir, on_change).wait(5)
+                pathlib.Path(f"{template_dir}/first").write_text("file content")
+                assert failed.wait(5)
+                pathlib.Path(f"{template_dir}/second").write_text("file content")
+
+                assert changed.wait(5)
+            finally:
+                file_storage.stop_watching()
+
+            assert f"{template_dir}/second" in batches[-1]
+
     def test_get_aws_credentials(self):
         mock_aws_credentials_data = """\
             {"aws_access_key_id": "test_aws_key_unit_test",
@@ -148,7 +244,48 @@ class TestFileStorage:
         # when debugging, the mocked iterator calls __len__() for some reason. this is why any_order is set to True
         # to, at least, guarantee that the calls we want actually are present in mock_iter_bucket.mock_calls
 
-    @mock.patch('app.file_storage.s3.iter_bucket')
+    @mock.patch.object(S3FileStorage, "get_file")
+    def test_file_storage_load_template_by_one_process(self, mock_s3_get_file,
+                                                       fastapi_client_s3_storage: TestClient):
+        mock_s3_get_file.side_effect = lambda path, template_directory: {
+            f"{BASE_DIR}/templates/0/": {"/templates/0/0": b"new content"},
+            f"{BASE_DIR}/static/0/": {"/static/0/logo.png": b"new logo"},
+        }[path]
+        s3_file_storage = fastapi_client_s3_storage.app.state.file_storage
+        loaders = 4
+
+        with TemporaryDirectory() as template_dir:
+            template_file = pathlib.Path(template_dir, get_local_template_file_path(template_id="0"))
+            stale_file = template_file.with_name("stale.html")
+            s3_file_storage.write_files({get_local_template_file_path(template_id="0"): b"old content",
+                                         "templates/0/stale.html": b"stale"}, template_dir)
+
+            # every worker process of a host is notified at once, and loads the template into the same directory
+            barrier = threading.Barrier(loaders)
+
+            def load():
+                barrier.wait()
+                s3_file_storage.load_template(template_dir, BASE_DIR, "0", 100.0)
+
+            threads = [threading.Thread(target=load) for _ in range(loaders)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            assert template_file.read_bytes() == b"new content"
+            assert pathlib.Path(template_dir, get_local_static_file_path("0", "logo.png")).read_bytes() == b"new logo"
+            assert not stale_file.exists()
+            # only one of them downloads it
+            assert mock_s3_get_file.call_count == 2
+
+            # it's downloaded again when it changes later on, or when the change time is unknown
+            s3_file_storage.load_template(template_dir, BASE_DIR, "0", 100.5)
+            assert mock_s3_get_file.call_count == 4
+            s3_file_storage.load_template(template_dir, BASE_DIR, "0")
+            assert mock_s3_get_file.call_count == 6
+
+    @mock.patch('smart_open.s3.iter_bucket')
     def test_file_storage_get_file_s3(self, mock_iter_bucket, fastapi_client_s3_storage: TestClient):
         mock_iter_bucket.side_effect = [
             [('templating/static/0/abc_1', b'static content'), ('templating/static/0/abc_2', b'static content'),],
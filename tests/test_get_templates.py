@@ -1,10 +1,13 @@
 from fastapi.testclient import TestClient
 import pytest
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from starlette import status
 from json import loads as json_loads
 
+from app.main import tags_filter
 from app.models.template import Template
+from app.schemas.template_detail import TagsMatchEnum, TemplateDetailSchema, TemplatePartialSchema
 
 NUMBER_OF_TEMPLATES = 50
 
@@ -88,3 +91,175 @@ class TestGetTemplates:
         assert response.status_code == status.HTTP_200_OK
         assert len(response.json()) == 1
 
+
+    def test_obtain_templates_paginated(self, fastapi_client_local_storage: TestClient):
+        page_size = 20
+        template_ids = []
+        params = {"limit": page_size}
+
+        while True:
+            response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params=params)
+            assert response.status_code == status.HTTP_200_OK
+            assert len(response.json()) <= page_size
+            template_ids.extend(template_json["template_id"] for template_json in response.json())
+            if "X-Next-Cursor" not in response.headers:
+                break
+            params["after"] = response.headers["X-Next-Cursor"]
+
+        assert template_ids == sorted(str(i) for i in range(NUMBER_OF_TEMPLATES))
+
+    def test_obtain_templates_paginated_by_tags(self, fastapi_client_local_storage: TestClient):
+        params = {"tags": ["example"], "limit": 5, "after": "3"}
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params=params)
+        assert response.status_code == status.HTTP_200_OK
+        assert [template_json["template_id"] for template_json in response.json()] == ["30", "31", "32", "33", "34"]
+        assert response.headers["X-Next-Cursor"] == "34"
+
+    def test_obtain_templates_invalid_limit(self, fastapi_client_local_storage: TestClient):
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params={"limit": 0})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_obtain_templates_projected_fields(self, fastapi_client_local_storage: TestClient):
+        params = {"fields": ["metadata", "template_schema"]}
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params=params)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) == NUMBER_OF_TEMPLATES
+        for template_json in response.json():
+            assert set(template_json.keys()) == {"metadata", "template_schema"}
+
+    def test_obtain_templates_unknown_field(self, fastapi_client_local_storage: TestClient):
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params={"fields": ["unknown"]})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_obtain_templates_summary(self, fastapi_client_local_storage: TestClient):
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params={"summary": True, "tags": ["tag7"]})
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) == 1
+        template_json = response.json()[0]
+        assert set(template_json.keys()) == {"template_id", "tags"}
+        assert template_json["template_id"] == "7"
+        assert set(template_json["tags"]) == {"tag7", "example"}
+
+    def test_obtain_template_by_any_tag(self, fastapi_client_local_storage: TestClient):
+        tags = {"tags": ["tag3", "tag4", f"tag{NUMBER_OF_TEMPLATES + 1}"], "tags_match": "any"}
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params=tags)
+        assert response.status_code == status.HTTP_200_OK
+        assert {template_json["template_id"] for template_json in response.json()} == {"3", "4"}
+
+        tags = {"tags": ["tag3", "tag4"], "tags_match": "all"}
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params=tags)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) == 0
+
+    @pytest.mark.parametrize("tags_match", list(TagsMatchEnum))
+    def test_tags_filter_uses_index(self, db: Session, tags_match: TagsMatchEnum):
+        # the seeded table is small enough for a sequential scan to be cheaper, so it's disabled to check the index
+        # can be used at all
+        db.execute(text("SET LOCAL enable_seqscan = off"))
+        try:
+            statement = db.query(Template.id).filter(tags_filter(["tag1", "example"], tags_match)).statement
+            compiled = statement.compile(dialect=db.get_bind().dialect)
+            plan = db.connection().exec_driver_sql(f"EXPLAIN {compiled}", compiled.params).scalars().all()
+        finally:
+            db.rollback()
+
+        assert any("ix_template_tags" in line for line in plan), "\n".join(plan)
+
+    def test_database_json_matches_schema_serialization(self, fastapi_client_local_storage: TestClient, db: Session):
+        # contract between the documents built by the database and TemplateDetailSchema's serialization
+        rich_template = Template(id_="rich", schema={"type": "object", "properties": {"ü": {"type": "number"}}},
+                                 type_="text/html", metadata={"qr_entries": ["a.b"], "nested": {"list": [1, 2.5, None]}},
+                                 example_composition={"ü": 1.5, "quote": "\"'<>&"}, tags=["ä", "example"])
+        db.add(rich_template)
+        db.commit()
+        try:
+            for template in db.query(Template).all():
+                expected = TemplateDetailSchema.model_validate(template).model_dump(mode="json", by_alias=True)
+
+                response = fastapi_client_local_storage.get(self.GET_TEMPLATES_BY_ID_ENDPOINT.format(template.id))
+                assert response.status_code == status.HTTP_200_OK
+                assert_same_template_json(response.json(), expected)
+
+            response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params={"tags": ["ä"]})
+            assert len(response.json()) == 1
+            assert_same_template_json(response.json()[0], TemplateDetailSchema.model_validate(rich_template)
+                                      .model_dump(mode="json", by_alias=True))
+
+            fields = ["tags", "metadata"]
+            response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params={"tags": ["ä"],
+                                                                                             "fields": fields})
+            expected = TemplatePartialSchema.model_validate({"tags": rich_template.tags,
+                                                             "metadata_": rich_template.metadata_})
+            assert_same_template_json(response.json()[0],
+                                      expected.model_dump(mode="json", by_alias=True, exclude_unset=True))
+        finally:
+            db.delete(rich_template)
+            db.commit()
+
+
+    def test_template_by_id_not_modified(self, fastapi_client_local_storage: TestClient, db: Session):
+        endpoint = self.GET_TEMPLATES_BY_ID_ENDPOINT.format(5)
+        response = fastapi_client_local_storage.get(endpoint)
+        assert response.status_code == status.HTTP_200_OK
+        etag = response.headers["ETag"]
+
+        response = fastapi_client_local_storage.get(endpoint, headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+        template = db.get(Template, "5")
+        template.metadata_ = {"updated": True}
+        db.commit()
+
+        response = fastapi_client_local_storage.get(endpoint, headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["metadata"] == {"updated": True}
+        assert response.headers["ETag"] != etag
+
+    def test_template_by_id_not_modified_not_found(self, fastapi_client_local_storage: TestClient):
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_BY_ID_ENDPOINT.format(200),
+                                                    headers={"If-None-Match": '"etag"'})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_templates_not_modified(self, fastapi_client_local_storage: TestClient, db: Session):
+        params = {"tags": ["example"]}
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params=params)
+        etag = response.headers["ETag"]
+
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params=params,
+                                                    headers={"If-None-Match": f'W/"other", {etag}'})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        # different query parameters have different representations
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params={**params, "summary": True},
+                                                    headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+
+        template = Template(id_="new", schema={}, type_="text/html", metadata={}, example_composition={},
+                            tags=["example"])
+        db.add(template)
+        db.commit()
+        try:
+            response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params=params,
+                                                        headers={"If-None-Match": etag})
+            assert response.status_code == status.HTTP_200_OK
+            assert len(response.json()) == NUMBER_OF_TEMPLATES + 1
+            new_template_etag = response.headers["ETag"]
+        finally:
+            db.delete(template)
+            db.commit()
+
+        # deleting the template changes the ETag back to the one of the unchanged catalogue
+        response = fastapi_client_local_storage.get(self.GET_TEMPLATES_ENDPOINT, params=params,
+                                                    headers={"If-None-Match": new_template_etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["ETag"] == etag
+
+
+def assert_same_template_json(actual: dict, expected: dict):
+    # tags are serialized from a set, so their order is not relevant
+    assert list(actual.keys()) == list(expected.keys())
+    assert {key: value for key, value in actual.items() if key != "tags"} == \
+           {key: value for key, value in expected.items() if key != "tags"}
+    assert sorted(actual.get("tags", [])) == sorted(expected.get("tags", []))
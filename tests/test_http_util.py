@@ -0,0 +1,34 @@
+import pytest
+
+from app.util.http_util import RangeNotSatisfiable, negotiate_encoding, parse_byte_range
+
+
+@pytest.mark.parametrize("range_header, expected_range", [
+    ("bytes=0-4", (0, 4)),
+    ("bytes=5-", (5, 9)),
+    ("bytes=-3", (7, 9)),
+    ("bytes=0-100", (0, 9)),
+    ("bytes=4-2", None),
+    ("bytes=0-1,3-4", None),
+    ("items=0-1", None),
+])
+def test_parse_byte_range(range_header: str, expected_range: tuple | None):
+    assert parse_byte_range(range_header, 10) == expected_range
+
+
+@pytest.mark.parametrize("range_header", ["bytes=10-", "bytes=-0"])
+def test_parse_unsatisfiable_byte_range(range_header: str):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_byte_range(range_header, 10)
+
+
+@pytest.mark.parametrize("accept_encoding, expected_coding", [
+    (None, None),
+    ("identity", None),
+    ("gzip, br", "br"),
+    ("gzip;q=1, br;q=0.5", "gzip"),
+    ("br;q=0, *", "gzip"),
+    ("*;q=0", None),
+])
+def test_negotiate_encoding(accept_encoding: str | None, expected_coding: str | None):
+    assert negotiate_encoding(accept_encoding, ("br", "gzip")) == expected_coding
@@ -0,0 +1,152 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from typing import Iterator
+from unittest import mock
+
+import httpx
+import pytest
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.compose.idempotency import IdempotencyKeyReused, IdempotencyStore
+from app.models.idempotency_key import IdempotencyKey
+from benchmarks.templates import CERTIFICATE
+from tests.test_preload import metric_value
+
+
+@pytest.fixture
+def store_factory(db: Session) -> Iterator:
+    def create_store(**options) -> IdempotencyStore:
+        return IdempotencyStore(sessionmaker(bind=db.get_bind()), **{
+            "window_seconds": 60, "max_bytes": 1024, "lease_seconds": 30, "poll_interval": 0.05, **options})
+
+    db.query(IdempotencyKey).delete()
+    db.commit()
+    yield create_store
+    db.query(IdempotencyKey).delete()
+    db.commit()
+
+
+def test_retry_attaches_to_running_request(store_factory):
+    store = store_factory()
+    started, release = threading.Event(), threading.Event()
+
+    def wait_for_release() -> bytes:
+        started.set()
+        release.wait()
+        return b"pdf"
+
+    render = mock.Mock(side_effect=wait_for_release)
+
+    results = []
+    original = threading.Thread(target=lambda: results.append(store.run("key", "request", render)))
+    original.start()
+    started.wait()
+    # the retry may reach another process, with a store of its own
+    retry = threading.Thread(target=lambda: results.append(store_factory().run("key", "request", render)))
+    retry.start()
+    release.set()
+    original.join()
+    retry.join()
+
+    assert sorted(results) == [(b"pdf", False), (b"pdf", True)]
+    render.assert_called_once()
+
+
+def test_key_reused_for_different_request(store_factory):
+    store = store_factory()
+    store.run("key", "request", lambda: b"pdf")
+
+    with pytest.raises(IdempotencyKeyReused):
+        store.run("key", "other request", lambda: b"other pdf")
+    assert store.run("other key", "other request", lambda: b"other pdf") == (b"other pdf", False)
+
+
+def test_failed_request_is_forgotten(store_factory):
+    store = store_factory()
+    with pytest.raises(RuntimeError):
+        store.run("key", "request", mock.Mock(side_effect=RuntimeError))
+
+    assert store.run("key", "request", lambda: b"pdf") == (b"pdf", False)
+
+
+def test_results_expire_and_are_evicted(store_factory, db: Session):
+    store = store_factory(max_bytes=4)
+    store.run("expired", "request", lambda: b"a")
+    db.execute(update(IdempotencyKey).where(IdempotencyKey.key == "expired")
+               .values(created_at=func.clock_timestamp() - timedelta(seconds=61)))
+    db.commit()
+    store.run("evicted", "request", lambda: b"bbb")
+    store.run("kept", "request", lambda: b"cc")
+
+    assert store.run("kept", "request", lambda: b"new") == (b"cc", True)
+    assert store.run("evicted", "request", lambda: b"new")[1] is False
+    assert store.run("expired", "request", lambda: b"new")[1] is False
+
+
+def test_running_request_keeps_its_lease(store_factory):
+    store = store_factory(lease_seconds=0.3)
+    started, release = threading.Event(), threading.Event()
+
+    def wait_for_release() -> bytes:
+        started.set()
+        release.wait()
+        return b"pdf"
+
+    results = []
+    original = threading.Thread(target=lambda: results.append(store.run("key", "request", wait_for_release)))
+    original.start()
+    started.wait()
+    # the retry comes after the first lease would have expired
+    time.sleep(0.6)
+    retry = threading.Thread(target=lambda: results.append(store_factory().run("key", "request", lambda: b"retried")))
+    retry.start()
+    time.sleep(0.3)
+    release.set()
+    original.join()
+    retry.join()
+
+    assert sorted(results) == [(b"pdf", False), (b"pdf", True)]
+
+
+def test_abandoned_request_is_taken_over(store_factory, db: Session):
+    # left by a process which died while running the request
+    db.add(IdempotencyKey(key="key", fingerprint="request",
+                          locked_until=func.clock_timestamp() - timedelta(seconds=1)))
+    db.commit()
+
+    assert store_factory().run("key", "request", lambda: b"pdf") == (b"pdf", False)
+
+
+def test_retries_across_worker_processes(gunicorn_server, db: Session, tmp_path: Path):
+    CERTIFICATE.install(tmp_path / "templates")
+    db.merge(CERTIFICATE.model())
+    db.query(IdempotencyKey).delete()
+    db.commit()
+
+    def compose(_) -> httpx.Response:
+        # requests on new connections are spread across the workers
+        return httpx.post(f"{base_url}/template/{CERTIFICATE.template_id}/compose",
+                          json=CERTIFICATE.example_composition,
+                          headers={"custom-accept": "text/html", "Idempotency-Key": "retried-certificate"})
+
+    try:
+        with gunicorn_server(2) as (_, base_url):
+            with ThreadPoolExecutor(4) as executor:
+                responses = list(executor.map(compose, range(8)))
+
+            assert [response.status_code for response in responses] == [200] * 8
+            assert len({response.content for response in responses}) == 1
+            assert [response.headers.get("Idempotent-Replayed") for response in responses].count(None) == 1
+            # the workers share their metrics periodically
+            deadline = time.monotonic() + 10
+            while metric_value(metrics := httpx.get(f"{base_url}/metrics").text, "plato_renders_total") != 1:
+                assert time.monotonic() < deadline, metrics
+                time.sleep(0.2)
+    finally:
+        db.delete(db.merge(CERTIFICATE.model()))
+        db.query(IdempotencyKey).delete()
+        db.commit()
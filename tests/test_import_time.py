@@ -0,0 +1,45 @@
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+IMPORT_TIME_BUDGET_SECONDS = 3
+"""
+Generous budget for the cumulative import time of the entry points, as measured by `python -X importtime`, so only
+a heavy new eager import fails the test on slower machines
+"""
+
+LAZY_MODULES = ("weasyprint", "qrcode", "PIL", "smart_open", "boto3", "botocore", "google.cloud.storage")
+"""
+Renderer and storage backend dependencies, which must only be imported on first use
+"""
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """
+    Imports the module in a new interpreter.
+
+    Returns:
+        Dict[str, int]: The cumulative import time of every imported module, in microseconds
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", ["app.main", "app.cli"])
+def test_import_time_budget(module: str):
+    times = import_times(module)
+
+    eager_modules = [name for name in times
+                     if any(name == lazy_module or name.startswith(f"{lazy_module}.") for lazy_module in LAZY_MODULES)]
+    assert eager_modules == []
+    assert times[module] / 1_000_000 < IMPORT_TIME_BUDGET_SECONDS
+
@@ -0,0 +1,109 @@
+import threading
+
+from app.compose.layout_cache import LayoutCache, layout_key
+from app.models.template import Template
+from app.schemas.template_detail import MIMETypeEnum
+
+
+def template(template_id: str, version: int = 1) -> Template:
+    template = Template(id_=template_id, schema={}, type_=MIMETypeEnum.HTML_MIME.value, metadata={},
+                        example_composition={}, tags=[])
+    template.version = version
+    return template
+
+
+class Layout:
+    """
+    Stands for a laid out document
+    """
+    def __init__(self, name: str, pages: int = 1):
+        self.name = name
+        self.pages = [name] * pages
+
+
+def test_layout_key():
+    key = layout_key(template("a"), {"b": 1, "a": [1, 2]}, {"dpi": 96, "optimize_images": True})
+    assert key == layout_key(template("a"), {"a": [1, 2], "b": 1}, {"optimize_images": True, "dpi": 96})
+    assert key != layout_key(template("a", version=2), {"b": 1, "a": [1, 2]}, {"dpi": 96, "optimize_images": True})
+    assert key != layout_key(template("a"), {"b": 2, "a": [1, 2]}, {"dpi": 96, "optimize_images": True})
+    assert key != layout_key(template("a"), {"b": 1, "a": [1, 2]}, {"dpi": 150, "optimize_images": True})
+
+
+def test_layout_cache_evicts_least_recently_used():
+    cache = LayoutCache(max_pages=4, max_document_pages=4)
+    layouts = {name: Layout(name, pages=2) for name in "abc"}
+    cache.put(("a", 1), layouts["a"])
+    cache.put(("b", 1), layouts["b"])
+    assert cache.get(("a", 1)) is layouts["a"]
+
+    cache.put(("c", 1), layouts["c"])
+    assert cache.get(("b", 1)) is None
+    assert cache.get(("a", 1)) is layouts["a"]
+    assert cache.get(("c", 1)) is layouts["c"]
+    assert len(cache) == 2
+    assert cache.pages == 4
+
+
+def test_layout_cache_is_bounded_by_pages():
+    cache = LayoutCache(max_pages=10, max_document_pages=5)
+    for name in "abcd":
+        cache.put((name, 1), Layout(name, pages=1))
+    cache.put(("large", 1), Layout("large", pages=5))
+    assert all(cache.get((name, 1)) is not None for name in ("a", "b", "c", "d", "large"))
+    assert cache.pages == 9
+
+    cache.put(("larger", 1), Layout("larger", pages=3))
+    assert cache.get(("a", 1)) is None and cache.get(("b", 1)) is None
+    assert cache.pages == 10
+
+    cache.put(("too large", 1), Layout("too large", pages=6))
+    assert cache.get(("too large", 1)) is None
+    assert cache.pages == 10
+
+    cache.put(("larger", 1), Layout("larger", pages=1))
+    assert cache.pages == 8
+
+
+def test_layout_cache_discard():
+    cache = LayoutCache(max_pages=10, max_document_pages=10)
+    layout_b = Layout("layout b")
+    cache.put(("a", 1, "data"), Layout("layout a"))
+    cache.put(("a", 2, "data"), Layout("layout a2"))
+    cache.put(("b", 1, "data"), layout_b)
+
+    cache.discard("a")
+    assert len(cache) == 1
+    assert cache.get(("b", 1, "data")) is layout_b
+
+    cache.discard()
+    assert len(cache) == 0
+    assert cache.pages == 0
+
+
+def test_disabled_layout_cache():
+    cache = LayoutCache(max_pages=0, max_document_pages=32)
+    cache.put(("a", 1), Layout("layout a"))
+    assert cache.get(("a", 1)) is None
+
+
+def test_cached_layouts_are_written_one_at_a_time():
+    cache = LayoutCache(max_pages=10, max_document_pages=10)
+    cached, uncached = Layout("cached"), Layout("uncached")
+    cache.put(("a", 1), cached)
+    # evicted documents stay locked while they're being written
+    cache.discard()
+    writes = []
+
+    def write(document: Layout) -> None:
+        with cache.writing(document):
+            writes.append(document.name)
+
+    with cache.writing(cached):
+        threads = [threading.Thread(target=write, args=(document,)) for document in (cached, uncached)]
+        for thread in threads:
+            thread.start()
+        threads[1].join(5)
+        threads[0].join(0.2)
+        assert writes == ["uncached"]
+    threads[0].join(5)
+    assert writes == ["uncached", "cached"]
@@ -0,0 +1,86 @@
+import logging
+import subprocess
+import sys
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import pytest
+
+from app.compose.limits import PageLimitExceeded, PayloadTooDeep, check_depth, page_limit, parse_payload
+
+
+def test_check_depth():
+    check_depth({"rows": [{"cells": [1, 2]}]}, max_depth=4)
+    check_depth("scalar", max_depth=0)
+    with pytest.raises(PayloadTooDeep):
+        check_depth({"rows": [{"cells": [1, 2]}]}, max_depth=3)
+
+
+def test_parse_payload_deeper_than_parser():
+    with pytest.raises(PayloadTooDeep):
+        parse_payload(b"[" * 100_000 + b"]" * 100_000, max_depth=64)
+
+
+def lay_out(pages: int) -> None:
+    progress_logger = logging.getLogger("weasyprint.progress")
+    for page in range(1, pages + 1):
+        progress_logger.info("Step 5 - Creating layout - Page %d", page)
+
+
+def test_page_limit():
+    lay_out(5)
+    with page_limit(3):
+        lay_out(3)
+        with pytest.raises(PageLimitExceeded):
+            lay_out(4)
+    lay_out(5)
+
+
+@contextmanager
+def logging_levels(levels: Dict[str, int]) -> Iterator[None]:
+    """
+    Sets the level of loggers (by name, "" for the root logger) until the context exits.
+    """
+    loggers = {name: logging.getLogger(name) for name in levels}
+    previous_levels = {name: logger.level for name, logger in loggers.items()}
+    for name, logger in loggers.items():
+        logger.setLevel(levels[name])
+    try:
+        yield
+    finally:
+        for name, logger in loggers.items():
+            logger.setLevel(previous_levels[name])
+
+
+@pytest.mark.parametrize("progress_level", [logging.NOTSET, logging.WARNING])
+def test_page_limit_with_quiet_logging(caplog, progress_level: int):
+    with logging_levels({"": logging.WARNING, "weasyprint.progress": progress_level}), page_limit(3):
+        with pytest.raises(PageLimitExceeded):
+            lay_out(4)
+        logging.getLogger("weasyprint.progress").warning("Other progress")
+
+    # page records are only handled for the limit, other records are still emitted
+    assert [record.getMessage() for record in caplog.records] == ["Other progress"]
+
+
+def test_page_limit_keeps_verbose_logging(caplog):
+    with logging_levels({"": logging.WARNING, "weasyprint.progress": logging.DEBUG}), page_limit(3):
+        lay_out(2)
+        assert logging.getLogger("weasyprint.progress").level == logging.DEBUG
+
+    assert [record.getMessage() for record in caplog.records] == [f"Step 5 - Creating layout - Page {page}"
+                                                                   for page in (1, 2)]
+
+
+def test_limit_process_memory():
+    # run in another process, as the limit can't be raised again
+    script = """
+from app.compose.limits import limit_process_memory, process_data_bytes
+limit_process_memory(process_data_bytes() + 64 * 1024 * 1024)
+try:
+    bytearray(256 * 1024 * 1024)
+except MemoryError:
+    print("MemoryError")
+"""
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "MemoryError"
@@ -0,0 +1,45 @@
+import asyncio
+import random
+
+import httpx
+
+from loadtest.driver import run_phase
+from loadtest.scenario import Phase, Scenario
+
+SCENARIO = Scenario("test", requests=[{"template": "benchmark_certificate", "mime_type": "text/html"}],
+                    phases=[], templates=3, max_in_flight=5, p99_seconds=0.5)
+
+
+def run(handler, phase: Phase):
+    async def run_with_client():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://plato") as client:
+            return await run_phase(client, SCENARIO, phase, random.Random(0))
+    return asyncio.run(run_with_client())
+
+
+def test_healthy_phase():
+    requested_paths = set()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested_paths.add(request.url.path)
+        return httpx.Response(200, text="<html></html>")
+
+    result = run(handler, Phase(rate=100, duration=0.5))
+
+    assert result.dropped == 0
+    assert result.error_rate == 0
+    assert requested_paths <= {f"/template/benchmark_certificate_{index}/compose" for index in range(3)}
+    assert not result.saturated(SCENARIO)
+
+
+def test_saturated_phase():
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.2)
+        return httpx.Response(500)
+
+    result = run(handler, Phase(rate=100, duration=0.5))
+
+    assert result.dropped > 0
+    assert result.error_rate == 1
+    assert result.summary(SCENARIO)["errors"].keys() == {"500"}
+    assert result.saturated(SCENARIO)
@@ -0,0 +1,111 @@
+import os
+import time
+from pathlib import Path
+
+import httpx
+from fastapi.testclient import TestClient
+from starlette import status
+
+from app.metrics import Counter, Gauge, Histogram, Metric, MetricsDirectory, PROMETHEUS_CONTENT_TYPE, render_metrics
+from tests.test_preload import metric_value
+from tests.test_render_pool import worker_pids
+
+
+def test_histogram_observe():
+    histogram = Histogram("test_seconds", "Test histogram", ["template_id"], buckets=[0.1, 1])
+    Metric.registry.remove(histogram)
+    histogram.observe(0.05, template_id="a")
+    histogram.observe(0.5, template_id="a")
+    histogram.observe(5, template_id="a")
+    histogram.observe(0.5, template_id="b")
+
+    assert histogram.count(template_id="a") == 3
+    assert histogram.sum(template_id="a") == 5.55
+    assert histogram.count(template_id="b") == 1
+    assert histogram.count(template_id="c") == 0
+
+
+def test_render_metrics():
+    counter = Counter("test_requests_total", "Test counter", ["route"])
+    counter.inc(route='/templates/{template_id}')
+    counter.inc(2, route='/templates/{template_id}')
+    histogram = Histogram("test_duration_seconds", "Test histogram", buckets=[0.1, 1])
+    histogram.observe(0.5)
+    gauge = Gauge("test_queue_depth", "Test gauge", lambda: 3)
+
+    lines = render_metrics().splitlines()
+    assert lines[lines.index("# TYPE test_requests_total counter") + 1] == \
+        'test_requests_total{route="/templates/{template_id}"} 3'
+    histogram_start = lines.index("# TYPE test_duration_seconds histogram") + 1
+    assert lines[histogram_start:histogram_start + 5] == ['test_duration_seconds_bucket{le="0.1"} 0',
+                                                          'test_duration_seconds_bucket{le="1"} 1',
+                                                          'test_duration_seconds_bucket{le="+Inf"} 1',
+                                                          'test_duration_seconds_sum 0.5',
+                                                          'test_duration_seconds_count 1']
+    assert lines[lines.index("# TYPE test_queue_depth gauge") + 1] == "test_queue_depth 3"
+
+    for metric in (counter, histogram, gauge):
+        Metric.registry.remove(metric)
+
+
+def test_metrics_endpoint(fastapi_client_local_storage: TestClient):
+    fastapi_client_local_storage.get("/templates/unknown")
+
+    response = fastapi_client_local_storage.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == PROMETHEUS_CONTENT_TYPE
+    assert 'plato_http_requests_total{method="GET",route="/templates/{template_id}",status="404"}' in response.text
+    assert "plato_render_queue_depth 0" in response.text
+    assert "plato_process_resident_memory_bytes " in response.text
+
+
+def test_metrics_directory_merges_processes(tmp_path: Path):
+    counter = Counter("test_renders_total", "Test counter")
+    histogram = Histogram("test_render_seconds", "Test histogram", buckets=[1])
+    gauge = Gauge("test_pid", "Test gauge", os.getpid)
+    metrics_directory = MetricsDirectory(str(tmp_path))
+    counter.inc()
+    histogram.observe(0.5)
+    try:
+        child_pid = os.fork()
+        if child_pid == 0:
+            # the child counts from zero, rather than from the values of its parent
+            counter.inc(2)
+            histogram.observe(2)
+            metrics_directory.write()
+            os._exit(0)
+        os.waitpid(child_pid, 0)
+
+        lines = metrics_directory.render().splitlines()
+        assert "test_renders_total 3" in lines
+        assert 'test_render_seconds_bucket{le="1"} 1' in lines and "test_render_seconds_count 2" in lines
+        assert f'test_pid{{pid="{child_pid}"}} {child_pid}' in lines
+        assert f'test_pid{{pid="{os.getpid()}"}} {os.getpid()}' in lines
+
+        # once the child exited, its counts are kept while its gauges are dropped
+        metrics_directory.archive(child_pid)
+        lines = metrics_directory.render().splitlines()
+        assert "test_renders_total 3" in lines and "test_render_seconds_count 2" in lines
+        assert f'test_pid{{pid="{child_pid}"}} {child_pid}' not in lines
+        assert f'test_pid{{pid="{os.getpid()}"}} {os.getpid()}' in lines
+    finally:
+        for metric in (counter, histogram, gauge):
+            Metric.registry.remove(metric)
+
+
+def test_metrics_of_every_worker_process(gunicorn_server):
+    requests = 8
+    sample = 'plato_http_requests_total{method="GET",route="/templates/{template_id}",status="404"}'
+    with gunicorn_server(2) as (server, base_url):
+        # requests on new connections are spread across the workers
+        for _ in range(requests):
+            assert httpx.get(f"{base_url}/templates/unknown").status_code == status.HTTP_404_NOT_FOUND
+
+        # the other worker writes its metrics periodically
+        deadline = time.monotonic() + 10
+        while metric_value(metrics := httpx.get(f"{base_url}/metrics").text, sample) != requests:
+            assert time.monotonic() < deadline, metrics
+            time.sleep(0.2)
+        memory_samples = [line for line in metrics.splitlines()
+                          if line.startswith("plato_process_resident_memory_bytes{")]
+        assert sorted(line.split('"')[1] for line in memory_samples) == sorted(worker_pids(server))
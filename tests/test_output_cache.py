@@ -0,0 +1,38 @@
+from app.compose.output_cache import OutputCache
+
+
+def test_output_cache_evicts_least_recently_used():
+    cache = OutputCache(max_bytes=10)
+    cache.put(("example", "a"), b"1234")
+    cache.put(("example", "b"), b"1234")
+    assert cache.get(("example", "a")) == b"1234"
+
+    cache.put(("example", "c"), b"1234")
+    assert cache.get(("example", "b")) is None
+    assert cache.get(("example", "a")) == b"1234"
+    assert cache.get(("example", "c")) == b"1234"
+    assert cache.size == 8
+
+
+def test_output_cache_replace_and_oversized():
+    cache = OutputCache(max_bytes=10)
+    cache.put(("example", "a"), b"1234")
+    cache.put(("example", "a"), b"12")
+    assert cache.size == 2
+
+    cache.put(("example", "b"), b"12345678901")
+    assert cache.get(("example", "b")) is None
+    assert cache.size == 2
+
+
+def test_output_cache_discard():
+    cache = OutputCache(max_bytes=100)
+    cache.put(("example", "a", "application/pdf"), b"pdf")
+    cache.put(("example", "a", "text/html"), b"html")
+    cache.put(("example", "b", "text/html"), b"html")
+
+    cache.discard(lambda key: key[1] == "a")
+    assert cache.get(("example", "a", "application/pdf")) is None
+    assert cache.get(("example", "a", "text/html")) is None
+    assert cache.get(("example", "b", "text/html")) == b"html"
+    assert cache.size == 4
@@ -0,0 +1,109 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+import httpx
+import pytest
+from sqlalchemy.orm import Session
+
+from app.models.template import Template
+from app.schemas.template_detail import MIMETypeEnum
+from benchmarks.templates import CERTIFICATE
+from tests.test_publish import create_bundle, valid_bundle_files
+
+WORKERS = 2
+ASSET_BYTES = 48 * 1024 * 1024
+
+
+def unique_memory(pid: int) -> int:
+    """
+    Memory only mapped by the given process (its USS), in bytes
+    """
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        fields = dict(line.split(":", 1) for line in smaps if ":" in line)
+    return sum(int(fields[field].split()[0]) * 1024 for field in ("Private_Clean", "Private_Dirty"))
+
+
+def metric_value(metrics: str, sample: str) -> float:
+    """
+    Value of a sample in metrics rendered in the Prometheus text format, or 0 if it wasn't recorded
+    """
+    values = [line.rsplit(" ", 1)[1] for line in metrics.splitlines() if line.rsplit(" ", 1)[0] == sample]
+    return float(values[0]) if values else 0
+
+
+def worker_unique_memory(gunicorn_server, preload: bool) -> List[int]:
+    """
+    Starts gunicorn with the given preload mode and measures the unique memory of each worker, once they're ready.
+    """
+    with gunicorn_server(WORKERS, PRELOAD_APP=str(preload).lower()) as (server, base_url):
+        assert httpx.get(f"{base_url}/metrics").status_code == 200
+        worker_pids = Path(f"/proc/{server.pid}/task/{server.pid}/children").read_text().split()
+        return [unique_memory(int(pid)) for pid in worker_pids]
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="Memory is measured through /proc")
+def test_preloaded_workers_share_memory(gunicorn_server, tmp_path: Path):
+    asset = tmp_path / "templates" / "static" / "preload_test" / "font.bin"
+    asset.parent.mkdir(parents=True)
+    asset.write_bytes(os.urandom(ASSET_BYTES))
+
+    preloaded = worker_unique_memory(gunicorn_server, preload=True)
+    not_preloaded = worker_unique_memory(gunicorn_server, preload=False)
+
+    assert len(preloaded) == len(not_preloaded) == WORKERS
+    # without preloading, every worker holds its own copy of the static assets
+    assert min(not_preloaded) > ASSET_BYTES
+    assert max(preloaded) < min(not_preloaded) - ASSET_BYTES * 3 / 4
+
+
+@pytest.mark.parametrize("preload", [True, False])
+def test_examples_are_prerendered_before_fork(gunicorn_server, db: Session, tmp_path: Path, preload: bool):
+    CERTIFICATE.install(tmp_path / "templates")
+    db.merge(CERTIFICATE.model())
+    db.commit()
+    try:
+        with gunicorn_server(1, PRELOAD_APP=str(preload).lower(), PRERENDER_EXAMPLES="true") as (_, base_url), \
+                httpx.Client(base_url=base_url) as client:
+            renders = metric_value(client.get("/metrics").text, "plato_renders_total")
+            response = client.get(f"/template/{CERTIFICATE.template_id}/example",
+                                  headers={"custom-accept": MIMETypeEnum.HTML_MIME.value})
+            assert response.status_code == 200
+            renders = metric_value(client.get("/metrics").text, "plato_renders_total") - renders
+    finally:
+        db.delete(db.merge(CERTIFICATE.model()))
+        db.commit()
+
+    # workers forked from a preloaded master serve the examples it rendered, others render them on first use
+    assert renders == (0 if preload else 1)
+
+
+def test_preloaded_workers_refresh_templates_published_by_each_other(gunicorn_server, db: Session):
+    admin_key = "preload_admin_key"
+    # the bundle includes one of its partials by the template id it's published with
+    template_id = "published"
+    try:
+        with gunicorn_server(WORKERS, PRELOAD_APP="true", ADMIN_API_KEY=admin_key) as (_, base_url):
+            response = httpx.put(f"{base_url}/templates/{template_id}", headers={"X-Admin-Key": admin_key},
+                                 files={"bundle": ("bundle.tar.gz", create_bundle(valid_bundle_files()))})
+            assert response.status_code == 200
+
+            # the worker which published the template ignores its own notification, every other worker refreshes it;
+            # requests on new connections are spread across the workers, until one of the others answers
+            def refreshed_templates(_) -> float:
+                metrics = httpx.get(f"{base_url}/metrics").text
+                return metric_value(metrics, 'plato_template_sync_seconds_count{operation="refresh"}')
+
+            deadline = time.monotonic() + 30
+            with ThreadPoolExecutor(8) as executor:
+                while not any(executor.map(refreshed_templates, range(8))):
+                    assert time.monotonic() < deadline, "no worker refreshed the published template"
+
+                examples = list(executor.map(lambda _: httpx.get(f"{base_url}/template/{template_id}/example", headers={
+                    "custom-accept": MIMETypeEnum.HTML_MIME.value}).text, range(8)))
+            assert examples == ["<p>Hello example</p><footer>footer</footer>"] * 8
+    finally:
+        db.query(Template).filter_by(id=template_id).delete()
+        db.commit()
@@ -0,0 +1,159 @@
+import pstats
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette import status
+
+from app.compose.render_pool import RenderPool
+from app.models.template import Template
+from app.profiling import ProfileRequest, StackSampler, profiled
+from app.settings import get_settings
+
+ADMIN_API_KEY = "profiling_admin_key"
+TEMPLATE_ID = "profiled"
+COMPOSE_ENDPOINT = f"/template/{TEMPLATE_ID}/compose"
+
+
+@pytest.fixture(scope="class")
+def profiling_client(fastapi_client_local_storage: TestClient, db, tmp_path_factory):
+    settings = get_settings()
+    previous_profile_directory = settings.PROFILE_DIRECTORY
+    settings.ADMIN_API_KEY = ADMIN_API_KEY
+    settings.PROFILE_DIRECTORY = str(tmp_path_factory.mktemp("profiles"))
+    fastapi_client_local_storage.app.state.jinja_env.loader.mapping[f"{TEMPLATE_ID}/{TEMPLATE_ID}"] = "{{ p.name }}"
+    db.add(Template(id_=TEMPLATE_ID, schema={"type": "object"}, type_="text/html", metadata={},
+                    example_composition={"name": "example"}, tags=[]))
+    db.commit()
+
+    yield fastapi_client_local_storage
+
+    settings.ADMIN_API_KEY = None
+    settings.PROFILE_DIRECTORY = previous_profile_directory
+    db.query(Template).filter_by(id=TEMPLATE_ID).delete()
+    db.commit()
+
+
+class TestProfiling:
+    HEADERS = {"custom-accept": "text/html", "X-Admin-Key": ADMIN_API_KEY}
+
+    def test_profile_compose(self, profiling_client: TestClient):
+        response = profiling_client.post(COMPOSE_ENDPOINT, json={"name": "profiled"},
+                                         headers={**self.HEADERS, "X-Plato-Profile": "cpu,memory",
+                                                  "X-Request-ID": "request-1"})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.text == "profiled"
+        assert response.headers["X-Profile-Id"] == "request-1"
+
+        response = profiling_client.get("/profiles/request-1", headers=self.HEADERS)
+        assert response.status_code == status.HTTP_200_OK
+        profile_path = get_settings().PROFILE_DIRECTORY + "/request-1.prof"
+        assert any(function_name == "compose_html" for _, _, function_name in pstats.Stats(profile_path).stats)
+
+        response = profiling_client.get("/profiles/request-1", params={"kind": "memory"}, headers=self.HEADERS)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.text.startswith("Peak traced memory: ")
+
+    def test_profile_requires_admin_key(self, profiling_client: TestClient):
+        response = profiling_client.post(COMPOSE_ENDPOINT, json={"name": "profiled"},
+                                         headers={"custom-accept": "text/html", "X-Plato-Profile": "cpu"})
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+        response = profiling_client.get("/profiles/request-1")
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    @pytest.mark.parametrize("headers", [{"X-Plato-Profile": "memory"}, {"X-Plato-Profile": "cpu,disk"},
+                                         {"X-Plato-Profile": "cpu", "X-Request-ID": "../request"}])
+    def test_profile_invalid_request(self, profiling_client: TestClient, headers: dict):
+        response = profiling_client.post(COMPOSE_ENDPOINT, json={"name": "profiled"},
+                                         headers={**self.HEADERS, **headers})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_concurrent_profiles_are_rejected(self, profiling_client: TestClient, tmp_path):
+        started, finish = threading.Event(), threading.Event()
+
+        def profiled_render():
+            started.set()
+            finish.wait(5)
+
+        # another composition being profiled by this worker
+        render = profiled(profiled_render, ProfileRequest("other", memory=True), str(tmp_path), RenderPool(1))
+        other_profile = threading.Thread(target=render)
+        other_profile.start()
+        try:
+            assert started.wait(5)
+            response = profiling_client.post(COMPOSE_ENDPOINT, json={"name": "profiled"},
+                                             headers={**self.HEADERS, "X-Plato-Profile": "cpu"})
+            assert response.status_code == status.HTTP_409_CONFLICT
+        finally:
+            finish.set()
+            other_profile.join()
+
+        assert (tmp_path / "other.memory.txt").is_file()
+        response = profiling_client.post(COMPOSE_ENDPOINT, json={"name": "profiled"},
+                                         headers={**self.HEADERS, "X-Plato-Profile": "cpu"})
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_profile_not_found(self, profiling_client: TestClient):
+        response = profiling_client.get("/profiles/unknown", headers=self.HEADERS)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+        response = profiling_client.get("/profiles/continuous", headers=self.HEADERS)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def concurrent_step() -> None:
+    time.sleep(0.001)
+
+
+def test_profiled_renders_run_alone(tmp_path):
+    pool = RenderPool(2)
+    started, release = threading.Event(), threading.Event()
+    events = []
+
+    def concurrent_render():
+        started.set()
+        while not release.is_set():
+            concurrent_step()
+        events.append("concurrent render done")
+
+    def profiled_render():
+        events.append("profiled render")
+        # overlaps with the concurrent render, unless it waited for it
+        release.wait(5)
+
+    concurrent = pool.submit(concurrent_render)
+    assert started.wait(5)
+    profiled_future = pool.submit(profiled(profiled_render, ProfileRequest("alone"), str(tmp_path), pool))
+    threading.Timer(0.2, release.set).start()
+    concurrent.result(5)
+    profiled_future.result(5)
+    # no other render starts while the profiled one runs
+    assert pool.run(events.append, "later render") is None
+    pool.shutdown()
+
+    assert events == ["concurrent render done", "profiled render", "later render"]
+    stats = pstats.Stats(str(tmp_path / "alone.prof")).stats
+    assert not any(function_name == "concurrent_step" for _, _, function_name in stats)
+
+
+def test_stack_sampler():
+    def busy_render(stop_event: threading.Event):
+        while not stop_event.is_set():
+            time.sleep(0.001)
+
+    stop_event = threading.Event()
+    thread = threading.Thread(target=busy_render, args=(stop_event,), name="plato-sampled-test")
+    thread.start()
+    sampler = StackSampler(interval=60, thread_name_prefix="plato-sampled")
+    try:
+        sampler.sample()
+        sampler.sample()
+    finally:
+        stop_event.set()
+        thread.join()
+
+    (stack, count), = [line.rsplit(" ", 1) for line in sampler.folded().splitlines()]
+    assert "busy_render" in stack.split(";")[-1]
+    assert count == "2"
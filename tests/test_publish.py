@@ -0,0 +1,220 @@
+import io
+import json
+import pathlib
+import tarfile
+import tempfile
+import threading
+import zipfile
+from contextlib import asynccontextmanager
+from unittest import mock
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from starlette import status
+
+from app.db.notifications import NODE_ID, TEMPLATE_CHANGED_CHANNEL, TemplateChangeListener, notify_template_changed
+from app.deps import get_db
+from app.file_storage import DiskFileStorage, template_loaded_at
+from app.main import app
+from app.models.template import Template
+from app.schemas.template_detail import MIMETypeEnum
+from app.settings import get_settings
+from app.util.setup_util import create_template_environment
+
+TEMPLATE_ID = "published"
+ADMIN_API_KEY = "test_admin_key"
+SCHEMA = {"type": "object", "properties": {"name": {"type": "string"}}, "required": ["name"]}
+
+
+def create_bundle(files: dict, archive_format: str = "tar") -> io.BytesIO:
+    bundle = io.BytesIO()
+    if archive_format == "zip":
+        with zipfile.ZipFile(bundle, mode="w") as zip_file:
+            for name, content in files.items():
+                zip_file.writestr(name, content)
+    else:
+        with tarfile.open(fileobj=bundle, mode="w:gz") as tar_file:
+            for name, content in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar_file.addfile(info, io.BytesIO(content))
+    bundle.seek(0)
+    return bundle
+
+
+def valid_bundle_files() -> dict:
+    return {
+        "template/index.html": b"<p>Hello {{ p.name }}</p>{% include 'published/footer.html' %}",
+        "template/footer.html": b"<footer>footer</footer>",
+        "static/logo.png": b"logo",
+        "schema.json": json.dumps(SCHEMA).encode(),
+        "example.json": json.dumps({"name": "example"}).encode(),
+        "tags.json": json.dumps(["published"]).encode(),
+    }
+
+
+@pytest.fixture(scope="class")
+def publish_client(db: Session):
+    settings = get_settings()
+
+    @asynccontextmanager
+    async def mock_lifespan(app: FastAPI):
+        with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as template_dir:
+            app.state.file_storage = DiskFileStorage(data_dir)
+            app.state.jinja_env = create_template_environment(template_dir)
+            app.state.template_directory = template_dir
+            app.state.template_static_directory = f"{template_dir}/static"
+            yield
+
+    app.dependency_overrides[get_db] = lambda: db
+    app.router.lifespan_context = mock_lifespan
+    settings.ADMIN_API_KEY = ADMIN_API_KEY
+
+    with TestClient(app) as client:
+        yield client
+
+    settings.ADMIN_API_KEY = None
+    db.query(Template).delete()
+    db.commit()
+
+
+class TestPublish:
+    PUBLISH_ENDPOINT = f"/templates/{TEMPLATE_ID}"
+
+    def publish(self, client: TestClient, bundle: io.BytesIO, admin_key: str | None = ADMIN_API_KEY):
+        headers = {"X-Admin-Key": admin_key} if admin_key else {}
+        return client.put(self.PUBLISH_ENDPOINT, files={"bundle": ("bundle.tar.gz", bundle)}, headers=headers)
+
+    @pytest.mark.parametrize("archive_format", ["tar", "zip"])
+    def test_publish_ok(self, publish_client: TestClient, db: Session, archive_format: str):
+        response = self.publish(publish_client, create_bundle(valid_bundle_files(), archive_format))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["template_id"] == TEMPLATE_ID
+        assert response.json()["tags"] == ["published"]
+
+        template = db.get(Template, TEMPLATE_ID)
+        db.refresh(template)
+        assert template.schema == SCHEMA
+        assert template.example_composition == {"name": "example"}
+
+        template_dir = publish_client.app.state.template_directory
+        assert pathlib.Path(template_dir, "templates", TEMPLATE_ID, TEMPLATE_ID).is_file()
+        assert pathlib.Path(template_dir, "static", TEMPLATE_ID, "logo.png").read_bytes() == b"logo"
+
+        response = publish_client.get(f"/template/{TEMPLATE_ID}/example",
+                                      headers={"custom-accept": MIMETypeEnum.HTML_MIME.value})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.text == "<p>Hello example</p><footer>footer</footer>"
+
+    def test_publish_replaces_previous_version(self, publish_client: TestClient, db: Session):
+        files = valid_bundle_files()
+        assert self.publish(publish_client, create_bundle(files)).status_code == status.HTTP_200_OK
+
+        files["template/index.html"] = b"<p>Goodbye {{ p.name }}</p>"
+        del files["static/logo.png"]
+        assert self.publish(publish_client, create_bundle(files)).status_code == status.HTTP_200_OK
+
+        template_dir = publish_client.app.state.template_directory
+        assert not pathlib.Path(template_dir, "static", TEMPLATE_ID, "logo.png").exists()
+        # other processes sharing the template directory don't download the published template again
+        assert template_loaded_at(template_dir, TEMPLATE_ID) == float(
+            db.scalar(select(func.extract("epoch", Template.updated_at)).where(Template.id == TEMPLATE_ID)))
+        response = publish_client.get(f"/template/{TEMPLATE_ID}/example",
+                                      headers={"custom-accept": MIMETypeEnum.HTML_MIME.value})
+        assert response.text == "<p>Goodbye example</p>"
+
+    def test_change_notification_tells_when_template_was_updated(self, publish_client: TestClient, db: Session):
+        assert self.publish(publish_client, create_bundle(valid_bundle_files())).status_code == status.HTTP_200_OK
+        connection = db.connection().connection.dbapi_connection
+        db.execute(text(f"LISTEN {TEMPLATE_CHANGED_CHANNEL}"))
+        db.commit()
+
+        notify_template_changed(db, TEMPLATE_ID)
+        db.commit()
+        connection.poll()
+        notification = json.loads(connection.notifies.pop().payload)
+
+        # nodes find the template published on their host is already up to date
+        template_dir = publish_client.app.state.template_directory
+        assert notification["updated_at"] == template_loaded_at(template_dir, TEMPLATE_ID)
+
+    def test_publish_failed_commit_keeps_previous_version(self, publish_client: TestClient, db: Session):
+        files = valid_bundle_files()
+        assert self.publish(publish_client, create_bundle(files)).status_code == status.HTTP_200_OK
+
+        files["template/index.html"] = b"<p>Goodbye {{ p.name }}</p>"
+        with mock.patch.object(db, "commit", side_effect=OperationalError("COMMIT", {}, Exception("connection lost"))):
+            with pytest.raises(OperationalError):
+                self.publish(publish_client, create_bundle(files))
+        db.rollback()
+
+        template_dir = publish_client.app.state.template_directory
+        assert pathlib.Path(template_dir, "static", TEMPLATE_ID, "logo.png").read_bytes() == b"logo"
+        assert [path.name for path in pathlib.Path(template_dir).iterdir() if path.name.startswith(".publish-")] == []
+        response = publish_client.get(f"/template/{TEMPLATE_ID}/example",
+                                      headers={"custom-accept": MIMETypeEnum.HTML_MIME.value})
+        assert response.text == "<p>Hello example</p><footer>footer</footer>"
+
+    @pytest.mark.parametrize("admin_key", [None, "wrong_key"])
+    def test_publish_requires_admin_key(self, publish_client: TestClient, admin_key: str | None):
+        response = self.publish(publish_client, create_bundle(valid_bundle_files()), admin_key)
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    @pytest.mark.parametrize("files, expected_detail", [
+        ({"schema.json": b"{}"}, "Missing files in bundle: template/index.html, example.json"),
+        ({**valid_bundle_files(), "example.json": b'{"name": 1}'},
+         "The example composition does not match the schema: 1 is not of type 'string'"),
+        ({**valid_bundle_files(), "template/index.html": b"{% if %}"}, "Invalid template: "),
+        ({**valid_bundle_files(), "../escape.html": b""}, "Invalid path in bundle: '../escape.html'"),
+        ({**valid_bundle_files(), "readme.md": b""}, "Unexpected file in bundle: 'readme.md'"),
+        ({**valid_bundle_files(), "metadata.json": b'{"pdf_options": {"jpeg_quality": 100}}'},
+         "Invalid PDF options in 'metadata.json': "),
+    ])
+    def test_publish_invalid_bundle(self, publish_client: TestClient, files: dict, expected_detail: str):
+        response = self.publish(publish_client, create_bundle(files))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["detail"].startswith(f"Invalid template bundle: {expected_detail}")
+
+    def test_publish_invalid_archive(self, publish_client: TestClient):
+        response = self.publish(publish_client, io.BytesIO(b"not an archive"))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["detail"] == "Invalid template bundle: The bundle is not a valid zip or tar archive"
+
+
+class TestTemplateChangeListener:
+    def test_notifications_from_other_nodes(self, db: Session):
+        changes = []
+        changed = threading.Event()
+
+        def on_change(template_id, updated_at):
+            changes.append((template_id, updated_at))
+            if template_id == "updated":
+                changed.set()
+
+        database_uri = db.get_bind().url.render_as_string(hide_password=False)
+        listener = TemplateChangeListener(database_uri, on_change)
+        listener.start()
+        try:
+            # give the listener time to connect before notifying
+            changed.wait(1)
+            # notifications are delivered in order, so the malformed ones and the one sent by this node are handled
+            # first
+            payloads = ["not json", json.dumps({"template_id": "no_node_id"}), json.dumps(["not", "an", "object"]),
+                        json.dumps({"template_id": "bad_update", "node_id": "other_node", "updated_at": "soon"}),
+                        *(json.dumps({"template_id": node_id, "node_id": node_id})
+                          for node_id in (NODE_ID, "other_node")),
+                        json.dumps({"template_id": "updated", "node_id": "other_node", "updated_at": 1.5})]
+            for payload in payloads:
+                db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                           {"channel": TEMPLATE_CHANGED_CHANNEL, "payload": payload})
+                db.commit()
+            assert changed.wait(5)
+        finally:
+            listener.stop()
+
+        assert changes == [("other_node", None), ("updated", 1.5)]
@@ -0,0 +1,176 @@
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+import httpx
+import pytest
+
+from app.compose.render_pool import RenderPool, RenderPriorityEnum
+from app.metrics import RENDER_RECYCLES
+from benchmarks.templates import CERTIFICATE
+from tests.test_preload import metric_value
+
+
+def test_recycle_after_max_renders():
+    recycles = []
+    pool = RenderPool(2, max_renders=3, on_recycle=recycles.append)
+    recycled_before = RENDER_RECYCLES.value(reason="renders")
+
+    assert [pool.run(pow, 2, exponent) for exponent in range(5)] == [1, 2, 4, 8, 16]
+    pool.shutdown()
+
+    assert recycles == ["renders"]
+    assert RENDER_RECYCLES.value(reason="renders") == recycled_before + 1
+
+
+def test_recycle_jitter():
+    pool = RenderPool(1, max_renders=3, max_renders_jitter=2)
+    pool.run(pow, 2, 1)
+    pool.shutdown()
+
+    assert 3 <= pool._render_limit <= 5
+
+
+def test_recycle_above_max_rss():
+    recycles = []
+    pool = RenderPool(1, max_rss_bytes=1, on_recycle=recycles.append)
+
+    pool.run(pow, 2, 1)
+    pool.run(pow, 2, 2)
+    pool.shutdown()
+
+    assert recycles == ["memory"]
+
+
+def block_workers(pool: RenderPool) -> threading.Event:
+    """
+    Occupies every worker of the pool until the returned event is set.
+    """
+    release = threading.Event()
+    started = threading.Barrier(pool.workers + 1)
+
+    def block() -> None:
+        started.wait()
+        release.wait()
+
+    for _ in range(pool.workers):
+        pool.submit(block)
+    started.wait()
+    return release
+
+
+def run_in_order(pool: RenderPool, renders: List[dict]) -> List[str]:
+    """
+    Queues the renders while the workers are busy, returning the names of the renders in the order they ran.
+    """
+    order = []
+    release = block_workers(pool)
+    futures = [pool.submit(order.append, render["name"], priority=render.get("priority", RenderPriorityEnum.BULK),
+                           flow=render.get("flow")) for render in renders]
+    release.set()
+    for future in futures:
+        future.result()
+    pool.shutdown()
+    return order
+
+
+def test_priority_classes():
+    pool = RenderPool(1)
+    order = run_in_order(pool, [{"name": "bulk_1"},
+                                {"name": "background", "priority": RenderPriorityEnum.BACKGROUND},
+                                {"name": "bulk_2"},
+                                {"name": "interactive", "priority": RenderPriorityEnum.INTERACTIVE}])
+    assert order == ["interactive", "bulk_1", "bulk_2", "background"]
+
+
+@pytest.mark.parametrize("flow_weights, expected_order", [
+    ({}, ["a1", "b1", "a2", "b2", "a3", "a4"]),
+    ({"b": 2}, ["b1", "a1", "b2", "a2", "a3", "a4"]),
+])
+def test_fair_queuing_across_flows(flow_weights: dict, expected_order: List[str]):
+    pool = RenderPool(1, flow_weights=flow_weights)
+    renders = [{"name": f"a{i}", "flow": "a"} for i in range(1, 5)] + [{"name": f"b{i}", "flow": "b"} for i in (1, 2)]
+    assert run_in_order(pool, renders) == expected_order
+
+
+def test_reserved_workers_only_run_interactive_renders():
+    pool = RenderPool(2, reserved_workers=1)
+    release = threading.Event()
+    bulk_renders = [pool.submit(release.wait, priority=RenderPriorityEnum.BULK) for _ in range(2)]
+    deadline = time.monotonic() + 5
+    while pool.queued > 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    # the second bulk render waits for the first one, while interactive renders run on the reserved worker
+    assert pool.run(pow, 2, 3, priority=RenderPriorityEnum.INTERACTIVE) == 8
+    assert pool.queued == 1
+    release.set()
+    assert [render.result() for render in bulk_renders] == [True, True]
+    pool.shutdown()
+
+
+def test_shutdown_without_waiting_cancels_queued_renders():
+    pool = RenderPool(1)
+    release = block_workers(pool)
+    queued_render = pool.submit(pow, 2, 3)
+
+    pool.shutdown(wait=False)
+    release.set()
+    assert queued_render.cancelled()
+    assert pool.run(pow, 2, 3) == 8
+    pool.shutdown()
+
+
+def test_workers_of_a_shut_down_pool_leave_once_it_restarts():
+    pool = RenderPool(1)
+    release_old = block_workers(pool)
+    old_workers = pool._threads
+    pool.shutdown(wait=False)
+
+    release_new = block_workers(pool)
+    queued_render = pool.submit(pow, 2, 3)
+    release_old.set()
+    for worker in old_workers:
+        worker.join(5)
+        assert not worker.is_alive()
+    # the render waits for the only worker of the restarted pool, instead of being run by the old one
+    assert not queued_render.done()
+
+    release_new.set()
+    assert queued_render.result(5) == 8
+    pool.shutdown()
+
+
+def worker_pids(server) -> list:
+    return Path(f"/proc/{server.pid}/task/{server.pid}/children").read_text().split()
+
+
+def test_recycled_worker_process_is_replaced(gunicorn_server, db, tmp_path: Path):
+    CERTIFICATE.install(tmp_path / "templates")
+    db.merge(CERTIFICATE.model())
+    db.commit()
+
+    try:
+        with gunicorn_server(1, RENDER_MAX_RENDERS="2") as (server, base_url), httpx.Client(base_url=base_url) as client:
+            first_worker_pids = worker_pids(server)
+            responses = []
+            for _ in range(4):
+                responses.append(client.post(f"/template/{CERTIFICATE.template_id}/compose",
+                                             json=CERTIFICATE.example_composition,
+                                             headers={"custom-accept": "text/html"}))
+            # the replaced worker drained its in-flight render before exiting
+            assert [response.status_code for response in responses] == [200] * 4
+
+            deadline = time.monotonic() + 30
+            while worker_pids(server) in ([], first_worker_pids):
+                assert time.monotonic() < deadline
+                time.sleep(0.2)
+
+            # the recycle is reported by the replacement worker
+            metrics = client.get("/metrics").text
+            assert metric_value(metrics, 'plato_render_recycles_total{reason="renders"}') >= 1
+    finally:
+        db.delete(db.merge(CERTIFICATE.model()))
+        db.commit()
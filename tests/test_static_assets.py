@@ -0,0 +1,52 @@
+import os
+import pathlib
+from tempfile import TemporaryDirectory
+
+from app.compose.static_assets import StaticAssetCache
+
+
+class TestStaticAssetCache:
+    def test_identical_files_are_cached_once(self):
+        cache = StaticAssetCache(max_bytes=1024)
+
+        with TemporaryDirectory() as temp:
+            font_0 = pathlib.Path(temp, "0", "font.ttf")
+            font_1 = pathlib.Path(temp, "1", "font.ttf")
+            for font in (font_0, font_1):
+                font.parent.mkdir()
+                font.write_bytes(b"font content")
+
+            assert cache.get(str(font_0)) is cache.get(str(font_1))
+            assert cache._size == len(b"font content")
+
+            fetched = cache.fetch(font_0.as_uri())
+            assert fetched["string"] == b"font content"
+            assert fetched["mime_type"] == "font/ttf"
+
+    def test_changed_file_is_reloaded(self):
+        cache = StaticAssetCache(max_bytes=1024)
+
+        with TemporaryDirectory() as temp:
+            logo = pathlib.Path(temp, "logo.png")
+            logo.write_bytes(b"old logo")
+            assert cache.get(str(logo)) == b"old logo"
+
+            logo.write_bytes(b"new logo!")
+            os.utime(logo, ns=(0, 0))
+            assert cache.get(str(logo)) == b"new logo!"
+
+            cache.invalidate(str(logo))
+            assert cache._size == len(b"old logo")
+
+    def test_least_recently_used_assets_are_evicted(self):
+        cache = StaticAssetCache(max_bytes=10)
+
+        with TemporaryDirectory() as temp:
+            first, second = pathlib.Path(temp, "first"), pathlib.Path(temp, "second")
+            first.write_bytes(b"123456")
+            second.write_bytes(b"abcdef")
+
+            cache.get(str(first))
+            cache.get(str(second))
+            assert cache._size == 6
+            assert list(cache._contents.values()) == [b"abcdef"]
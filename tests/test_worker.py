@@ -0,0 +1,231 @@
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List
+
+import httpx
+import pytest
+from jinja2 import DictLoader, Environment as JinjaEnv
+from jsonschema import ValidationError
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.datastructures import State
+
+from app.compose.job_queue import PostgresJobQueue, RenderJobFailed, RenderJobTimeout
+from app.compose.render_pool import RenderPriorityEnum
+from app.models.render_job import RenderJob
+from app.models.template import Template
+from app.schemas.template_detail import MIMETypeEnum
+from app.worker import RenderWorker
+from benchmarks.templates import CERTIFICATE
+from loadtest.environment import PROJECT_DIRECTORY, server_environment
+
+TEMPLATE_ID = "worker_template"
+HTML_MIME = MIMETypeEnum.HTML_MIME.value
+
+
+@pytest.fixture
+def template(db: Session) -> Iterator[Template]:
+    template = Template(id_=TEMPLATE_ID, schema={"type": "object", "required": ["name"]}, type_=HTML_MIME,
+                        metadata={}, example_composition={"name": "example"}, tags=[])
+    db.merge(template)
+    db.commit()
+    yield template
+    db.query(Template).filter_by(id=TEMPLATE_ID).delete()
+    db.commit()
+
+
+@pytest.fixture
+def queue_factory(db: Session) -> Iterator:
+    def create_queue(**options) -> PostgresJobQueue:
+        return PostgresJobQueue(sessionmaker(bind=db.get_bind()), **{
+            "timeout_seconds": 30, "lease_seconds": 30, "max_attempts": 2, "poll_interval": 0.05, **options})
+
+    yield create_queue
+    db.query(RenderJob).delete()
+    db.commit()
+
+
+def worker_state(render_seconds: float = 0) -> State:
+    state = State()
+    state.jinja_env = JinjaEnv(loader=DictLoader({f"{TEMPLATE_ID}/{TEMPLATE_ID}": "<p>{{ p.name | slow }}</p>"}))
+    state.jinja_env.filters["slow"] = lambda value: time.sleep(render_seconds) or value
+    state.template_static_directory = ""
+    return state
+
+
+@contextmanager
+def running_workers(queue: PostgresJobQueue, workers: int, render_seconds: float = 0) -> Iterator[List[RenderWorker]]:
+    render_workers = [RenderWorker(queue, worker_state(render_seconds), consumers=1, worker_id=f"worker-{i}")
+                      for i in range(workers)]
+    for render_worker in render_workers:
+        render_worker.start()
+    try:
+        yield render_workers
+    finally:
+        for render_worker in render_workers:
+            render_worker.stop()
+
+
+@pytest.mark.usefixtures("template")
+def test_jobs_are_shared_by_several_workers(queue_factory):
+    queue = queue_factory()
+    claims = Counter()
+    claim = queue.claim
+
+    def counting_claim(worker_id: str):
+        job = claim(worker_id)
+        if job is not None:
+            claims[worker_id.split("/")[0]] += 1
+        return job
+
+    queue.claim = counting_claim
+    names = [f"name {i}" for i in range(12)]
+    with running_workers(queue, workers=3, render_seconds=0.05), ThreadPoolExecutor(len(names)) as executor:
+        results = list(executor.map(lambda name: queue.run(TEMPLATE_ID, {"name": name}, HTML_MIME, {}), names))
+
+    assert results == [f"<p>{name}</p>".encode() for name in names]
+    assert set(claims) == {"worker-0", "worker-1", "worker-2"}
+    assert sum(claims.values()) == len(names)
+
+
+@pytest.mark.usefixtures("template")
+def test_render_errors_are_raised_by_the_api(queue_factory):
+    queue = queue_factory()
+    with running_workers(queue, workers=1):
+        with pytest.raises(ValidationError):
+            queue.run(TEMPLATE_ID, {}, HTML_MIME, {})
+        with pytest.raises(RenderJobFailed, match="not found"):
+            queue.run("missing_template", {}, HTML_MIME, {})
+
+
+def test_jobs_are_claimed_by_priority_then_age(queue_factory):
+    queue = queue_factory()
+    background = queue.enqueue(TEMPLATE_ID, {}, HTML_MIME, {}, RenderPriorityEnum.BACKGROUND)
+    first_bulk = queue.enqueue(TEMPLATE_ID, {}, HTML_MIME, {}, RenderPriorityEnum.BULK)
+    second_bulk = queue.enqueue(TEMPLATE_ID, {}, HTML_MIME, {}, RenderPriorityEnum.BULK)
+    interactive = queue.enqueue(TEMPLATE_ID, {}, HTML_MIME, {}, RenderPriorityEnum.INTERACTIVE)
+
+    claimed = [queue.claim("worker") for _ in range(5)]
+    assert [job and job.id for job in claimed] == [interactive, first_bulk, second_bulk, background, None]
+    assert claimed[0].priority == RenderPriorityEnum.INTERACTIVE
+
+
+def test_abandoned_jobs_are_claimed_again_until_max_attempts(queue_factory):
+    # every claim expires right away, as if its worker died
+    queue = queue_factory(lease_seconds=0)
+    job_id = queue.enqueue(TEMPLATE_ID, {}, HTML_MIME, {}, RenderPriorityEnum.INTERACTIVE)
+
+    assert queue.claim("worker-0").attempts == 1
+    assert queue.claim("worker-1").attempts == 2
+    assert queue.result(job_id) is None
+
+    assert queue.claim("worker-2") is None
+    assert "abandoned" in queue.result(job_id).error["message"]
+
+
+def test_late_results_are_ignored(queue_factory):
+    queue = queue_factory(lease_seconds=0)
+    job_id = queue.enqueue(TEMPLATE_ID, {}, HTML_MIME, {}, RenderPriorityEnum.INTERACTIVE)
+    queue.claim("worker-0")
+    queue.claim("worker-1")
+
+    queue.complete(job_id, b"first")
+    queue.complete(job_id, b"second")
+    assert queue.result(job_id).content == b"first"
+
+
+@pytest.mark.usefixtures("template")
+def test_leases_are_renewed_while_rendering(queue_factory):
+    # renders take several leases, but the job stays with the worker rendering it
+    queue = queue_factory(lease_seconds=0.3)
+    claims = []
+    claim = queue.claim
+
+    def recording_claim(worker_id: str):
+        job = claim(worker_id)
+        if job is not None:
+            claims.append(worker_id)
+        return job
+
+    queue.claim = recording_claim
+    with running_workers(queue, workers=2, render_seconds=1):
+        assert queue.run(TEMPLATE_ID, {"name": "slow"}, HTML_MIME, {}) == b"<p>slow</p>"
+    assert len(claims) == 1
+
+
+def test_only_the_leasing_worker_renews_a_job(queue_factory):
+    queue = queue_factory()
+    job_id = queue.enqueue(TEMPLATE_ID, {}, HTML_MIME, {}, RenderPriorityEnum.INTERACTIVE)
+    queue.claim("worker-0")
+
+    assert queue.renew(job_id, "worker-0")
+    assert not queue.renew(job_id, "worker-1")
+    queue.complete(job_id, b"done")
+    assert not queue.renew(job_id, "worker-0")
+
+
+def test_timed_out_jobs_are_discarded(queue_factory, db: Session):
+    queue = queue_factory(timeout_seconds=0.2)
+    with pytest.raises(RenderJobTimeout):
+        queue.run(TEMPLATE_ID, {}, HTML_MIME, {})
+    assert db.query(RenderJob).count() == 0
+
+
+def test_purge_forgets_finished_jobs(queue_factory, db: Session):
+    queue = queue_factory()
+    done = queue.enqueue(TEMPLATE_ID, {}, HTML_MIME, {}, RenderPriorityEnum.INTERACTIVE)
+    queued = queue.enqueue(TEMPLATE_ID, {}, HTML_MIME, {}, RenderPriorityEnum.INTERACTIVE)
+    queue.claim("worker")
+    queue.complete(done, b"done")
+
+    assert queue.purge(older_than_seconds=3600) == 0
+    assert queue.purge(older_than_seconds=0) == 1
+    assert [job_id for job_id, in db.query(RenderJob.id)] == [queued]
+
+
+def test_render_farm(gunicorn_server, db: Session, tmp_path: Path):
+    CERTIFICATE.install(tmp_path / "templates")
+    db.merge(CERTIFICATE.model())
+    db.commit()
+
+    env = {**server_environment(db.get_bind().url.render_as_string(hide_password=False), tmp_path, render_workers=1),
+           "RENDER_JOB_POLL_INTERVAL": "0.05"}
+    log_paths = [tmp_path / f"worker-{i}.log" for i in range(2)]
+    workers = []
+    try:
+        for log_path in log_paths:
+            with open(log_path, mode="wb") as log_file:
+                workers.append(subprocess.Popen([sys.executable, "-m", "app.worker"], cwd=PROJECT_DIRECTORY, env=env,
+                                                stdout=log_file, stderr=subprocess.STDOUT))
+        deadline = time.monotonic() + 120
+        while not all("Render worker" in log_path.read_text() for log_path in log_paths):
+            assert all(worker.poll() is None for worker in workers) and time.monotonic() < deadline, \
+                "\n".join(log_path.read_text() for log_path in log_paths)
+            time.sleep(0.5)
+
+        with gunicorn_server(1, RENDER_FARM="true", RENDER_JOB_POLL_INTERVAL="0.05") as (_, base_url), \
+                httpx.Client(base_url=base_url) as client:
+            def compose(_) -> httpx.Response:
+                return client.post(f"/template/{CERTIFICATE.template_id}/compose",
+                                   json=CERTIFICATE.example_composition, headers={"custom-accept": HTML_MIME})
+
+            with ThreadPoolExecutor(4) as executor:
+                responses = list(executor.map(compose, range(8)))
+            metrics = client.get("/metrics").text
+        assert [response.status_code for response in responses] == [200] * 8
+        assert len({response.content for response in responses}) == 1
+        assert 'plato_render_jobs_total{outcome="done"} 8' in metrics
+
+        # workers finish their jobs and exit when stopped
+        for worker in workers:
+            worker.terminate()
+        assert [worker.wait(timeout=30) for worker in workers] == [0, 0]
+    finally:
+        for worker in workers:
+            worker.kill()
+        db.delete(db.merge(CERTIFICATE.model()))
+        db.commit()